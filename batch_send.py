@@ -0,0 +1,147 @@
+import argparse
+import socket
+import sys
+import time
+
+
+# Send a file of commands to the robot, one line at a time. Rather than
+# waiting a fixed time between lines, we wait for the robot's prompt,
+# which it sends as soon as it has finished each command. Commands which
+# do not move the robot can optionally be sent without waiting (pipelined),
+# since the robot runs them in order anyway. At the end we print how long
+# each command took and the total.
+
+DEFAULT_PORT = 40801
+PROMPT = b"Ron is ready> "
+
+# Commands which only report or change settings, never move the robot
+PIPELINE_SAFE = ["bright", "blink", "colour", "coverage", "distance", "echo", "hello",
+                 "help", "honk", "light", "lights", "sensors", "status", "temp", "where"]
+
+
+def connect_to_robot(robot_address, robot_port):
+   try:
+      client_socket = socket.create_connection((robot_address, robot_port), timeout=10)
+   except OSError as error:
+      print("Unable to connect to", robot_address, ":", error)
+      return False
+   # Commands such as "square 3" can take a long time
+   client_socket.settimeout(None)
+   return client_socket
+
+
+def read_commands(file_name):
+   commands = []
+   with open(file_name, "r") as my_file:
+      for line in my_file:
+         line = line.strip()
+         if line and line[0] != "#":
+            commands.append(line)
+   return commands
+
+
+class RobotConnection:
+
+   def __init__(self, client_socket, show_replies):
+      self.socket = client_socket
+      self.show_replies = show_replies
+      self.received = b""
+      self.closed = False
+
+
+   # Wait for the next prompt and return everything before it. Returns
+   # None if the robot closed the connection first.
+   def wait_for_prompt(self):
+      while PROMPT not in self.received:
+         data = b""
+         if not self.closed:
+            data = self.socket.recv(4096)
+         if not data:
+            self.closed = True
+            reply = self.received
+            self.received = b""
+            self.show(reply)
+            return None
+         self.received += data
+      reply, self.received = self.received.split(PROMPT, 1)
+      self.show(reply)
+      return reply
+
+
+   def show(self, reply):
+      if self.show_replies and reply:
+         sys.stdout.write(reply.decode(errors="replace"))
+         sys.stdout.flush()
+
+
+   def send(self, command):
+      self.socket.sendall((command + "\n").encode())
+
+
+
+def send_batch(connection, commands, pipeline):
+   timings = []
+   # Commands sent which we have not had a prompt back for yet,
+   # as (command, time sent)
+   waiting = []
+   for command in commands:
+      name = command.split()[0].lower()
+      can_pipeline = pipeline and name in PIPELINE_SAFE
+      if not can_pipeline:
+         # Let everything before this finish first
+         while waiting:
+            finish_command(connection, waiting, timings)
+      connection.send(command)
+      waiting.append( (command, time.perf_counter()) )
+      if name == "exit":
+         break
+      if not can_pipeline:
+         finish_command(connection, waiting, timings)
+   while waiting and not connection.closed:
+      finish_command(connection, waiting, timings)
+   return timings
+
+
+def finish_command(connection, waiting, timings):
+   command, sent_time = waiting.pop(0)
+   connection.wait_for_prompt()
+   timings.append( (command, time.perf_counter() - sent_time) )
+
+
+def main():
+   parser = argparse.ArgumentParser(description="Send a file of commands to the robot.")
+   parser.add_argument("address", help="robot hostname or IP address")
+   parser.add_argument("file_name", help="file with one command per line")
+   parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+   parser.add_argument("--pipeline", action="store_true",
+                       help="send commands which do not move the robot without waiting")
+   parser.add_argument("-q", "--quiet", action="store_true", help="do not print the replies")
+   arguments = parser.parse_args()
+
+   try:
+      commands = read_commands(arguments.file_name)
+   except OSError:
+      print("File", arguments.file_name, "not found.")
+      sys.exit(2)
+
+   client_socket = connect_to_robot(arguments.address, arguments.port)
+   if not client_socket:
+      sys.exit(1)
+
+   start_time = time.perf_counter()
+   connection = RobotConnection(client_socket, not arguments.quiet)
+   # The greeting ends with the first prompt
+   connection.wait_for_prompt()
+   timings = send_batch(connection, commands, arguments.pipeline)
+   total_time = time.perf_counter() - start_time
+   client_socket.close()
+
+   print("")
+   print("Command timings:")
+   for command, taken in timings:
+      print("%8.3f s  %s" % (taken, command))
+   print("Total: %.3f s for %d commands" % (total_time, len(timings)))
+
+
+if __name__ == "__main__":
+   main()
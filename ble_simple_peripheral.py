@@ -45,6 +45,7 @@ class BLESimplePeripheral:
         ((self._handle_tx, self._handle_rx),) = self._ble.gatts_register_services((_UART_SERVICE,))
         self._connections = set()
         self._write_callback = None
+        self._connection_callback = None
         self._payload = advertising_payload(name=name, services=[_UART_UUID])
         self._advertise()
 
@@ -54,10 +55,14 @@ class BLESimplePeripheral:
             conn_handle, _, _ = data
             print("New connection", conn_handle)
             self._connections.add(conn_handle)
+            if self._connection_callback:
+                self._connection_callback(True, conn_handle)
         elif event == _IRQ_CENTRAL_DISCONNECT:
             conn_handle, _, _ = data
             print("Disconnected", conn_handle)
             self._connections.remove(conn_handle)
+            if self._connection_callback:
+                self._connection_callback(False, conn_handle)
             # Start advertising again to allow a new connection.
             self._advertise()
         elif event == _IRQ_GATTS_WRITE:
@@ -80,6 +85,11 @@ class BLESimplePeripheral:
     def on_write(self, callback):
         self._write_callback = callback
 
+    # callback(connected, conn_handle) is called when a central
+    # connects or disconnects
+    def on_connection(self, callback):
+        self._connection_callback = callback
+
 
 def demo():
     ble = bluetooth.BLE()
@@ -0,0 +1,151 @@
+import os
+
+# Calibration values the robot uses to balance its motors and time its turns.
+# The values live in a small text file on the Pico's flash so they survive
+# a reboot. The file has one "name=value" pair per line, for example:
+# left_motor_adjust=1.1
+# right_turn_modifier=0.7
+# Names which are not in the file fall back to the defaults the Robot provides.
+# A value can also be a table of number pairs, such as a motor speed and the
+# turn rate measured at that speed. Tables are saved as a comma separated list:
+# left_turn_rates=40:180.5,60:265.0,80:340.2
+
+CALIBRATION_FILE = "calibration.txt"
+
+
+class Calibration:
+
+   def __init__(self, defaults, file_name=CALIBRATION_FILE):
+       self.file_name = file_name
+       self.defaults = defaults
+       self.values = {}
+       for name in defaults:
+           self.values[name] = defaults[name]
+
+
+   def is_table(self, name):
+       return type(self.defaults[name]) is list
+
+
+   # Read saved values from flash. Unknown names and values we cannot
+   # convert are ignored so a damaged file never stops the robot booting.
+   def load(self):
+       try:
+           my_file = open(self.file_name, "r")
+       except OSError:
+           return False
+
+       for line in my_file:
+           line = line.strip()
+           if not line or line[0] == "#" or "=" not in line:
+               continue
+           name, value = line.split("=", 1)
+           name = name.strip()
+           if name not in self.defaults:
+               continue
+           try:
+               if self.is_table(name):
+                   self.values[name] = table_from_text(value)
+               else:
+                   self.values[name] = float(value)
+           except ValueError:
+               pass
+       my_file.close()
+       return True
+
+
+   # Write the values to flash. We write a temporary file first and then
+   # rename it over the old one, so losing power part way through leaves
+   # either the old or the new file, never half of one.
+   def save(self):
+       temp_name = self.file_name + ".tmp"
+       try:
+           my_file = open(temp_name, "w")
+           for name in sorted(self.values):
+               if self.is_table(name):
+                   value = table_to_text(self.values[name])
+               else:
+                   value = str(self.values[name])
+               my_file.write(name + "=" + value + "\n")
+           my_file.close()
+           os.rename(temp_name, self.file_name)
+       except OSError:
+           return False
+       return True
+
+
+   def get(self, name):
+       return self.values[name]
+
+
+   def names(self):
+       return sorted(self.values)
+
+
+   # Change a value. Returns False if the name is not known or the file
+   # could not be written, though the new value is used either way. The
+   # file is only rewritten when the value actually changed.
+   def set(self, name, value):
+       if name not in self.defaults:
+           return False
+       if self.is_table(name):
+           value = sorted(value)
+       else:
+           value = float(value)
+       if self.values[name] == value:
+           return True
+       self.values[name] = value
+       return self.save()
+
+
+   # Put every value back to its default and save the result.
+   def restore_defaults(self):
+       changed = False
+       for name in self.defaults:
+           if self.values[name] != self.defaults[name]:
+               self.values[name] = self.defaults[name]
+               changed = True
+       if changed:
+           return self.save()
+       return True
+
+
+# Turn "40:180.5,60:265" into [(40.0, 180.5), (60.0, 265.0)]
+def table_from_text(text):
+   table = []
+   text = text.strip()
+   if not text:
+       return table
+   for pair in text.split(","):
+       key, value = pair.split(":")
+       table.append( (float(key), float(value)) )
+   table.sort()
+   return table
+
+
+def table_to_text(table):
+   pairs = []
+   for key, value in table:
+       pairs.append(str(key) + ":" + str(value))
+   return ",".join(pairs)
+
+
+# Look up a value in a table of (key, value) pairs, drawing a straight
+# line between the two nearest keys. Keys outside the table are
+# scaled from the nearest end, since turn rate grows with motor speed.
+def interpolate(table, key):
+   if not table:
+       return 0.0
+   if len(table) == 1 or key <= table[0][0]:
+       low_key, low_value = table[0]
+       if low_key <= 0:
+           return low_value
+       return low_value * key / low_key
+   for index in range(1, len(table)):
+       high_key, high_value = table[index]
+       if key <= high_key:
+           low_key, low_value = table[index - 1]
+           fraction = (key - low_key) / (high_key - low_key)
+           return low_value + (high_value - low_value) * fraction
+   high_key, high_value = table[-1]
+   return high_value * key / high_key
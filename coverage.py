@@ -0,0 +1,124 @@
+import array
+
+# Remember which parts of the floor the robot has already driven over,
+# one bit per map cell, and find the nearest part it has not visited yet.
+#
+# The coverage map uses the same cells as the occupancy map, so a cell
+# number means the same place in both. The search for the nearest
+# unvisited cell is a breadth-first search which only passes through
+# cells we have visited, and never into cells with an object in them.
+# Everything it needs is allocated up front.
+
+
+class CoverageMap:
+
+   def __init__(self, width, height):
+       self.width = width
+       self.height = height
+       self.visited = bytearray((width * height + 7) // 8)
+       self.visited_count = 0
+       # Working space for the search. A breadth-first search on a grid
+       # never holds more than two rings of cells, so this is plenty.
+       self.searched = bytearray(len(self.visited))
+       self.queue = array.array("H", bytes(2 * self.queue_size()))
+
+
+   def queue_size(self):
+       return min(self.width * self.height, 8 * (self.width + self.height))
+
+
+   def clear(self):
+       for index in range(len(self.visited)):
+           self.visited[index] = 0
+       self.visited_count = 0
+
+
+   def in_map(self, column, row):
+       return column >= 0 and column < self.width and row >= 0 and row < self.height
+
+
+   def is_visited(self, column, row):
+       if not self.in_map(column, row):
+           return False
+       index = row * self.width + column
+       return self.visited[index >> 3] & (1 << (index & 7)) != 0
+
+
+   # Mark the cell and every cell within "radius" cells of it visited
+   def mark(self, column, row, radius=0):
+       if column < -radius or column >= self.width + radius or \
+          row < -radius or row >= self.height + radius:
+           # Nowhere near the map
+           return
+       for mark_row in range(row - radius, row + radius + 1):
+           for mark_column in range(column - radius, column + radius + 1):
+               if not self.in_map(mark_column, mark_row):
+                   continue
+               index = mark_row * self.width + mark_column
+               bit = 1 << (index & 7)
+               if not self.visited[index >> 3] & bit:
+                   self.visited[index >> 3] |= bit
+                   self.visited_count += 1
+
+
+   # Find the closest cell (column, row) we have not visited, which we can
+   # reach without passing through an object in the occupancy map. Returns
+   # None when there is nowhere left to go.
+   def nearest_frontier(self, column, row, occupancy):
+       if not self.in_map(column, row):
+           return None
+       searched = self.searched
+       for index in range(len(searched)):
+           searched[index] = 0
+       queue = self.queue
+       size = len(queue)
+       width = self.width
+
+       start = row * width + column
+       searched[start >> 3] |= 1 << (start & 7)
+       queue[0] = start
+       head = 0
+       tail = 1
+       count = 1
+       while count > 0:
+           index = queue[head]
+           head = (head + 1) % size
+           count -= 1
+           cell_column = index % width
+           cell_row = index // width
+           # The first cell we reach which we have not visited is the
+           # nearest one. Everything before it was visited, so we only
+           # ever search through floor we have already driven over.
+           if index != start and not self.visited[index >> 3] & (1 << (index & 7)):
+               return (cell_column, cell_row)
+           for next_column, next_row in ((cell_column + 1, cell_row), (cell_column - 1, cell_row),
+                                         (cell_column, cell_row + 1), (cell_column, cell_row - 1)):
+               if not self.in_map(next_column, next_row):
+                   continue
+               if occupancy.is_occupied(next_column, next_row):
+                   continue
+               next_index = next_row * width + next_column
+               bit = 1 << (next_index & 7)
+               if searched[next_index >> 3] & bit:
+                   continue
+               if count >= size:
+                   continue
+               searched[next_index >> 3] |= bit
+               queue[tail] = next_index
+               tail = (tail + 1) % size
+               count += 1
+       return None
+
+
+   # How much of the floor we know about have we covered? Floor we know
+   # about is every cell we have visited plus every cell the occupancy
+   # map says is open. Returns a percentage.
+   def percent_covered(self, occupancy):
+       known = self.visited_count
+       for row in range(self.height):
+           for column in range(self.width):
+               if occupancy.is_free(column, row) and not self.is_visited(column, row):
+                   known += 1
+       if known == 0:
+           return 0.0
+       return 100.0 * self.visited_count / known
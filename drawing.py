@@ -0,0 +1,177 @@
+import math
+
+# Turn a description of a drawing into a list of moves for the robot.
+#
+# A drawing is a list of (pen, x, y) moves. The robot drives in a straight
+# line to (x, y) with the pen down if pen is True, up if pen is False, or
+# left where it is if pen is None. Positions are in steps and are relative
+# to where the robot is when it starts drawing: x is to its right and y is
+# straight ahead.
+#
+# Two text formats are understood:
+#
+# A polyline, a list of x,y points: "0,0 0,1 1,1 1,0 0,0". The robot moves
+# to the first point with the pen up, then draws through the others.
+#
+# A small part of the SVG path language: M/m (move to), L/l (line to),
+# H/h (horizontal line), V/v (vertical line) and Z/z (close the shape).
+# Upper case letters use absolute positions, lower case are relative to
+# the last point. For example "M 0 0 L 1 0 L 1 1 Z" draws a triangle.
+
+PATH_COMMANDS = "MmLlHhVvZz"
+# No point may be further than this many steps from the start, either
+# way, the most the other shape commands go
+MAX_POSITION = 10.0
+
+
+# A number from the drawing. float() also takes "nan" and "inf",
+# which the robot could never drive to.
+def parse_number(text):
+   value = float(text)
+   if not math.isfinite(value):
+       raise ValueError("Positions need to be ordinary numbers, not " + text)
+   return value
+
+
+# Returns a list of (pen, x, y) moves, or raises ValueError if the
+# text does not make sense.
+def parse_drawing(text):
+   text = text.strip()
+   if not text:
+       raise ValueError("Nothing to draw")
+   if text[0] in PATH_COMMANDS:
+       moves = parse_svg_path(text)
+   else:
+       moves = parse_polyline(text)
+   for pen, x, y in moves:
+       if abs(x) > MAX_POSITION or abs(y) > MAX_POSITION:
+           raise ValueError("Points need to be within " + str(MAX_POSITION) + " steps of the start")
+   return moves
+
+
+def parse_polyline(text):
+   moves = []
+   for point in text.replace(";", " ").split():
+       values = point.split(",")
+       if len(values) != 2:
+           raise ValueError("Points need to look like x,y")
+       x = parse_number(values[0])
+       y = parse_number(values[1])
+       moves.append( (len(moves) > 0, x, y) )
+   return moves
+
+
+# Split "M0,0L1 0l.5-1z" into ["M", "0", "0", "L", "1", "0", ...]
+def path_tokens(text):
+   tokens = []
+   number = ""
+   for character in text:
+       if character in PATH_COMMANDS:
+           if number:
+               tokens.append(number)
+               number = ""
+           tokens.append(character)
+       elif character in " ,\t\r\n":
+           if number:
+               tokens.append(number)
+               number = ""
+       elif character == "-" and number and number[-1] not in "eE":
+           tokens.append(number)
+           number = character
+       else:
+           number += character
+   if number:
+       tokens.append(number)
+   return tokens
+
+
+def parse_svg_path(text):
+   tokens = path_tokens(text)
+   moves = []
+   x = 0.0
+   y = 0.0
+   start_x = 0.0
+   start_y = 0.0
+   command = None
+   index = 0
+   while index < len(tokens):
+       token = tokens[index]
+       if token in PATH_COMMANDS:
+           command = token
+           index += 1
+           if command in "Zz":
+               moves.append( (True, start_x, start_y) )
+               x = start_x
+               y = start_y
+           continue
+       if command is None or command in "Zz":
+           raise ValueError("Expected a path command, found " + token)
+
+       if command in "MmLl":
+           if index + 1 >= len(tokens):
+               raise ValueError("A point needs an x and a y")
+           new_x = parse_number(tokens[index])
+           new_y = parse_number(tokens[index + 1])
+           index += 2
+           if command in "ml":
+               new_x += x
+               new_y += y
+           x = new_x
+           y = new_y
+           if command in "Mm":
+               moves.append( (False, x, y) )
+               start_x = x
+               start_y = y
+               # Further points after a move are lines, as in SVG
+               if command == "M":
+                   command = "L"
+               else:
+                   command = "l"
+           else:
+               moves.append( (True, x, y) )
+       elif command in "Hh":
+           value = parse_number(token)
+           index += 1
+           if command == "h":
+               value += x
+           x = value
+           moves.append( (True, x, y) )
+       elif command in "Vv":
+           value = parse_number(token)
+           index += 1
+           if command == "v":
+               value += y
+           y = value
+           moves.append( (True, x, y) )
+   if not moves:
+       raise ValueError("Nothing to draw")
+   return moves
+
+
+# The moves for a regular polygon, drawn the way the robot always has:
+# drive forward, turn right, and so on, ending where we started.
+# The pen is left where it is.
+def polygon(sides, side_length, first_turn=0.0):
+   moves = []
+   x = 0.0
+   y = 0.0
+   direction = first_turn
+   for side in range(sides):
+       rads = math.radians(direction)
+       x += side_length * math.sin(rads)
+       y += side_length * math.cos(rads)
+       moves.append( (None, x, y) )
+       direction += 360.0 / sides
+   return moves
+
+
+# Total length of the lines in a drawing, in steps
+def drawing_length(moves):
+   x = 0.0
+   y = 0.0
+   length = 0.0
+   for pen, next_x, next_y in moves:
+       length += math.sqrt((next_x - x) ** 2 + (next_y - y) ** 2)
+       x = next_x
+       y = next_y
+   return length
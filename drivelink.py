@@ -0,0 +1,291 @@
+import socket
+import struct
+import time
+import _thread
+
+# Drive the robot over UDP, for joysticks.
+#
+# Over TCP a lost packet holds up every packet after it until it has
+# been sent again, but a joystick only cares about where the stick is
+# now. So drive setpoints can also be sent as UDP packets to DRIVE_PORT:
+#
+#   magic b"RD", sequence number, left speed, right speed
+#
+# The speeds are -100 to 100. Each packet carries a sequence number one
+# higher than the last, and any packet which is not newer than the last
+# one we used arrived late and is thrown away. A client should send the
+# stick position every SEND_MS or so, even when it has not changed: if
+# nothing arrives for SILENCE_MS while the wheels are turning, the robot
+# stops by itself.
+#
+# Every BEACON_MS the robot broadcasts a beacon to BEACON_PORT saying
+# which ports it listens on, so clients can find it without needing its
+# hostname. The update loop calls poll() and beacon() on every tick.
+
+DRIVE_PORT = 40802
+BEACON_PORT = 40803
+DRIVE_FORMAT = "<2sIbb"
+DRIVE_MAGIC = b"RD"
+DRIVE_SIZE = struct.calcsize(DRIVE_FORMAT)
+# magic, version, command (TCP) port, drive port
+BEACON_FORMAT = "<2sBHH"
+BEACON_MAGIC = b"RB"
+BEACON_VERSION = 1
+
+BEACON_MS = 2000
+# Clients send this often
+SEND_MS = 100
+# Stop if nothing arrives for this long
+SILENCE_MS = 500
+# After this long without packets a client can start its numbers again
+RESYNC_MS = 5000
+
+
+# The address to broadcast to on our network, from our address and
+# the netmask, both as text
+def broadcast_address(address, netmask):
+   try:
+       address_parts = [int(part) for part in address.split(".")]
+       mask_parts = [int(part) for part in netmask.split(".")]
+   except (AttributeError, ValueError):
+       return "255.255.255.255"
+   if len(address_parts) != 4 or len(mask_parts) != 4:
+       return "255.255.255.255"
+   parts = []
+   for index in range(4):
+       parts.append(str((address_parts[index] | ~mask_parts[index]) & 0xFF))
+   return ".".join(parts)
+
+
+# Is sequence newer than last, allowing for the numbers wrapping round?
+def is_newer(sequence, last):
+   difference = (sequence - last) & 0xFFFFFFFF
+   return difference != 0 and difference < 0x80000000
+
+
+class DriveLink:
+
+   def __init__(self):
+       self.drive_socket = None
+       self.beacon_socket = None
+       # poll() runs in the update thread, start() and stop() in the
+       # network thread
+       self.lock = _thread.allocate_lock()
+       self.beacon = b""
+       self.beacon_to = None
+       self.next_beacon = 0
+       self.sender = None
+       self.last_sequence = 0
+       self.last_packet = 0
+       # Are the wheels turning because of us?
+       self.driving = False
+       # After a stop the stick has to be pushed and let go again before
+       # the robot may drive. stop_sequence is the last packet before it.
+       self.stop_pending = False
+       self.stop_sender = None
+       self.stop_sequence = 0
+       self.held_since_stop = False
+       self.released = False
+       self.received = 0
+       self.late = 0
+       self.bad = 0
+       self.silence_stops = 0
+
+
+   def is_running(self):
+       return self.drive_socket is not None
+
+
+   # Listen for drive packets and start sending beacons. address and
+   # netmask are ours, command_port is where we take TCP commands.
+   # Returns False if the sockets cannot be set up.
+   def start(self, address, netmask, command_port):
+       with self.lock:
+           self.close()
+           try:
+               self.drive_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+               self.drive_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+               self.drive_socket.bind( ("0.0.0.0", DRIVE_PORT) )
+               self.drive_socket.setblocking(False)
+               self.beacon_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+               try:
+                   self.beacon_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+               except (AttributeError, OSError):
+                   # Some ports allow broadcasts without being asked
+                   pass
+           except OSError:
+               self.close()
+               return False
+           self.beacon = struct.pack(BEACON_FORMAT, BEACON_MAGIC, BEACON_VERSION,
+                                     command_port, DRIVE_PORT)
+           self.beacon_to = (broadcast_address(address, netmask), BEACON_PORT)
+           self.next_beacon = time.ticks_ms()
+           self.sender = None
+           return True
+
+
+   # Stop listening. Returns True if the robot was being driven, so
+   # the caller can stop it.
+   def stop(self):
+       with self.lock:
+           was_driving = self.driving
+           self.close()
+           return was_driving
+
+
+   def close(self):
+       for open_socket in (self.drive_socket, self.beacon_socket):
+           if open_socket is not None:
+               try:
+                   open_socket.close()
+               except OSError:
+                   pass
+       self.drive_socket = None
+       self.beacon_socket = None
+       self.driving = False
+
+
+   # Read the packets which have arrived. Returns the newest
+   # (left, right) setpoint, or None if there is nothing new.
+   def poll(self, now):
+       if self.drive_socket is None:
+           return None
+       setpoint = None
+       with self.lock:
+           while self.drive_socket is not None:
+               try:
+                   packet, sender = self.drive_socket.recvfrom(DRIVE_SIZE + 1)
+               except OSError:
+                   # Nothing more waiting
+                   break
+               if len(packet) != DRIVE_SIZE:
+                   self.bad += 1
+                   continue
+               magic, sequence, left, right = struct.unpack(DRIVE_FORMAT, packet)
+               if magic != DRIVE_MAGIC:
+                   self.bad += 1
+                   continue
+               # A new client, or one which went quiet, starts afresh
+               if sender != self.sender or time.ticks_diff(now, self.last_packet) > RESYNC_MS:
+                   self.sender = sender
+               elif not is_newer(sequence, self.last_sequence):
+                   self.late += 1
+                   continue
+               self.last_sequence = sequence
+               self.last_packet = now
+               self.received += 1
+               setpoint = (left, right)
+               if self.stop_pending:
+                   self.watch_release(sender, sequence, left, right)
+           if setpoint is not None:
+               self.driving = setpoint[0] != 0 or setpoint[1] != 0
+       return setpoint
+
+
+   # The robot has been stopped. It stays stopped until the stick is let
+   # go in a packet sent after the stop, so zeros from a stick which was
+   # never touched do not undo it.
+   def note_stop(self):
+       with self.lock:
+           self.stop_pending = True
+           self.stop_sender = self.sender
+           self.stop_sequence = self.last_sequence
+           self.held_since_stop = False
+           self.released = False
+
+
+   def watch_release(self, sender, sequence, left, right):
+       if sender == self.stop_sender and not is_newer(sequence, self.stop_sequence):
+           # Sent before the stop
+           return
+       if left != 0 or right != 0:
+           self.held_since_stop = True
+       elif self.held_since_stop:
+           self.stop_pending = False
+           self.released = True
+
+
+   # Has the stick been let go since the last stop? Only says so once.
+   def stop_released(self):
+       with self.lock:
+           released = self.released
+           self.released = False
+           return released
+
+
+   # Has the client gone quiet while the wheels are turning? If so we
+   # stop driving, and the caller should stop the robot.
+   def is_silent(self, now):
+       if not self.driving or time.ticks_diff(now, self.last_packet) <= SILENCE_MS:
+           return False
+       self.driving = False
+       self.silence_stops += 1
+       return True
+
+
+   # Send the beacon if it is time
+   def send_beacon(self, now):
+       if self.beacon_socket is None or time.ticks_diff(now, self.next_beacon) < 0:
+           return
+       self.next_beacon = time.ticks_add(now, BEACON_MS)
+       with self.lock:
+           if self.beacon_socket is None:
+               return
+           try:
+               self.beacon_socket.sendto(self.beacon, self.beacon_to)
+           except OSError:
+               pass
+
+
+
+# On a computer: wait for a robot's beacon. Returns (address,
+# command_port, drive_port), or None if none was heard within timeout
+# seconds.
+def find_robot(timeout=5):
+   listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+   listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+   listener.bind( ("", BEACON_PORT) )
+   listener.settimeout(timeout)
+   try:
+       while True:
+           packet, sender = listener.recvfrom(64)
+           if len(packet) != struct.calcsize(BEACON_FORMAT):
+               continue
+           magic, version, command_port, drive_port = struct.unpack(BEACON_FORMAT, packet)
+           if magic == BEACON_MAGIC and version == BEACON_VERSION:
+               return (sender[0], command_port, drive_port)
+   except OSError:
+       return None
+   finally:
+       listener.close()
+
+
+
+# On a computer: sends drive packets with the next sequence number
+class DriveSender:
+
+   def __init__(self, address, port=DRIVE_PORT):
+       self.destination = (address, port)
+       self.sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+       self.sequence = 0
+
+
+   def send(self, left, right):
+       self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+       left = max(-100, min(100, int(left)))
+       right = max(-100, min(100, int(right)))
+       self.sender_socket.sendto(struct.pack(DRIVE_FORMAT, DRIVE_MAGIC, self.sequence, left, right),
+                                 self.destination)
+
+
+   def close(self):
+       self.sender_socket.close()
+
+
+# Look for a robot. Run with "python drivelink.py".
+if __name__ == "__main__":
+   found = find_robot()
+   if found:
+       print("Found a robot at", found[0], "commands on port", found[1], "driving on port", found[2])
+   else:
+       print("No robot beacon heard.")
@@ -0,0 +1,194 @@
+import os
+import struct
+import time
+
+# Keep a log of what happened to the robot, for when nobody was
+# watching its console.
+#
+# Each event is a small fixed size binary record: the time in ms since
+# the log started, what happened, and a few numbers about it. Records go
+# into a ring buffer in RAM, which is cheap enough to do from anywhere,
+# even a Bluetooth callback. When FLUSH_RECORDS records have built up,
+# flush() (called from the update loop) appends them to a file on flash
+# in one write. Writing a few bytes to flash at a time would be slow and
+# wear it out. When the file grows past MAX_FILE_BYTES it is renamed to
+# the old log file, replacing the one before, and a new file started.
+
+# time_ms, event, detail, extra, value
+RECORD_FORMAT = "<IBBHI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+LOG_FILE = "events.log"
+OLD_LOG_FILE = "events.old"
+RAM_RECORDS = 256
+FLUSH_RECORDS = 128
+MAX_FILE_BYTES = 32768
+
+EVENT_BOOT = 1
+EVENT_CONNECT = 2           # value: the client's IP address
+EVENT_DISCONNECT = 3
+EVENT_BLE_CONNECT = 4       # detail: connection handle
+EVENT_BLE_DISCONNECT = 5
+EVENT_MODE = 6              # detail: new action, extra: old action
+EVENT_TOO_CLOSE = 7         # value: distance in cm
+EVENT_COMMAND_FAILED = 8    # value: first four letters of the command
+EVENT_BIND_FAILED = 9
+EVENT_LATE_CHECK = 10       # detail: action, value: ms since the last check
+EVENT_WIFI_DOWN = 11
+EVENT_WIFI_UP = 12          # extra: tries to rejoin, value: ms without Wi-Fi
+
+EVENT_NAMES = ["", "boot", "connect", "disconnect", "ble connect", "ble disconnect",
+               "mode", "too close", "command failed", "bind failed", "late check",
+               "wi-fi down", "wi-fi up"]
+
+
+# Up to four letters packed into a number, to fit in a record
+def pack_name(name):
+   value = 0
+   for index in range(min(4, len(name))):
+       value |= (ord(name[index]) & 0xFF) << (8 * index)
+   return value
+
+
+def unpack_name(value):
+   name = ""
+   while value:
+       name += chr(value & 0xFF)
+       value >>= 8
+   return name
+
+
+# An IPv4 address such as "192.168.1.20" as a number
+def pack_address(address):
+   value = 0
+   try:
+       for part in address.split("."):
+           value = (value << 8) | (int(part) & 0xFF)
+   except ValueError:
+       return 0
+   return value
+
+
+# One record as a line of text
+def describe(record):
+   time_ms, event, detail, extra, value = record
+   if event < len(EVENT_NAMES):
+       text = EVENT_NAMES[event]
+   else:
+       text = "event " + str(event)
+   if event == EVENT_CONNECT:
+       text += " from " + ".".join([str((value >> shift) & 0xFF) for shift in (24, 16, 8, 0)])
+   elif event == EVENT_MODE:
+       text += " " + str(extra) + " to " + str(detail)
+   elif event == EVENT_TOO_CLOSE:
+       text += " " + str(value) + " cm"
+   elif event == EVENT_COMMAND_FAILED:
+       text += " " + unpack_name(value)
+   elif event == EVENT_LATE_CHECK:
+       text += " " + str(value) + " ms, action " + str(detail)
+   elif event == EVENT_WIFI_UP:
+       text += " after " + str(value) + " ms, " + str(extra) + " tries"
+   elif detail or value:
+       text += " " + str(detail) + " " + str(value)
+   return text
+
+
+class EventLog:
+
+   def __init__(self, file_name=LOG_FILE, old_file_name=OLD_LOG_FILE):
+       self.file_name = file_name
+       self.old_file_name = old_file_name
+       self.records = bytearray(RAM_RECORDS * RECORD_SIZE)
+       self.start = time.ticks_ms()
+       # Records ever added, and ever written to flash
+       self.added = 0
+       self.flushed = 0
+       self.dropped = 0
+       self.flush_failed = False
+
+
+   def add(self, event, detail=0, extra=0, value=0):
+       index = self.added % RAM_RECORDS
+       self.added += 1
+       struct.pack_into(RECORD_FORMAT, self.records, index * RECORD_SIZE,
+                        time.ticks_diff(time.ticks_ms(), self.start), event,
+                        detail & 0xFF, extra & 0xFFFF, value & 0xFFFFFFFF)
+
+
+   # Records in RAM which have not been written to flash
+   def waiting(self):
+       return self.added - self.flushed
+
+
+   # Write the waiting records to flash if there are enough of them,
+   # or any at all if force is True. Returns True if we wrote some.
+   def flush(self, force=False):
+       waiting = self.waiting()
+       if waiting == 0 or (waiting < FLUSH_RECORDS and not force):
+           return False
+       if waiting > RAM_RECORDS:
+           # Overwritten before we got to them
+           self.dropped += waiting - RAM_RECORDS
+           self.flushed = self.added - RAM_RECORDS
+           waiting = RAM_RECORDS
+       first = self.flushed % RAM_RECORDS
+       records = memoryview(self.records)
+       try:
+           self.rotate(waiting * RECORD_SIZE)
+           log_file = open(self.file_name, "ab")
+           if first + waiting <= RAM_RECORDS:
+               log_file.write(records[first * RECORD_SIZE:(first + waiting) * RECORD_SIZE])
+           else:
+               log_file.write(records[first * RECORD_SIZE:])
+               log_file.write(records[:(first + waiting - RAM_RECORDS) * RECORD_SIZE])
+           log_file.close()
+       except OSError:
+           self.flush_failed = True
+           return False
+       self.flushed += waiting
+       self.flush_failed = False
+       return True
+
+
+   # Start a new file if adding new_bytes would make it too big
+   def rotate(self, new_bytes):
+       try:
+           size = os.stat(self.file_name)[6]
+       except OSError:
+           return
+       if size + new_bytes <= MAX_FILE_BYTES:
+           return
+       try:
+           os.remove(self.old_file_name)
+       except OSError:
+           pass
+       os.rename(self.file_name, self.old_file_name)
+
+
+   # The latest count records still in RAM, newest first, as
+   # (time_ms, event, detail, extra, value)
+   def get_recent(self, count):
+       count = min(count, self.added, RAM_RECORDS)
+       recent = []
+       for record in range(self.added - 1, self.added - 1 - count, -1):
+           index = record % RAM_RECORDS
+           recent.append(struct.unpack_from(RECORD_FORMAT, self.records, index * RECORD_SIZE))
+       return recent
+
+
+
+# Read a log file on a computer. Returns a list of records,
+# oldest first.
+def read_log(data):
+   records = []
+   for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+       records.append(struct.unpack_from(RECORD_FORMAT, data, offset))
+   return records
+
+
+if __name__ == "__main__":
+   import sys
+   for file_name in sys.argv[1:]:
+       with open(file_name, "rb") as log_file:
+           for record in read_log(log_file.read()):
+               print("%10.3f  %s" % (record[0] / 1000.0, describe(record)))
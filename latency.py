@@ -0,0 +1,131 @@
+import array
+
+# Keep track of how long each command takes to run.
+#
+# Each command name gets a histogram of run times in microseconds. The
+# buckets grow in steps of about 1.4 times (two buckets for every
+# doubling), from 1 us up to a few minutes, so a histogram is a fixed
+# size array of counts however many times the command runs. Adding a
+# time only changes numbers in that array, nothing new is allocated.
+# The percentiles worked out from the histogram are the top of the
+# bucket they land in, so they are never more than about 1.4 times the
+# real value.
+
+BUCKETS = 56
+# Counts stop here rather than wrap around
+MAX_COUNT = 65535
+
+
+# Which bucket a time in microseconds goes in. Bucket 0 holds 0 and 1,
+# after that each doubling is split into a lower and upper half.
+def bucket_for(time_us):
+   if time_us < 2:
+       return 0
+   doublings = 0
+   while time_us >= 4:
+       time_us >>= 1
+       doublings += 1
+   bucket = 2 * doublings + time_us - 1
+   if bucket >= BUCKETS:
+       return BUCKETS - 1
+   return bucket
+
+
+# The longest time which goes in a bucket
+def bucket_top(bucket):
+   if bucket == 0:
+       return 1
+   doublings = (bucket - 1) // 2
+   start = 2 + (bucket - 1) % 2
+   return ((start + 1) << doublings) - 1
+
+
+class CommandTimes:
+
+   def __init__(self):
+       self.counts = array.array("H", [0] * BUCKETS)
+       self.runs = 0
+       self.errors = 0
+       self.longest_us = 0
+
+
+   def add(self, time_us, failed):
+       bucket = bucket_for(time_us)
+       if self.counts[bucket] < MAX_COUNT:
+           self.counts[bucket] += 1
+       self.runs += 1
+       if failed:
+           self.errors += 1
+       if time_us > self.longest_us:
+           self.longest_us = time_us
+
+
+   # The time in microseconds which percent of the runs took no
+   # longer than, as far as the buckets can tell
+   def percentile(self, percent):
+       total = 0
+       for bucket in range(BUCKETS):
+           total += self.counts[bucket]
+       if total == 0:
+           return 0
+       wanted = (total * percent + 99) // 100
+       seen = 0
+       for bucket in range(BUCKETS):
+           seen += self.counts[bucket]
+           if seen >= wanted:
+               return min(bucket_top(bucket), self.longest_us)
+       return self.longest_us
+
+
+
+class LatencyStats:
+
+   def __init__(self):
+       self.commands = {}
+
+
+   def reset(self):
+       self.commands.clear()
+
+
+   # Only the first run of each command allocates, to make its histogram
+   def add(self, name, time_us, failed):
+       times = self.commands.get(name)
+       if times is None:
+           times = CommandTimes()
+           self.commands[name] = times
+       times.add(time_us, failed)
+
+
+   # (name, runs, errors, p50, p95, longest) for each command, times in
+   # microseconds, slowest first
+   def get_report(self):
+       report = []
+       for name in self.commands:
+           times = self.commands[name]
+           report.append( (name, times.runs, times.errors, times.percentile(50),
+                           times.percentile(95), times.longest_us) )
+       report.sort(key=lambda line: line[5], reverse=True)
+       return report
+
+
+
+# Check the buckets on a computer. Run with "python latency.py".
+def demo():
+   import random
+   stats = LatencyStats()
+   samples = []
+   for run in range(1000):
+       time_us = int(random.lognormvariate(8, 1))
+       samples.append(time_us)
+       stats.add("test", time_us, run % 50 == 0)
+   samples.sort()
+   name, runs, errors, p50, p95, longest = stats.get_report()[0]
+   print("Runs:", runs, " errors:", errors)
+   print("p50 from buckets:", p50, "us  real:", samples[499], "us")
+   print("p95 from buckets:", p95, "us  real:", samples[949], "us")
+   print("Longest:", longest, "us  real:", samples[-1], "us")
+
+
+if __name__ == "__main__":
+   demo()
@@ -0,0 +1,139 @@
+import array
+import time
+
+# Watch the update loop in main.py, which is where the robot checks for
+# objects in front of it and runs its behaviours.
+#
+# The loop is meant to call robot.update() once a second, but some
+# behaviours take much longer than that (following sleeps, wandering
+# and going somewhere drive for seconds at a time), and while they do,
+# nothing checks whether we are about to hit something. For each cycle
+# we record the time since the last one started (the period), how long
+# robot.update() took (the work) and which action the robot was in.
+# A period longer than the budget is a late safety check. The last few
+# of those are kept too, so they can be traced back to what caused them.
+
+HISTORY = 64
+LATE_HISTORY = 16
+# Allow room for the actions in robot.py
+MAX_ACTIONS = 16
+DEFAULT_BUDGET_MS = 1500
+
+
+class LoopMonitor:
+
+   def __init__(self, budget_ms=DEFAULT_BUDGET_MS):
+       self.budget_ms = budget_ms
+       self.periods = array.array("I", [0] * HISTORY)
+       self.work = array.array("I", [0] * HISTORY)
+       self.actions = bytearray(HISTORY)
+       self.action_runs = array.array("I", [0] * MAX_ACTIONS)
+       self.action_work = array.array("I", [0] * MAX_ACTIONS)
+       self.action_longest = array.array("I", [0] * MAX_ACTIONS)
+       self.late_time = array.array("I", [0] * LATE_HISTORY)
+       self.late_period = array.array("I", [0] * LATE_HISTORY)
+       self.late_action = bytearray(LATE_HISTORY)
+       self.reset()
+
+
+   def reset(self):
+       self.cycles = 0
+       self.late = 0
+       self.last_start = None
+       self.start_time = 0
+       self.action = 0
+       for action in range(MAX_ACTIONS):
+           self.action_runs[action] = 0
+           self.action_work[action] = 0
+           self.action_longest[action] = 0
+
+
+   # Call just before robot.update(). Times are from ticks_ms().
+   def start(self, now, action):
+       self.start_time = now
+       self.action = action % MAX_ACTIONS
+       index = self.cycles % HISTORY
+       if self.last_start is None:
+           self.periods[index] = 0
+       else:
+           self.periods[index] = time.ticks_diff(now, self.last_start)
+       self.last_start = now
+
+
+   # Call just after robot.update(). Returns the period if the safety
+   # check was late, so the caller can warn someone, otherwise 0.
+   def finish(self, now):
+       index = self.cycles % HISTORY
+       work = time.ticks_diff(now, self.start_time)
+       action = self.action
+       self.work[index] = work
+       self.actions[index] = action
+       self.action_runs[action] += 1
+       self.action_work[action] += work
+       if work > self.action_longest[action]:
+           self.action_longest[action] = work
+       self.cycles += 1
+
+       period = self.periods[index]
+       if period <= self.budget_ms:
+           return 0
+       late_index = self.late % LATE_HISTORY
+       self.late_time[late_index] = self.start_time
+       self.late_period[late_index] = period
+       # The action which ran last cycle is the one which made us late
+       self.late_action[late_index] = self.actions[(index - 1) % HISTORY]
+       self.late += 1
+       return period
+
+
+   def set_budget(self, budget_ms):
+       self.budget_ms = budget_ms
+
+
+   # Shortest, average and longest period of the cycles we still
+   # have, and how many of those were late
+   def get_periods(self):
+       count = min(self.cycles, HISTORY)
+       shortest = 0
+       longest = 0
+       total = 0
+       measured = 0
+       late = 0
+       for cycle in range(self.cycles - count, self.cycles):
+           period = self.periods[cycle % HISTORY]
+           if period == 0:
+               continue
+           if measured == 0 or period < shortest:
+               shortest = period
+           if period > longest:
+               longest = period
+           if period > self.budget_ms:
+               late += 1
+           total += period
+           measured += 1
+       if measured == 0:
+           return (0, 0, 0, 0, 0)
+       return (measured, shortest, total // measured, longest, late)
+
+
+   # (action, runs, average work, longest work) for each action
+   # which has run, times in ms
+   def get_action_work(self):
+       results = []
+       for action in range(MAX_ACTIONS):
+           runs = self.action_runs[action]
+           if runs > 0:
+               results.append( (action, runs, self.action_work[action] // runs,
+                                self.action_longest[action]) )
+       return results
+
+
+   # The late safety checks we still have, newest first, as
+   # (time_ms, period, action before)
+   def get_late(self):
+       count = min(self.late, LATE_HISTORY)
+       results = []
+       for late in range(self.late - 1, self.late - 1 - count, -1):
+           index = late % LATE_HISTORY
+           results.append( (self.late_time[index], self.late_period[index], self.late_action[index]) )
+       return results
@@ -1,26 +1,155 @@
+import gc
+import math
+import select
 import socket
 import sys
 import time
 import machine
-import network
 import _thread
 from machine import Pin
-from robot import Robot
+from robot import Robot, MAP_MAX_BYTES, MAP_MAX_CELL_SIZE, ACTION_NAMES, ACTION_MANUAL, TOO_CLOSE
+from drawing import parse_drawing, drawing_length
+import scripts
 import bluetooth
 from ble_simple_peripheral import BLESimplePeripheral
+from telemetry import Telemetry, parse_fields, field_names, MAX_RATE
+from latency import LatencyStats
+import eventlog
+from eventlog import EventLog
+from loopmonitor import LoopMonitor
+from memory import MemoryMonitor
+from recorder import FlightRecorder, RECORDING_EXTENSION, SAMPLE_SIZE
+from replies import ReplyBuffer, FORMAT_TEXT, FORMAT_KEY_VALUE, FORMAT_NAMES
+import wifi
+from drivelink import DriveLink, DRIVE_PORT, BEACON_PORT
 
 
 # Network credentials
 DEFAULT_PORT = 40801
+# Sent after every reply, so clients know we are ready for the next command
+PROMPT = "Ron is ready> "
+RECEIVE_SIZE = 1024
+# A command is run once its new line arrives. Some clients do not send
+# one, so a part line with nothing more after it for this long is run
+# as it is.
+PARTIAL_LINE_MS = 200
 # Replace the values here with your own network login information.
 NETWORK_FILE = "network.txt"
+# How often the update thread wakes up to send telemetry, and
+# how often it runs the robot's own update
+UPDATE_TICK_MS = 50
+ROBOT_UPDATE_MS = 1000
+# While waiting for a client or a command, check the Wi-Fi is still
+# there this often
+LINK_CHECK_MS = 2000
 
 # The Pico board's LED
 led = Pin("LED", Pin.OUT)
 # Are we flashing the LED?
 pico_blinking = 0
+# A drawing being sent to us a piece at a time with "draw add", and
+# the most characters it can grow to
+pending_drawing = ""
+MAX_DRAWING_TEXT = 2048
+# Name of the script we are recording, or None, and its lines so far
+script_recording = None
+script_lines = []
+# Are we running a script, and has someone asked us to stop it?
+script_running = False
+script_abort = False
+# Commands which stop the robot at once, even in the middle of a motion
+STOP_WORDS = ("halt", "stop")
+# Input read from the client while a command was running, looking for a
+# stop. It is handled as usual once the command finishes.
+early_input = ""
+# The client being served, its poller and the thread serving it, so
+# check_for_stop() can look at its input
+stop_socket = None
+stop_poller = None
+network_thread = None
+# When we last looked at the client's input for a stop (ticks_us)
+last_stop_scan = 0
+# When we last received anything from the client (ticks_ms)
+last_received = 0
+# Most text we collect from a script's commands to send back at the end
+SCRIPT_MAX_REPLY = 2048
+# Replies which start with one of these mean the command did not work
+FAILED_REPLIES = ["Please", "I did not", "Did not", "Unable", "Cannot", "Something",
+                  "Command not recognized", "There is no", "Nothing received"]
+
+# How long each part of starting up took, as (phase, ticks_ms) pairs.
+# ticks_ms() counts from when the Pico was switched on.
+boot_times = []
+
+
+def boot_phase(name):
+    boot_times.append( (name, time.ticks_ms()) )
+
+
+# Read credentials from the file network.txt
+# File has the format:
+# network-name
+# network-password
+# ip-address netmask gateway dns (optional, for a fixed address)
+def read_network_credentials():
+   try:
+       my_file = open(NETWORK_FILE, "r")
+   except OSError:
+       return False
+   lines = my_file.readlines()
+   my_file.close()
+   if len(lines) >= 2:
+      wifi_name = lines[0].strip()
+      wifi_password = lines[1].strip()
+      print("Network credentials: " + wifi_name + ":" + wifi_password + "\n")
+      if len(lines) >= 3 and len(lines[2].split()) == 4:
+          return [wifi_name, wifi_password, tuple(lines[2].split())]
+      return [wifi_name, wifi_password]
+   return False
+
+
+# Start joining the network straight away. The Wi-Fi chip gets on with
+# it while we set up the robot and Bluetooth, and main() waits for it.
+boot_phase("imports")
+credentials = read_network_credentials()
+wlan = False
+joined_with_cache = False
+link_watchdog = None
+if credentials:
+    wlan, joined_with_cache = wifi.start_join(credentials)
+    # Notices when the Wi-Fi goes and joins it again
+    link_watchdog = wifi.LinkWatchdog(wlan, credentials)
+    boot_phase("wi-fi join started")
 
 robot = Robot()
+boot_phase("robot")
+# Heap and garbage collection statistics
+memory_monitor = MemoryMonitor()
+# What has happened to the robot, kept in RAM and written to flash
+event_log = EventLog()
+event_log.add(eventlog.EVENT_BOOT)
+# How long each command takes to run
+latency_stats = LatencyStats()
+# How long stops take, from arriving to the motors being off
+stop_stats = LatencyStats()
+# How regularly the update loop gets round to the robot's safety checks
+loop_monitor = LoopMonitor()
+# Records the sensors on every tick of the update loop
+flight_recorder = FlightRecorder()
+# Wheel speeds sent over UDP, and the beacon clients find us with
+drive_link = DriveLink()
+# Telemetry frames pushed to a subscribed client
+telemetry = Telemetry()
+telemetry.memory = memory_monitor
+# Tells send_telemetry() whether the subscriber has room for a frame
+telemetry_poller = None
+# status, where, distance, sensors and colour can reply as plain text,
+# key=value pairs or JSON. The last two are built in reply_buffer.
+reply_format = FORMAT_TEXT
+reply_buffer = ReplyBuffer(256)
+# Held while sending, so a telemetry frame from the update thread
+# never lands in the middle of a reply
+send_lock = _thread.allocate_lock()
 
 # Create a Bluetooth Low Energy (BLE) object
 ble = bluetooth.BLE()
@@ -28,44 +157,145 @@ ble = bluetooth.BLE()
 bluetooth_connection = BLESimplePeripheral(ble)
 
 
-# Read credentials from the file network.txt
-# File has the format:
-# network-name
-# network-password
-def read_network_credentials():
-   my_file = open(NETWORK_FILE, "r")
-   if my_file:
-       lines = my_file.readlines()
-       if len(lines) >= 2:
-          wifi_name = lines[0].strip()
-          wifi_password = lines[1].strip()
-          print("Network credentials: " + wifi_name + ":" + wifi_password + "\n")
-          return [wifi_name, wifi_password]
-   return False
+# Is this line a stop command?
+def is_stop_command(line):
+    words = line.split()
+    return len(words) > 0 and words[0].lower() in STOP_WORDS
+
+
+# The text from the last stop command on, or None if there is no stop.
+# Commands before a stop were waiting behind the motion it stops, so
+# they are dropped.
+def after_last_stop(text):
+    lines = text.split("\n")
+    for index in range(len(lines) - 1, -1, -1):
+        if is_stop_command(lines[index]):
+            return "\n".join(lines[index:])
+    return None
+
+
+# Stop the robot now. since_us is the earliest the stop could have
+# arrived, so the time until the motors are off is the worst case.
+def stop_now(source, since_us):
+    global script_abort
+    robot.emergency_stop()
+    drive_link.note_stop()
+    if script_running:
+        script_abort = True
+    stop_stats.add(source, time.ticks_diff(time.ticks_us(), since_us), False)
+
+
+# Called every few ms while a motion waits. Reads whatever the client
+# has sent, keeping it to be run later, and stops the robot if there
+# is a stop in it. Only whole lines are looked at, as a line can arrive
+# in pieces.
+def check_for_stop():
+    global early_input
+    global last_stop_scan
+    global last_received
+    global script_abort
+
+    if stop_poller is None or _thread.get_ident() != network_thread:
+        return
+    # The stop arrived some time since we last looked
+    since = last_stop_scan
+    last_stop_scan = time.ticks_us()
+    # Where the line still being received starts
+    line_start = early_input.rfind("\n") + 1
+    if not stop_poller.poll(0):
+        if line_start < len(early_input) and \
+           time.ticks_diff(time.ticks_ms(), last_received) > PARTIAL_LINE_MS:
+            # Nothing more is coming, so the part line is a whole one
+            early_input += "\n"
+            if after_last_stop(early_input[line_start:]) is not None:
+                stop_now("network", since)
+        return
+    try:
+        data = stop_socket.recv(RECEIVE_SIZE)
+    except OSError:
+        data = b""
+    if not data:
+        # The client has gone, stop as we would when they disconnect
+        if script_running:
+            script_abort = True
+        robot.emergency_stop()
+        drive_link.note_stop()
+        return
+    last_received = time.ticks_ms()
+    early_input += data.decode()
+    line_end = early_input.rfind("\n") + 1
+    if after_last_stop(early_input[line_start:line_end]) is not None:
+        stop_now("network", since)
+
+
+def log_bluetooth_connection(connected, conn_handle):
+    if connected:
+        event_log.add(eventlog.EVENT_BLE_CONNECT, conn_handle)
+    else:
+        event_log.add(eventlog.EVENT_BLE_DISCONNECT, conn_handle)
+
+
+def log_too_close(distance):
+    event_log.add(eventlog.EVENT_TOO_CLOSE, value=int(distance))
 
 
-def enable_networking(wait_time, credentials):
-  attempts = 0
-  time.sleep(wait_time)
-  wlan = network.WLAN(network.STA_IF)
-  wlan.active(True)
-  wlan.connect(credentials[0], credentials[1])
-      
-  while wlan.status() != 3 and attempts < 10:
-     time.sleep(1)
-     attempts += 1
-  
-  if wlan.status() == 3:
-     address = wlan.ifconfig()
-     return address[0]
-     
-  return False
+bluetooth_connection.on_connection(log_bluetooth_connection)
+robot.on_too_close(log_too_close)
+robot.on_stop_poll(check_for_stop)
+boot_phase("bluetooth")
 
 
+# Has start up finished?
+def boot_ready():
+    for name, ticks in boot_times:
+        if name == "accepting commands":
+            return True
+    return False
+
+
+def boot_report():
+    send_string = "Start up, in ms since the Pico was switched on:\n"
+    last = 0
+    for name, ticks in boot_times:
+        send_string += name + ": " + str(ticks) + " (+" + str(ticks - last) + ")\n"
+        last = ticks
+    if credentials and len(credentials) > 2:
+        send_string += "Using the fixed address " + credentials[2][0] + "\n"
+    if joined_with_cache:
+        send_string += "Joined using the access point we remembered from last time.\n"
+    return send_string
+
+
+# Report on the Wi-Fi connection and the times it has gone away
+def wifi_report():
+    if not link_watchdog:
+        send_string = "There is no " + NETWORK_FILE + ", so the Wi-Fi is not being used.\n"
+        return send_string
+    send_string = "Wi-Fi: " + credentials[0]
+    if link_watchdog.link_up():
+        send_string += ", address " + wlan.ifconfig()[0]
+        try:
+            send_string += ", signal " + str(wlan.status("rssi")) + " dBm"
+        except:
+            pass
+        send_string += "\n"
+    else:
+        send_string += ", not connected\n"
+    send_string += "Outages: " + str(link_watchdog.outages) + ", "
+    send_string += str(link_watchdog.total_downtime_ms // 1000) + " s without Wi-Fi in all, "
+    send_string += str(link_watchdog.attempts) + " tries to join again\n"
+    now = time.ticks_ms()
+    for start, length in link_watchdog.get_outages():
+        send_string += str(time.ticks_diff(now, start) // 1000) + " s ago: "
+        send_string += "lost for " + str(length) + " ms\n"
+    return send_string
+
 
 def display_help():
    send_string = "Tasks the Pico knows how to do:\n\n"
    send_string += "! - repeat last command\n"
+   send_string += "bench [times] - measure memory used by status, where, distance, sensors and colour replies\n"
+   send_string += "boot - show how long each part of starting up took\n"
    send_string += "blink [times] - toggle LED <times> or enable/disable if no number specified\n"
    send_string += "echo [text] - repeats text back to client\n"
    send_string += "hello - say Hello to the client\n"
@@ -73,39 +303,59 @@ def display_help():
    send_string += "light <on/off> - turn the LED on or off\n"
    send_string += "sleep <seconds> - wait\n"
    send_string += "temp - try to sense temperature (somewhat inaccurate)\n"
+   send_string += "wifi - show the Wi-Fi signal and how often the connection has been lost\n"
    send_string += "exit - disconnect client\n\n"
    
    send_string += "Tasks the robot knows how to do:\n\n"
+   send_string += "arc <radius> <degrees> - drive along a curve, negative degrees curve left.\n"
    send_string += "art <line_length> - create random artwork of a given size.\n"
    send_string += "avoid - try to move away from nearby objects.\n"
+   send_string += "batch [stop] <command; command; ...> - run several commands, one reply. stop = quit on first failure.\n"
    send_string += "bright [percent] - set the brightness of buggy lights.\n"
+   send_string += "calibrate [name value|defaults] - show or change motor and turn calibration.\n"
+   send_string += "calibrate turn [speeds] - measure turn rates by spinning over a dark line.\n"
    send_string += "circle <radius> - drive in a circle\n"
+   send_string += "coverage [clear] - report how much of the floor has been explored.\n"
    send_string += "colour [red|yellow|blue|detect|match] [light_level]- detect colour under buggy.\n"
    send_string += "direction [degrees] - ask/tell the robot which way it is facing.\n"
    send_string += "distance - distance to nearest object in cm\n"
+   send_string += "explore - cover the floor, heading for places the robot has not been yet.\n"
+   send_string += "draw <path> - draw x,y points or an SVG path (M, L, H, V, Z). Also draw add|run|clear.\n"
+   send_string += "drive [left right] - set each wheel's speed (-100 to 100), or report on the UDP drive channel.\n"
+   send_string += "format [text|kv|json] - reply to status, where, distance, sensors and colour as text, key=value or JSON.\n"
    send_string += "follow - try to follow moving objects in front of the buggy.\n"
    send_string += "forward [steps] - move the buggy forward.\n"
    send_string += "goto <x> <y> - move robot to x,y coordinates.\n"
-   send_string += "halt - come to a complete stop\n"
+   send_string += "halt (or stop) - come to a complete stop, even part way through another command\n"
    send_string += "home - the robot will try to find its way back to where it started.\n"
    send_string += "honk - beep the horn\n"
    send_string += "lights <on|pff|colour> - change the colour of the LED lights on the buggy\n"
    send_string += "line [black/white] - follow a line on the floor. Defaults to black.\n"
+   send_string += "log [count|flush] - show recent events (connections, mode changes, stops, errors).\n"
+   send_string += "loop [reset|budget <ms>] - how regularly the robot checks for objects, and what delays it.\n"
+   send_string += "map [clear|dump|size <width> <height> <cell_cm>] - show, clear, download or resize the map.\n"
+   send_string += "mem [reset|history] - report free memory, garbage collections and the commands using the most memory. Finds the largest free block, which takes a few collections.\n"
    send_string += "manual - Have the robot stop what it is doing and await instructions\n"
    send_string += "pen [up|down|toggle] - raise or lower the pen\n"
    send_string += "play - enter Play mode, which wanders, avoids, and follows\n"
    send_string += "position [x] [y] - Set the robots current (x,y) location.\n"
+   send_string += "record [start [name]|stop] - record the sensors 20 times a second to a file on the Pico.\n"
    send_string += "reverse [steps] - move the buggy backwards\n"
    send_string += "sensors [barrier]- report the light levels detected. Set light/dark barrier.\n"
+   send_string += "script list|save|show|run|delete [name] - store command scripts on the Pico and run them.\n"
    send_string += "speed [up|down|new_speed] - get the current speed or set engines to a new speed\n"
    send_string += "spin <left/right> - spin the buggy in place\n"
    send_string += "square [length] - move in a square (forward, right, forward, right)\n"
    send_string += "status - get status report from the buggy\n"
+   send_string += "stats [reset] - how long each command takes to run, slowest first.\n"
    send_string += "step [steps] - move the buggy forward.\n"
+   send_string += "subscribe <fields> <rate> - push binary telemetry frames (pose,motors,distance,lf,mode,mem or all).\n"
+   send_string += "trail [clear|replay|retrace|dump] - show, drive over, retrace home along, or download the robot's trail.\n"
    send_string += "track [black/white] - avoid lines on the floor. Defaults to black.\n"
    send_string += "triangle [length] - move the buggy in the shape of a triangle.\n"
    send_string += "turn <degrees> - turn the buggy left or right a number of degrees\n"
    send_string += "turnto <degrees> - turn the buggy to the specified direction\n"
+   send_string += "unsubscribe - stop sending telemetry frames\n"
    send_string += "wander - the robot will move about randomly. Do not leave unattended.\n"
    send_string += "where - have the robot report on its position and direction\n"
    
@@ -131,6 +381,9 @@ def Reset_Everything():
     global robot
     
     pico_blinking = 0
+    with send_lock:
+        telemetry.stop()
+    set_reply_format(FORMAT_TEXT)
     led.value(1)     # Indicate we are ready for a new connection
     robot.lights_off()
     robot.halt()
@@ -140,13 +393,113 @@ def Update_Everything():
     global robot
     global bluetooth_connection
     
+    next_update = time.ticks_ms()
+    last_action = robot.action
     while True:
-        if bluetooth_connection.is_connected():
-           bluetooth_connection.on_write(handle_bluetooth)
-           
-        do_blinking()
-        robot.update()
-        time.sleep(1)
+        now = time.ticks_ms()
+        if time.ticks_diff(now, next_update) >= 0:
+            next_update = time.ticks_add(now, ROBOT_UPDATE_MS)
+            if bluetooth_connection.is_connected():
+               bluetooth_connection.on_write(handle_bluetooth)
+
+            do_blinking()
+            loop_monitor.start(time.ticks_ms(), robot.action)
+            robot.update()
+            late = loop_monitor.finish(time.ticks_ms())
+            if late:
+                print("Safety check late: " + str(late) + " ms since the last one.")
+                event_log.add(eventlog.EVENT_LATE_CHECK, loop_monitor.action, value=late)
+        if robot.action != last_action:
+            event_log.add(eventlog.EVENT_MODE, robot.action, last_action)
+            last_action = robot.action
+        robot.step_motors()
+        drive_update(time.ticks_ms())
+        flight_recorder.sample(robot, time.ticks_ms())
+        event_log.flush()
+        memory_monitor.check(time.ticks_ms())
+        send_telemetry()
+        time.sleep_ms(UPDATE_TICK_MS)
+
+
+# Act on wheel speeds from the UDP drive channel, stop the robot if
+# its client goes quiet, and send the beacon when it is due
+def drive_update(now):
+    was_driving = drive_link.driving
+    if robot.action != ACTION_MANUAL:
+        # Someone started a behaviour, so it is no longer ours to stop
+        was_driving = False
+        drive_link.driving = False
+    setpoint = drive_link.poll(now)
+    if drive_link.stop_released():
+        # The stick has been pushed and let go since the stop, so it may
+        # drive again
+        robot.clear_stop()
+    if setpoint is not None:
+        # A joystick left alone sends zeros, which must not stop
+        # whatever the robot is doing
+        if setpoint[0] != 0 or setpoint[1] != 0 or was_driving:
+            drive_wheels(setpoint[0], setpoint[1])
+    elif drive_link.is_silent(now):
+        robot.halt()
+    drive_link.send_beacon(now)
+
+
+# Is something within TOO_CLOSE? Readings of 1 or less are errors.
+def is_too_close(distance):
+    return distance <= TOO_CLOSE and distance > 1
+
+
+# Turn the wheels at these speeds (-100 to 100) in manual mode. We go by
+# the last distance the update loop measured, as measuring takes too
+# long to do for every joystick packet. Returns False if something is
+# in the way.
+def drive_wheels(left, right):
+    if robot.action != ACTION_MANUAL:
+        robot.enter_manual_mode()
+    # Either wheel going forward can take the front into something,
+    # either going back the rear
+    blocked = False
+    if (left > 0 or right > 0) and is_too_close(robot.forward_distance):
+        blocked = True
+    if (left < 0 or right < 0) and is_too_close(robot.reverse_distance):
+        blocked = True
+    if blocked:
+        robot.halt()
+        drive_link.driving = False
+        return False
+    if not robot.drive_wheels(left, right):
+        # Stopped, until the stick is let go
+        drive_link.driving = False
+        return False
+    return True
+
+
+# Send a telemetry frame to the subscribed client if one is due. This
+# runs in the update thread, so it holds send_lock while it looks at the
+# subscription, which the network thread changes under the same lock,
+# and never waits for a client which has stopped reading.
+def send_telemetry():
+    now = time.ticks_ms()
+    if not telemetry.is_due(now):
+        return
+    with send_lock:
+        destination = telemetry.destination
+        if destination is None or not telemetry.is_due(now):
+            # Stopped since we looked
+            return
+        frame = telemetry.build(robot, now)
+        if not telemetry_poller.poll(0):
+            # No room to send, the client is not keeping up
+            telemetry.frames_dropped += 1
+            return
+        try:
+            sent = destination.send(frame)
+        except OSError:
+            sent = 0
+        if sent != len(frame):
+            # The client has gone, or only part of the frame fitted,
+            # which would leave the client unable to find the next one
+            telemetry.stop()
     
     
     
@@ -178,7 +531,7 @@ def set_direction(command_line):
     global robot
     if len(command_line) < 2:
         # ask the robot what direction it is facing
-        current_dir = robot.get_direction()
+        current_dir = round(robot.get_direction(), 1)
         send_string = "Facing " + str(current_dir) + " degrees.\n"
         return send_string
     # Try to set new direction
@@ -203,11 +556,14 @@ def go_to_sleep(command_line, socket):
            sleep_time = float(command_line[1])
         except:
            send_string = "I did not understand " + command_line[1] + "\n"
-           socket.send( send_string.encode() )
+           send_reply(socket, send_string)
 
     send_string = "Sleeping for " + str(sleep_time) + " seconds.\n"
-    socket.send( send_string.encode() )
-    time.sleep(sleep_time)
+    send_reply(socket, send_string)
+    # Wait the way motions do, so a stop cuts the sleep short
+    if not robot.wait(sleep_time):
+        send_string = "Woken early by a stop.\n"
+        return send_string
     send_string = "Waking.\n"
     return send_string
 
@@ -405,6 +761,42 @@ def turn_buggy_to(command_line):
    return send_string
 
 
+# drive <left> <right> sets the wheel speeds. Plain "drive" reports on
+# the UDP drive channel.
+def drive_command(command_line):
+    if len(command_line) < 2:
+        if not drive_link.is_running():
+            send_string = "The UDP drive channel is not running.\n"
+            return send_string
+        send_string = "Drive packets on UDP port " + str(DRIVE_PORT) + ", beacon to "
+        send_string += drive_link.beacon_to[0] + ":" + str(BEACON_PORT) + "\n"
+        send_string += "Received: " + str(drive_link.received) + ", late: " + str(drive_link.late)
+        send_string += ", bad: " + str(drive_link.bad) + ", stopped by silence: "
+        send_string += str(drive_link.silence_stops) + "\n"
+        if drive_link.sender:
+            send_string += "Last driven from " + drive_link.sender[0] + "\n"
+        return send_string
+    if len(command_line) < 3:
+        send_string = "Please give a speed for each wheel, from -100 to 100.\n"
+        return send_string
+    try:
+        left = int(command_line[1])
+        right = int(command_line[2])
+    except:
+        send_string = "I did not understand the wheel speeds " + command_line[1] + " " + command_line[2] + "\n"
+        return send_string
+    left = max(-100, min(100, left))
+    right = max(-100, min(100, right))
+    if not drive_wheels(left, right):
+        if robot.stop_requested:
+            send_string = "Cannot drive, the robot has been stopped.\n"
+        else:
+            send_string = "Cannot drive that way, something is in the way.\n"
+        return send_string
+    send_string = "Driving the wheels at " + str(left) + " and " + str(right) + ".\n"
+    return send_string
+
+
 def halt_buggy():
     global robot
     # Put us in manual mode, which also stops the buggy.
@@ -472,6 +864,32 @@ def move_reverse(command_line):
     return send_string
 
 
+def move_in_arc(command_line):
+  global robot
+  robot.enter_manual_mode()
+
+  if len(command_line) < 3:
+     send_string = "Please provide the radius and how many degrees to curve. For example: arc 1.0 90\n"
+     return send_string
+
+  try:
+     radius = float(command_line[1])
+     degrees = float(command_line[2])
+  except:
+     send_string = "Did not recognize " + command_line[1] + " " + command_line[2] + "\n"
+     return send_string
+
+  if radius < 0.1 or radius > 10.0 or degrees < -720 or degrees > 720:
+     send_string = "Please specify a radius from 0.1 to 10.0 and degrees from -720 to 720\n"
+     return send_string
+
+  if robot.arc(radius, degrees):
+     send_string = "Finished driving along an arc.\n"
+  else:
+     send_string = "Something is in the way, cannot drive along an arc.\n"
+  return send_string
+
+
 def move_in_circle(command_line):
   global robot
   robot.enter_manual_mode()
@@ -492,11 +910,58 @@ def move_in_circle(command_line):
      return send_string
 
   robot.draw_circle(radius)
-  send_string = "Finished driving in a circle.\n"
+  send_string = "Finished driving in a circle in " + str(robot.get_last_draw_time()) + " seconds.\n"
   return send_string
 
 
 
+# Draw a shape with the pen. The shape can be given all at once,
+# "draw 0,0 0,1 1,1", or sent in pieces with "draw add ..." and
+# then drawn with "draw run". See drawing.py for the formats.
+def draw_shape(command_line):
+  global robot
+  global pending_drawing
+
+  if len(command_line) < 2:
+     send_string = "Please provide a shape to draw, such as: draw M 0 0 L 1 0 L 1 1 Z\n"
+     return send_string
+
+  if command_line[1] == "add":
+     more = " " + " ".join(command_line[2:])
+     if len(pending_drawing) + len(more) > MAX_DRAWING_TEXT:
+        send_string = "Unable to add to the drawing, it can be at most " + str(MAX_DRAWING_TEXT) + " characters.\n"
+        return send_string
+     pending_drawing += more
+     send_string = "Added to the drawing.\n"
+     return send_string
+  if command_line[1] == "clear":
+     pending_drawing = ""
+     send_string = "Cleared the drawing.\n"
+     return send_string
+  if command_line[1] == "run":
+     text = pending_drawing
+     pending_drawing = ""
+  else:
+     text = " ".join(command_line[1:])
+
+  try:
+     moves = parse_drawing(text)
+  except ValueError as error:
+     send_string = "Unable to understand the drawing: " + str(error) + "\n"
+     return send_string
+
+  robot.enter_manual_mode()
+  status = robot.draw(moves)
+  robot.pen_up()
+  draw_time = robot.get_last_draw_time()
+  if status:
+     send_string = "Finished drawing " + str(round(drawing_length(moves), 2))
+     send_string += " steps of lines in " + str(draw_time) + " seconds.\n"
+  else:
+     send_string = "Something got in the way, stopped drawing after " + str(draw_time) + " seconds.\n"
+  return send_string
+
+
 def move_in_square(command_line):
    global robot
    robot.enter_manual_mode()
@@ -516,7 +981,7 @@ def move_in_square(command_line):
       return send_string
 
    robot.draw_square(line_length)      
-   send_string = "Finished outlining a square.\n"
+   send_string = "Finished outlining a square in " + str(robot.get_last_draw_time()) + " seconds.\n"
    return send_string
 
 
@@ -539,7 +1004,7 @@ def move_in_triangle(command_line):
       return send_string
 
    robot.draw_triangle(line_length)
-   send_string = "Finished outlining a triangle.\n"
+   send_string = "Finished outlining a triangle in " + str(robot.get_last_draw_time()) + " seconds.\n"
    return send_string
 
 
@@ -581,6 +1046,77 @@ def avoid_mode():
    return send_string
 
 
+def explore_mode():
+   global robot
+   robot.enter_explore_mode()
+   send_string = "Robot is entering Explore mode.\n"
+   return send_string
+
+
+def coverage_report(command_line):
+   global robot
+   if len(command_line) >= 2 and command_line[1] == "clear":
+      robot.clear_coverage()
+      send_string = "Cleared the record of where the robot has been.\n"
+      return send_string
+
+   percent, per_minute, area = robot.get_coverage()
+   send_string = "Covered " + str(round(percent, 1)) + "% of the known floor, "
+   send_string += str(round(area, 2)) + " square metres.\n"
+   send_string += "Coverage rate: " + str(round(per_minute, 1)) + "% per minute.\n"
+   return send_string
+
+
+# "subscribe <fields> <rate>" has the update loop push binary
+# telemetry frames to this client rate times a second. The fields
+# are a comma separated list, or all. See telemetry.py for the format.
+def subscribe(command_line, client_socket):
+    if not client_socket:
+        send_string = "Telemetry can only be sent over the network.\n"
+        return send_string
+    if len(command_line) < 3:
+        send_string = "Please provide the fields and how many times a second, such as: subscribe pose,distance 10\n"
+        send_string += "Fields: all, pose, motors, distance, lf, mode, mem\n"
+        return send_string
+
+    fields = parse_fields(command_line[1].lower())
+    if not fields:
+        send_string = "I did not understand the fields " + command_line[1] + "\n"
+        return send_string
+    try:
+        rate = int(command_line[2])
+    except:
+        send_string = "I did not understand " + command_line[2] + ". Please use a whole number.\n"
+        return send_string
+    if rate < 1 or rate > MAX_RATE:
+        send_string = "Please provide a rate from 1 to " + str(MAX_RATE) + " times a second.\n"
+        return send_string
+
+    global telemetry_poller
+    poller = select.poll()
+    poller.register(client_socket, select.POLLOUT)
+    with send_lock:
+        telemetry_poller = poller
+        telemetry.start(fields, rate, client_socket, time.ticks_ms())
+    send_string = "Sending " + field_names(fields) + " " + str(rate) + " times a second.\n"
+    return send_string
+
+
+def unsubscribe():
+    if not telemetry.is_running():
+        send_string = "There is no telemetry to stop.\n"
+        return send_string
+    with send_lock:
+        frames_sent = telemetry.frames_sent
+        frames_dropped = telemetry.frames_dropped
+        telemetry.stop()
+    send_string = "Stopped telemetry after " + str(frames_sent) + " frames"
+    if frames_dropped:
+        send_string += ", dropped " + str(frames_dropped) + " the client was too slow for"
+    send_string += ".\n"
+    return send_string
+
+
 def follow_mode():
    global robot
    robot.enter_follow_mode()
@@ -603,6 +1139,9 @@ def goto_mode(command_line):
     except:
        send_string = "Did not recognize numbers " + command_line[1] + " or " + command_line[2] + "\n"
        return send_string
+    if not (math.isfinite(x) and math.isfinite(y)):
+       send_string = "Please use ordinary numbers for where to go, not " + command_line[1] + " " + command_line[2] + "\n"
+       return send_string
 
     robot.enter_goto_mode(x, y)
     send_string = "Robot is attempting to travel to " + str(x) + ", " + str(y) + "\n"
@@ -650,6 +1189,9 @@ def set_position(command_line):
     except:
         send_string = "Did not understand " + command_line[1] + " " + command_line[2] + "\n"
         return send_string
+    if not (math.isfinite(x) and math.isfinite(y)):
+        send_string = "Please use ordinary numbers for the position, not " + command_line[1] + " " + command_line[2] + "\n"
+        return send_string
     x = round(x, 1)
     y = round(y, 1)
     robot.set_coordinates(x, y)
@@ -697,8 +1239,20 @@ def where_report():
    global robot
    x_and_y = robot.get_coordinates()
    direction = robot.get_direction()
-   return_string = "Direction: " + str(direction) + "\n"
-   return_string += "Position: " + str(x_and_y) + "\n"
+   uncertainty = robot.get_uncertainty()
+   return_string = "Direction: " + str(round(direction, 1)) + "\n"
+   return_string += "Position: (" + str(round(x_and_y[0], 2)) + ", " + str(round(x_and_y[1], 2)) + ")\n"
+   return_string += "Uncertainty: " + str(round(uncertainty[0], 2)) + " steps, "
+   return_string += str(round(uncertainty[1], 1)) + " degrees\n"
+   route = robot.get_route()
+   if route:
+       return_string += "Route: "
+       for waypoint in route:
+           return_string += "(" + str(round(waypoint[0], 2)) + ", " + str(round(waypoint[1], 2)) + ") "
+       return_string += "\n"
+   trip_time = robot.get_last_trip_time()
+   if trip_time > 0:
+       return_string += "Last goto/home trip took " + str(round(trip_time, 1)) + " seconds\n"
    return return_string
 
 
@@ -728,6 +1282,302 @@ def light_sensors(command_line):
 
 
 
+# The machine readable versions of status, where, distance, sensors
+# and colour. They add the values to reply_buffer, see replies.py.
+def fill_status(reply):
+    reply.add_int(b"speed", robot.speed)
+    reply.add_int(b"left", robot.left_motor)
+    reply.add_int(b"right", robot.right_motor)
+    fill_distance(reply)
+    fill_sensors(reply)
+    reply.add_bool(b"lights_auto", robot.lights_auto)
+    reply.add_int(b"mode", robot.action)
+    fill_where(reply)
+    reply.add_bool(b"pen_down", robot.pen_position == "down")
+
+
+def fill_where(reply):
+    reply.add_float(b"x", robot.x, 2)
+    reply.add_float(b"y", robot.y, 2)
+    reply.add_float(b"dir", robot.direction, 1)
+    uncertainty = robot.get_uncertainty()
+    reply.add_float(b"x_y_error", uncertainty[0], 2)
+    reply.add_float(b"dir_error", uncertainty[1], 1)
+    reply.add_float(b"trip", robot.get_last_trip_time(), 1)
+
+
+def fill_distance(reply):
+    reply.add_float(b"front", robot.forward_distance, 1)
+    reply.add_float(b"rear", robot.reverse_distance, 1)
+
+
+def fill_sensors(reply):
+    buggy = robot.buggy
+    reply.add_int(b"lf_left", buggy.getRawLFValue("l"))
+    reply.add_int(b"lf_centre", buggy.getRawLFValue("c"))
+    reply.add_int(b"lf_right", buggy.getRawLFValue("r"))
+    reply.add_int(b"barrier", robot.light_barrier)
+
+
+def fill_colour(reply):
+    reply.add_int(b"red", robot.detect_red)
+    reply.add_int(b"yellow", robot.detect_yellow)
+    reply.add_int(b"blue", robot.detect_blue)
+
+
+def set_reply_format(new_format):
+    global reply_format
+    reply_format = new_format
+
+
+# Build a machine readable reply with fill_function and send it
+# straight from the buffer. Returns the empty string, as the
+# reply has already gone.
+def send_structured(fill_function, client_socket):
+    reply_buffer.start(reply_format)
+    fill_function(reply_buffer)
+    reply = reply_buffer.finish()
+    if client_socket:
+        with send_lock:
+            client_socket.send( reply )
+    else:
+        bluetooth_connection.send( reply )
+    return ""
+
+
+# "format [text|kv|json]" shows or changes how status, where,
+# distance, sensors and colour reply.
+def format_command(command_line):
+    if len(command_line) < 2:
+        send_string = "Replies are in " + FORMAT_NAMES[reply_format] + " format.\n"
+        return send_string
+    name = command_line[1].lower()
+    if name not in FORMAT_NAMES:
+        send_string = "Please use format text, kv or json.\n"
+        return send_string
+    set_reply_format(FORMAT_NAMES.index(name))
+    send_string = "Replies are now in " + name + " format.\n"
+    return send_string
+
+
+# Measure how much memory the status style commands use each time
+# they are run, as text and as structured replies. The garbage
+# collector is paused so gc.mem_alloc() counts every allocation.
+def bench_command(command_line):
+    times = 20
+    if len(command_line) >= 2:
+        try:
+            times = int(command_line[1])
+        except:
+            send_string = "I did not understand " + command_line[1] + ". Please use a whole number.\n"
+            return send_string
+    if times < 1 or times > 200:
+        send_string = "Please run the benchmark from 1 to 200 times.\n"
+        return send_string
+
+    style = reply_format
+    if style == FORMAT_TEXT:
+        style = FORMAT_KEY_VALUE
+    tests = [ ("status", get_status, fill_status),
+              ("where", where_report, fill_where),
+              ("distance", get_distance, fill_distance),
+              ("sensors", lambda: light_sensors(["sensors"]), fill_sensors),
+              ("colour", lambda: colour_detect(["colour"]), fill_colour) ]
+    send_string = "Bytes allocated per command, text then " + FORMAT_NAMES[style] + ":\n"
+    for name, text_function, fill_function in tests:
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for count in range(times):
+            text_function()
+        text_bytes = gc.mem_alloc() - before
+        before = gc.mem_alloc()
+        for count in range(times):
+            reply_buffer.start(style)
+            fill_function(reply_buffer)
+            reply_buffer.finish()
+        structured_bytes = gc.mem_alloc() - before
+        gc.enable()
+        send_string += name + ": " + str(text_bytes // times) + " / " + str(structured_bytes // times) + "\n"
+    return send_string
+
+
+# Report on the heap: free memory, the largest block we could
+# allocate, how often the garbage collector runs and how long it
+# takes, and which commands allocate the most.
+def memory_report(command_line):
+    if len(command_line) >= 2:
+        if command_line[1] == "reset":
+            memory_monitor.reset()
+            send_string = "Memory statistics cleared.\n"
+        elif command_line[1] == "history":
+            now = time.ticks_ms()
+            send_string = "Free memory, seconds ago:\n"
+            for sample_time, free in memory_monitor.get_history():
+                send_string += str(time.ticks_diff(now, sample_time) // 1000) + ": " + str(free) + "\n"
+        else:
+            send_string = "I did not understand. Please use 'mem', 'mem reset' or 'mem history'.\n"
+        return send_string
+
+    monitor = memory_monitor
+    monitor.measure(time.ticks_ms())
+    send_string = "Free memory: " + str(gc.mem_free()) + " bytes, in use: " + str(gc.mem_alloc()) + " bytes\n"
+    send_string += "Lowest free memory seen: " + str(monitor.lowest_free) + " bytes\n"
+    if monitor.largest_block > 0:
+        send_string += "Largest free block: " + str(monitor.largest_block) + " bytes. "
+        send_string += "Smallest seen: " + str(monitor.smallest_block) + " bytes\n"
+    send_string += "Garbage collections: " + str(monitor.collections) + ", the one just run took "
+    send_string += str(monitor.last_pause_us / 1000) + " ms, longest " + str(monitor.longest_pause_us / 1000) + " ms\n"
+    command_stats = monitor.get_command_stats()
+    if command_stats:
+        send_string += "Bytes allocated by commands (runs, average, most):\n"
+        for name, runs, average, most in command_stats[:10]:
+            send_string += name + ": " + str(runs) + ", " + str(average) + ", " + str(most) + "\n"
+    return send_string
+
+
+# Show how long commands take: how often each was run, how many
+# failed, and the median, 95th percentile and longest times.
+def latency_report(command_line):
+    if len(command_line) >= 2:
+        if command_line[1] == "reset":
+            latency_stats.reset()
+            stop_stats.reset()
+            send_string = "Command timings cleared.\n"
+        else:
+            send_string = "I did not understand. Please use 'stats' or 'stats reset'.\n"
+        return send_string
+
+    report = latency_stats.get_report()
+    if not report:
+        send_string = "No commands timed yet.\n"
+    else:
+        send_string = "Command: runs, errors, p50, p95, longest (ms)\n"
+        for name, runs, errors, p50, p95, longest in report:
+            send_string += name + ": " + str(runs) + ", " + str(errors) + ", " + str(p50 / 1000)
+            send_string += ", " + str(p95 / 1000) + ", " + str(longest / 1000) + "\n"
+    # Stops are timed from the latest they could have arrived, so these
+    # are worst cases. Network stops during a motion are looked for
+    # every STOP_CHECK_MS.
+    for name, runs, errors, p50, p95, longest in stop_stats.get_report():
+        send_string += "Stops from " + name + ": " + str(runs) + ", p50 " + str(p50 / 1000)
+        send_string += ", p95 " + str(p95 / 1000) + ", worst " + str(longest / 1000) + " ms\n"
+    return send_string
+
+
+# "record start [name]" records the sensors, pose and motors on every
+# tick of the update loop to <name>.rec, until "record stop". The
+# recording carries on if the client disconnects. recorder.py has a
+# function to read the file on a computer.
+def record_command(command_line):
+    recorder = flight_recorder
+    if len(command_line) < 2:
+        if recorder.is_recording():
+            send_string = "Recording to " + recorder.file_name + ": "
+        else:
+            send_string = "Not recording. Last recording " + recorder.file_name + ": "
+        send_string += str(recorder.samples) + " samples, " + str(recorder.file_bytes) + " bytes written, "
+        send_string += "slowest page write " + str(recorder.longest_write_ms) + " ms\n"
+        if recorder.stopped_because:
+            send_string += "Recording stopped because " + recorder.stopped_because + ".\n"
+        return send_string
+
+    if command_line[1] == "start":
+        name = "flight"
+        if len(command_line) >= 3:
+            name = command_line[2]
+        if not scripts.valid_name(name):
+            send_string = "Recording names can use up to 20 letters, numbers, - and _\n"
+            return send_string
+        if recorder.start(name + RECORDING_EXTENSION):
+            send_string = "Recording to " + recorder.file_name + ", " + str(SAMPLE_SIZE)
+            send_string += " bytes every " + str(UPDATE_TICK_MS) + " ms.\n"
+        else:
+            send_string = "Unable to create " + name + RECORDING_EXTENSION + "\n"
+    elif command_line[1] == "stop":
+        if not recorder.is_recording():
+            send_string = "Not recording.\n"
+            return send_string
+        recorder.stop()
+        send_string = "Stopped recording. " + str(recorder.samples) + " samples, "
+        send_string += str(recorder.file_bytes) + " bytes in " + recorder.file_name + "\n"
+    else:
+        send_string = "I did not understand. Please use 'record', 'record start [name]' or 'record stop'.\n"
+    return send_string
+
+
+# Show the latest events, newest first, or write the
+# events waiting in RAM to flash now.
+def log_command(command_line):
+    count = 20
+    if len(command_line) >= 2:
+        if command_line[1] == "flush":
+            waiting = event_log.waiting()
+            if event_log.flush(True):
+                send_string = "Wrote " + str(waiting) + " events to " + event_log.file_name + "\n"
+            elif waiting == 0:
+                send_string = "There are no events waiting to be written.\n"
+            else:
+                send_string = "Unable to write to " + event_log.file_name + "\n"
+            return send_string
+        try:
+            count = int(command_line[1])
+        except:
+            send_string = "I did not understand " + command_line[1] + ". Please use 'log', 'log <count>' or 'log flush'.\n"
+            return send_string
+
+    now = time.ticks_diff(time.ticks_ms(), event_log.start)
+    send_string = "Events: " + str(event_log.added) + " logged, " + str(event_log.waiting())
+    send_string += " waiting to be written, " + str(event_log.dropped) + " lost\n"
+    for record in event_log.get_recent(count):
+        send_string += str((now - record[0]) // 1000) + " s ago: "
+        event = record[1]
+        if event == eventlog.EVENT_MODE and record[2] < len(ACTION_NAMES) and record[3] < len(ACTION_NAMES):
+            send_string += "mode " + ACTION_NAMES[record[3]] + " to " + ACTION_NAMES[record[2]] + "\n"
+        else:
+            send_string += eventlog.describe(record) + "\n"
+    return send_string
+
+
+# Report on the update loop: how long between safety checks, how
+# long each behaviour keeps the loop busy, and the late checks.
+def loop_report(command_line):
+    if len(command_line) >= 2:
+        if command_line[1] == "reset":
+            loop_monitor.reset()
+            send_string = "Loop statistics cleared.\n"
+        elif command_line[1] == "budget" and len(command_line) >= 3:
+            try:
+                budget = int(command_line[2])
+            except:
+                send_string = "I did not understand " + command_line[2] + ". Please use a whole number.\n"
+                return send_string
+            if budget < 100 or budget > 60000:
+                send_string = "Please provide a budget from 100 to 60000 ms.\n"
+                return send_string
+            loop_monitor.set_budget(budget)
+            send_string = "Safety checks more than " + str(budget) + " ms apart will be reported.\n"
+        else:
+            send_string = "I did not understand. Please use 'loop', 'loop reset' or 'loop budget <ms>'.\n"
+        return send_string
+
+    measured, shortest, average, longest, late = loop_monitor.get_periods()
+    send_string = "Time between safety checks, last " + str(measured) + " cycles: "
+    send_string += str(shortest) + " ms shortest, " + str(average) + " ms average, " + str(longest) + " ms longest\n"
+    send_string += "Budget: " + str(loop_monitor.budget_ms) + " ms, late " + str(late) + " times recently, "
+    send_string += str(loop_monitor.late) + " times in all\n"
+    work = loop_monitor.get_action_work()
+    if work:
+        send_string += "Time spent in robot.update() (runs, average, longest ms):\n"
+        for action, runs, average, longest in work:
+            send_string += ACTION_NAMES[action] + ": " + str(runs) + ", " + str(average) + ", " + str(longest) + "\n"
+    now = time.ticks_ms()
+    for late_time, period, action in loop_monitor.get_late()[:5]:
+        send_string += "Late " + str(time.ticks_diff(now, late_time) // 1000) + " seconds ago, "
+        send_string += str(period) + " ms after " + ACTION_NAMES[action] + "\n"
+    return send_string
+
+
 def hold_pen(command_line):
    global robot
 
@@ -824,13 +1674,441 @@ def colour_detect(command_line):
    return send_string
 
 
+# Measure the real turn rate at a few speeds. The robot
+# needs to be placed over a straight dark line on the floor.
+def calibrate_turn(command_line):
+    global robot
+
+    speeds = []
+    for argument in command_line[2:]:
+        try:
+            speed = int(argument)
+        except:
+            send_string = "I did not understand the speed " + argument + "\n"
+            return send_string
+        if speed < 1 or speed > 100:
+            send_string = "Speeds need to be in the range of 1-100\n"
+            return send_string
+        speeds.append(speed)
+
+    if speeds:
+        results = robot.calibrate_turn(speeds)
+    else:
+        results = robot.calibrate_turn()
+    send_string = "Measured turn rates (degrees per second):\n"
+    for speed, left_rate, right_rate in results:
+        send_string += "Speed " + str(speed) + ": left " + str(left_rate)
+        send_string += ", right " + str(right_rate) + "\n"
+    send_string += "A rate of 0 means the line was not found. Please reset the robot's direction.\n"
+    return send_string
+
+
+# Report on the map of objects the robot has built, clear it,
+# change its size, or send the whole map as a binary block.
+# The dump is a text line giving the number of bytes which follow,
+# then the bytes themselves. occupancy.read_dump() decodes them.
+def map_command(command_line, client_socket):
+    global robot
+    the_map = robot.get_map()
+
+    if len(command_line) < 2:
+        occupied, free, unknown = the_map.summary()
+        send_string = "Map: " + str(the_map.width) + " x " + str(the_map.height)
+        send_string += " cells of " + str(the_map.cell_size_cm) + " cm, "
+        send_string += str(the_map.size_in_bytes()) + " bytes\n"
+        send_string += "Occupied: " + str(occupied) + " Free: " + str(free)
+        send_string += " Unknown: " + str(unknown) + "\n"
+        return send_string
+
+    if command_line[1] == "clear":
+        the_map.clear()
+        send_string = "Map cleared.\n"
+        return send_string
+
+    if command_line[1] == "dump":
+        if not client_socket:
+            send_string = "The map can only be downloaded over the network.\n"
+            return send_string
+        header = the_map.dump_header()
+        send_string = "Map dump " + str(len(header) + the_map.size_in_bytes()) + " bytes\n"
+        with send_lock:
+            client_socket.sendall( send_string.encode() )
+            client_socket.sendall( header )
+            client_socket.sendall( the_map.dump_cells() )
+        return ""
+
+    if command_line[1] == "size":
+        if len(command_line) < 5:
+            send_string = "Please provide a width, height and cell size. For example: map size 64 64 10\n"
+            return send_string
+        try:
+            width = int(command_line[2])
+            height = int(command_line[3])
+            cell_size = int(command_line[4])
+        except:
+            send_string = "Please use whole numbers for the map size.\n"
+            return send_string
+        if robot.set_map_size(width, height, cell_size):
+            send_string = "Created a new " + str(width) + " x " + str(height) + " map.\n"
+        else:
+            send_string = "Unable to create a map that size. The map can use up to "
+            send_string += str(MAP_MAX_BYTES) + " bytes, with cells from 1 to "
+            send_string += str(MAP_MAX_CELL_SIZE) + " cm.\n"
+        return send_string
+
+    send_string = "I did not understand. Please use 'map', 'map clear', 'map dump' or 'map size'.\n"
+    return send_string
+
+
+# The trail is the list of places the robot stopped at after each
+# motion. We can report it, clear it, drive along it again, drive
+# back along it to get home, or download it as a binary block.
+# trajectory.read_dump() decodes the download.
+def trail_command(command_line, client_socket):
+    global robot
+    trail = robot.get_trajectory()
+
+    if len(command_line) < 2:
+        send_string = "Trail: " + str(trail.count) + " of " + str(trail.capacity) + " motions recorded.\n"
+        last = trail.get_last()
+        if last:
+            send_string += "Last position: (" + str(round(last[1], 2)) + ", " + str(round(last[2], 2))
+            send_string += ") facing " + str(round(last[3], 1)) + " degrees\n"
+        return send_string
+
+    if command_line[1] == "clear":
+        robot.clear_trajectory()
+        send_string = "Trail cleared.\n"
+    elif command_line[1] == "replay":
+        if robot.enter_replay_mode():
+            send_string = "Driving along the recorded trail.\n"
+        else:
+            send_string = "There is no trail to follow.\n"
+    elif command_line[1] == "retrace":
+        if robot.enter_retrace_mode():
+            send_string = "Retracing the trail back home.\n"
+        else:
+            send_string = "There is no trail to follow.\n"
+    elif command_line[1] == "dump":
+        if not client_socket:
+            send_string = "The trail can only be downloaded over the network.\n"
+            return send_string
+        header = trail.dump_header()
+        blocks = trail.dump_rows()
+        size = len(header)
+        for block in blocks:
+            size += len(block)
+        send_string = "Trail dump " + str(size) + " bytes\n"
+        with send_lock:
+            client_socket.sendall( send_string.encode() )
+            client_socket.sendall( header )
+            for block in blocks:
+                client_socket.sendall( block )
+        send_string = ""
+    else:
+        send_string = "I did not understand. Please use 'trail', 'trail clear', 'trail replay', 'trail retrace' or 'trail dump'.\n"
+    return send_string
+
+
+# Show the calibration values, change one of them, or
+# put them all back to their defaults. Changes are used
+# immediately and saved to flash so they survive a reboot.
+def calibrate(command_line):
+    global robot
+
+    if len(command_line) < 2:
+        calibration = robot.get_calibration()
+        send_string = "Calibration values:\n"
+        for name in sorted(calibration):
+            send_string += name + ": " + str(calibration[name]) + "\n"
+        return send_string
+
+    if command_line[1] == "turn":
+        return calibrate_turn(command_line)
+
+    if command_line[1] == "defaults":
+        if robot.reset_calibration():
+            send_string = "Calibration restored to default values.\n"
+        else:
+            send_string = "Calibration restored to default values, but unable to save them. "
+            send_string += "The saved values come back on a restart.\n"
+        return send_string
+
+    if len(command_line) < 3:
+        send_string = "Please provide a calibration name and a new value. For example: calibrate left_motor_adjust 1.1\n"
+        return send_string
+
+    try:
+        new_value = float(command_line[2])
+    except:
+        send_string = "I did not understand " + command_line[2] + ". Please use a number.\n"
+        return send_string
+
+    if not robot.valid_calibration(command_line[1], new_value):
+        send_string = "Unable to set " + command_line[1] + " to " + command_line[2] + "\n"
+    elif robot.set_calibration(command_line[1], new_value):
+        send_string = "Set " + command_line[1] + " to " + str(new_value) + "\n"
+    else:
+        # The robot is using the new value, it just will not survive a restart
+        send_string = "Set " + command_line[1] + " to " + str(new_value)
+        send_string += ", but unable to save it. It goes back to the saved value on a restart.\n"
+    return send_string
+
+
+# Scripts are lists of commands stored on the Pico's flash.
+# "script save <name>" records the lines which follow, up to a line
+# saying "end". "script save <name> cmd; cmd; cmd" saves in one go.
+# "script run <name> [times|loop]" runs the commands right here,
+# without waiting on the network between them.
+def script_command(command_line, client_socket):
+    global script_recording
+    global script_lines
+
+    if len(command_line) < 2 or command_line[1] == "list":
+        names = scripts.list_scripts()
+        if not names:
+            send_string = "There are no scripts saved.\n"
+            return send_string
+        send_string = "Scripts: " + " ".join(names) + "\n"
+        return send_string
+
+    if len(command_line) < 3:
+        send_string = "Please provide the name of the script.\n"
+        return send_string
+
+    name = command_line[2]
+    if not scripts.valid_name(name):
+        send_string = "Script names can use up to 20 letters, numbers, - and _\n"
+        return send_string
+
+    if command_line[1] == "save":
+        if len(command_line) > 3:
+            lines = " ".join(command_line[3:]).split(";")
+            if scripts.save_script(name, lines):
+                send_string = "Saved script " + name + "\n"
+            else:
+                send_string = "Unable to save script " + name + "\n"
+            return send_string
+        script_recording = name
+        script_lines = []
+        send_string = "Recording script " + name + ". Send 'end' on a line by itself to finish.\n"
+    elif command_line[1] == "show":
+        commands = scripts.load_script(name)
+        if commands is None:
+            send_string = "There is no script called " + name + "\n"
+        else:
+            send_string = "\n".join(commands) + "\n"
+    elif command_line[1] == "delete":
+        if scripts.delete_script(name):
+            send_string = "Deleted script " + name + "\n"
+        else:
+            send_string = "There is no script called " + name + "\n"
+    elif command_line[1] == "run":
+        times = 1
+        if len(command_line) > 3:
+            if command_line[3] == "loop":
+                times = 0
+            else:
+                try:
+                    times = int(command_line[3])
+                except:
+                    send_string = "Please say how many times to run the script, or loop.\n"
+                    return send_string
+        send_string = run_script(name, times, client_socket)
+    else:
+        send_string = "I did not understand. Please use script list, save, show, run or delete.\n"
+    return send_string
+
+
+# Add lines to the script we are recording, or save it when we see "end".
+def record_script_lines(text):
+    global script_recording
+    global script_lines
+
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if line.lower() == "end":
+            name = script_recording
+            script_recording = None
+            if scripts.save_script(name, script_lines):
+                return "Saved script " + name + " with " + str(len(script_lines)) + " commands.\n"
+            return "Unable to save script " + name + "\n"
+        script_lines.append(line)
+    return ""
+
+
+# Check whether we have been told to stop the script. That happens
+# when "halt" or "stop" comes in over the network or Bluetooth while
+# the script is running, or the client disconnects. check_for_stop()
+# only reads the network client's input when run from the network
+# thread, so a script started over Bluetooth just sees script_abort.
+def script_stop_requested():
+    if not script_abort:
+        check_for_stop()
+    return script_abort
+
+
+# Run a stored script "times" times, or until stopped if times is zero.
+# The replies from the commands are collected and sent back in one go.
+def run_script(name, times, client_socket):
+    global script_running
+    global script_abort
+
+    if script_running:
+        send_string = "A script is already running.\n"
+        return send_string
+    commands = scripts.load_script(name)
+    if commands is None:
+        send_string = "There is no script called " + name + "\n"
+        return send_string
+
+    script_running = True
+    script_abort = False
+    start_time = time.ticks_ms()
+    replies = ""
+    commands_run = 0
+    loops = 0
+    while (times == 0 or loops < times) and not script_stop_requested():
+        for command in commands:
+            if script_stop_requested():
+                break
+            # Scripts cannot run other scripts or disconnect the client
+            cmd = command.split()[0].lower()
+            if cmd == "script" or cmd == "exit":
+                continue
+            reply, status = run_command(command, client_socket)
+            commands_run += 1
+            if len(replies) < SCRIPT_MAX_REPLY:
+                replies += reply
+        loops += 1
+    script_running = False
+
+    run_time = time.ticks_diff(time.ticks_ms(), start_time) / 1000.0
+    if script_abort:
+        robot.enter_manual_mode()
+        replies += "Script " + name + " stopped. "
+    else:
+        replies += "Script " + name + " finished. "
+    replies += "Ran " + str(commands_run) + " commands in " + str(run_time) + " seconds.\n"
+    script_abort = False
+    return replies
+
+
+# Did the command which gave this reply fail?
+def reply_failed(reply):
+    for start in FAILED_REPLIES:
+        if reply.startswith(start):
+            return True
+    return False
+
+
+# "batch [stop] command; command; ..." runs several commands from one
+# message and sends back one reply for all of them. With "stop" we do
+# not run anything after the first command which fails.
+def batch_command(command_line, client_socket):
+    if len(command_line) < 2:
+        send_string = "Please provide commands separated by ; such as: batch hello; speed 50; forward 2\n"
+        return send_string
+
+    stop_on_failure = command_line[1] == "stop"
+    if stop_on_failure:
+        text = " ".join(command_line[2:])
+    else:
+        text = " ".join(command_line[1:])
+    commands = []
+    for command in text.split(";"):
+        command = command.strip()
+        if command:
+            commands.append(command)
+    if not commands:
+        send_string = "Please provide commands separated by ;\n"
+        return send_string
+
+    send_string = ""
+    commands_run = 0
+    failures = 0
+    for command in commands:
+        if robot.stop_requested:
+            send_string += "Stopped before command " + str(commands_run + 1) + ".\n"
+            break
+        cmd = command.split()[0].lower()
+        # A batch cannot hold another batch, run scripts or disconnect the client
+        if cmd == "batch" or cmd == "script" or cmd == "exit":
+            reply = "Cannot run " + cmd + " inside a batch.\n"
+        else:
+            reply, status = run_command(command, client_socket)
+        commands_run += 1
+        if reply_failed(reply):
+            failures += 1
+            send_string += str(commands_run) + " failed: " + reply
+            if stop_on_failure:
+                break
+        elif len(send_string) < SCRIPT_MAX_REPLY:
+            send_string += str(commands_run) + " ok: " + reply
+    send_string += "Batch ran " + str(commands_run) + " of " + str(len(commands))
+    send_string += " commands, " + str(failures) + " failed.\n"
+    return send_string
+
+
+# Send a reply to whoever sent us a command. If client_socket is
+# False then the request came from Bluetooth.
+def send_reply(client_socket, send_string):
+    global bluetooth_connection
+
+    if not send_string:
+        return
+    if client_socket:
+        with send_lock:
+            client_socket.send( send_string.encode() )
+    else:
+        bluetooth_connection.send( send_string )
+
+
 # Parse command, call any appropriate function to match the request.
 # Return response to client_socket. If client_socket is False then
 # we assume the request come from Bluetooth and send a response over
 # BT.
 def parse_incoming_command(command, client_socket):
+    if script_recording is not None:
+        send_string = record_script_lines(command)
+        send_reply(client_socket, send_string)
+        return True
+
+    send_string, return_value = run_command(command, client_socket)
+    send_reply(client_socket, send_string)
+    return return_value
+
+
+# Run one command and return the reply to send back and
+# whether the client should stay connected. We note how long
+# each command takes and how much memory it allocates.
+def run_command(command, client_socket):
+    allocated = gc.mem_alloc()
+    start_time = time.ticks_us()
+    send_string, return_value = dispatch_command(command, client_socket)
+    run_time = time.ticks_diff(time.ticks_us(), start_time)
+    allocated = gc.mem_alloc() - allocated
+    if send_string.startswith("Command not recognized") or send_string.startswith("Nothing received"):
+        name = "?"
+    else:
+        name = command.split()[0].lower()
+    failed = reply_failed(send_string)
+    if failed and robot.stop_requested:
+        # It gave up because it was told to stop, not because of a problem
+        send_string = "Stopped part way through " + name + ".\n"
+        failed = False
+    latency_stats.add(name, run_time, failed)
+    if failed:
+        event_log.add(eventlog.EVENT_COMMAND_FAILED, value=eventlog.pack_name(name))
+    memory_monitor.add_command(name, allocated)
+    return (send_string, return_value)
+
+
+# Call the function which handles the command
+def dispatch_command(command, client_socket):
     global robot
-    global bluetooth_connection
 
     command_and_args = command.split()
     return_value = True
@@ -841,32 +2119,58 @@ def parse_incoming_command(command, client_socket):
 
     if args_length < 1:
        send_string = "Nothing received\n"
+    elif cmd == "arc":
+        send_string = move_in_arc(command_and_args)
     elif cmd == "art":
         send_string = create_art(command_and_args)
     elif cmd == "avoid":
         send_string = avoid_mode()
+    elif cmd == "batch":
+        send_string = batch_command(command_and_args, client_socket)
+    elif cmd == "bench":
+        send_string = bench_command(command_and_args)
+    elif cmd == "boot":
+        send_string = boot_report()
     elif cmd == "bright":
         send_string = set_light_brightness(command_and_args)
+    elif cmd == "calibrate":
+        send_string = calibrate(command_and_args)
     elif cmd == "circle":
         send_string = move_in_circle(command_and_args)
+    elif cmd == "coverage":
+        send_string = coverage_report(command_and_args)
     elif cmd == "colour":
-        send_string = colour_detect(command_and_args)
+        if reply_format == FORMAT_TEXT or args_length > 1:
+            send_string = colour_detect(command_and_args)
+        else:
+            send_string = send_structured(fill_colour, client_socket)
     elif cmd == "direction":
         send_string = set_direction(command_and_args)
     elif cmd == "distance":
-        send_string = get_distance()
+        if reply_format == FORMAT_TEXT:
+            send_string = get_distance()
+        else:
+            send_string = send_structured(fill_distance, client_socket)
+    elif cmd == "draw":
+        send_string = draw_shape(command_and_args)
+    elif cmd == "drive":
+        send_string = drive_command(command_and_args)
     elif cmd == "echo":
        send_string = command + "\n"
     elif cmd == "exit":
        send_string = "Good-bye\n"
        return_value = False
+    elif cmd == "explore":
+        send_string = explore_mode()
     elif cmd == "follow":
         send_string = follow_mode()
+    elif cmd == "format":
+        send_string = format_command(command_and_args)
     elif cmd == "forward":
         send_string = move_forward(command_and_args)
     elif cmd == "goto":
         send_string = goto_mode(command_and_args)
-    elif cmd == "halt":
+    elif cmd == "halt" or cmd == "stop":
         send_string = halt_buggy()
     elif cmd == "hello":
        send_string = "Hello\n"
@@ -885,18 +2189,33 @@ def parse_incoming_command(command, client_socket):
         send_string = change_lights(command_and_args)
     elif cmd == "line":
         send_string = follow_line(command_and_args)
+    elif cmd == "log":
+        send_string = log_command(command_and_args)
+    elif cmd == "loop":
+        send_string = loop_report(command_and_args)
     elif cmd == "manual":
         send_string = manual_mode()
+    elif cmd == "mem":
+        send_string = memory_report(command_and_args)
+    elif cmd == "map":
+        send_string = map_command(command_and_args, client_socket)
     elif cmd == "pen":
         send_string = hold_pen(command_and_args)
     elif cmd == "play":
         send_string = play_mode()
     elif cmd == "position":
         send_string = set_position(command_and_args)
+    elif cmd == "record":
+        send_string = record_command(command_and_args)
     elif cmd == "reverse":
         send_string = move_reverse(command_and_args)
+    elif cmd == "script":
+        send_string = script_command(command_and_args, client_socket)
     elif cmd == "sensors":
-        send_string = light_sensors(command_and_args)
+        if reply_format == FORMAT_TEXT or args_length > 1:
+            send_string = light_sensors(command_and_args)
+        else:
+            send_string = send_structured(fill_sensors, client_socket)
     elif cmd == "sleep":
        send_string = go_to_sleep(command_and_args, client_socket)
     elif cmd == "speed":
@@ -906,11 +2225,20 @@ def parse_incoming_command(command, client_socket):
     elif cmd == "square":
         send_string = move_in_square(command_and_args)
     elif cmd == "status":
-        send_string = get_status()
+        if reply_format == FORMAT_TEXT:
+            send_string = get_status()
+        else:
+            send_string = send_structured(fill_status, client_socket)
+    elif cmd == "stats":
+        send_string = latency_report(command_and_args)
     elif cmd == "step":
         send_string = move_forward(command_and_args)
+    elif cmd == "subscribe":
+        send_string = subscribe(command_and_args, client_socket)
     elif cmd == "temp":
         send_string = sense_temperature()
+    elif cmd == "trail":
+        send_string = trail_command(command_and_args, client_socket)
     elif cmd == "track":
         send_string = stay_inside_track(command_and_args)
     elif cmd == "triangle":
@@ -919,25 +2247,39 @@ def parse_incoming_command(command, client_socket):
         send_string = turn_buggy(command_and_args)
     elif cmd == "turnto":
         send_string = turn_buggy_to(command_and_args)
+    elif cmd == "unsubscribe":
+        send_string = unsubscribe()
     elif cmd == "wander":
         send_string = wander_mode()
     elif cmd == "where":
-        send_string = where_report()
+        if reply_format == FORMAT_TEXT:
+            send_string = where_report()
+        else:
+            send_string = send_structured(fill_where, client_socket)
+    elif cmd == "wifi":
+        send_string = wifi_report()
     else:
        send_string = "Command not recognized.\n"
 
-    if client_socket:
-        client_socket.send( send_string.encode() )
-    else:
-        bluetooth_connection.send( send_string )
-    return return_value
+    return (send_string, return_value)
 
 
 
+# Serve clients until the Wi-Fi connection goes away, then return
 def create_network_service(host='0.0.0.0', port=DEFAULT_PORT):
+    global network_thread
+    global stop_socket
+    global stop_poller
+    global early_input
+    global last_stop_scan
+    global last_received
+
     server_running = True
+    network_thread = _thread.get_ident()
     # Create a socket object
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # We bind the port again each time the Wi-Fi comes back
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     bind_completed = False
     while not bind_completed:
         try:
@@ -945,69 +2287,184 @@ def create_network_service(host='0.0.0.0', port=DEFAULT_PORT):
           bind_completed = True
         except:
           print("Unable to bind port. Trying again in ten seconds.")
+          event_log.add(eventlog.EVENT_BIND_FAILED)
           time.sleep(10)
+          if not link_watchdog.link_up():
+              server_socket.close()
+              return
            
     # Listen for incoming connections
     server_socket.listen(5)
     print(f"Server listening on {host}:{port}")
-
+    if not boot_ready():
+        boot_phase("accepting commands")
+        # Remember the access point, so we join faster next time.
+        # This only scans for it the first time.
+        if wlan and credentials:
+            wifi.save_cache(wlan, credentials[0])
+
+    # Take wheel speeds over UDP too, and let clients find us
+    if not drive_link.start(host, wlan.ifconfig()[1], port):
+        print("Unable to start the UDP drive channel.")
+
+    # Wake up now and then to check the Wi-Fi is still there
+    server_socket.settimeout(LINK_CHECK_MS / 1000)
     # _thread.start_new_thread(Update_Everything, ())
     while server_running:
         # Accept new connections
-        client_socket, address = server_socket.accept()
+        try:
+            client_socket, address = server_socket.accept()
+        except OSError:
+            server_running = link_watchdog.link_up()
+            continue
+        client_socket.settimeout(None)
         print(f"Connected to {address}")
+        event_log.add(eventlog.EVENT_CONNECT, value=eventlog.pack_address(address[0]))
         client_socket.send( "Hello, I am Ron the robot!\n".encode() )
         client_socket.send( "Type 'help' to get a list of recognized commands.\n".encode() )
 
         Reset_Everything()
         previous_command = ""
+        received = ""
+        poller = select.poll()
+        poller.register(client_socket, select.POLLIN)
+        early_input = ""
+        stop_socket = client_socket
+        stop_poller = poller
         
         # Receive data from the client
         keep_running = True
+        send_reply(client_socket, PROMPT)
         while keep_running:
-            client_socket.send( "Ron is ready> ".encode() )
-            data = client_socket.recv(1024)
-            if data:
-               if data.decode()[0] == "!":
+            # Clients can send several commands at once, one per line,
+            # and a line can arrive in pieces
+            if received:
+               wait = PARTIAL_LINE_MS
+            else:
+               wait = LINK_CHECK_MS
+            if not poller.poll(wait):
+               if received:
+                   # A client which does not end its command with a new
+                   # line has finished sending it, so take what we have
+                   received += "\n"
+                   last_stop_scan = time.ticks_us()
+               else:
+                   # Nothing from the client. If the Wi-Fi has gone, so have they.
+                   if not link_watchdog.link_up():
+                       keep_running = False
+                       server_running = False
+                   continue
+            else:
+               try:
+                   data = client_socket.recv(RECEIVE_SIZE)
+               except OSError:
+                   data = b""
+               last_stop_scan = time.ticks_us()
+               last_received = time.ticks_ms()
+               if not data:
+                   keep_running = False
+                   continue
+               received += data.decode()
+            # A stop goes ahead of everything else
+            rest = after_last_stop(received)
+            if rest is not None:
+               stop_now("network", last_stop_scan)
+               received = rest
+            while keep_running and "\n" in received:
+               command, received = received.split("\n", 1)
+               if not is_stop_command(command):
+                   # A new command after a stop may move the robot again
+                   robot.clear_stop()
+               # While the command runs, check_for_stop() carries on
+               # from what is still to come, part line and all
+               early_input = received
+               if command[:1] == "!":
                    status = parse_incoming_command(previous_command, client_socket)
                else:
-                   status = parse_incoming_command(data.decode(), client_socket)
-                   previous_command = data.decode()
+                   status = parse_incoming_command(command, client_socket)
+                   previous_command = command
                keep_running = status
-            else:
-               keep_running = False
+               if keep_running:
+                   send_reply(client_socket, PROMPT)
+               # Along with anything sent while that command ran. If it
+               # holds a stop we have already stopped.
+               received = early_input
+               early_input = ""
+               rest = after_last_stop(received)
+               if rest is not None:
+                   received = rest
 
         # Close the client socket
-        Reset_Everything()
+        stop_socket = None
+        stop_poller = None
+        event_log.add(eventlog.EVENT_DISCONNECT)
+        if server_running:
+            # The client left, so tidy up after them. If the Wi-Fi went
+            # instead, the robot carries on as it was until we are back.
+            Reset_Everything()
         client_socket.close()
+
+    server_socket.close()
+    if drive_link.stop():
+        robot.halt()
         
 
 
 # Define a callback function to handle received data
 def handle_bluetooth(new_data):
+    received_at = time.ticks_us()
     new_string = new_data.decode()
+    # A halt stops whatever is running, including a script
+    if is_stop_command(new_string):
+        stop_now("bluetooth", received_at)
+        if script_running:
+            return
+    else:
+        robot.clear_stop()
     # print("Data received: ", new_string)  # Print the received data
     status = parse_incoming_command(new_string, False)
     
 
 def main():
+    global wlan
+    global joined_with_cache
     
     # Init pico
     _thread.start_new_thread(Update_Everything, ())
-    delay = 1
-    my_address = False
-    credentials = read_network_credentials()
-    if credentials:
-        my_address = enable_networking(delay, credentials)
+    if not link_watchdog:
+       print("Unable to connect to network.")
+       led.value(0)
+       return
+
+    wlan, my_address, joined_with_cache = wifi.finish_join(wlan, credentials, joined_with_cache)
+    link_watchdog.wlan = wlan
     if my_address:
+       boot_phase("wi-fi joined")
+       link_watchdog.link_found(my_address, time.ticks_ms())
+    else:
+       link_watchdog.link_lost(time.ticks_ms())
+
+    # Keep serving clients, joining the Wi-Fi again whenever it goes.
+    # The robot carries on as it was while we are away.
+    while True:
+       if not my_address:
+          print("Unable to connect to network. Trying again.")
+          led.value(0)
+          my_address = link_watchdog.reconnect()
+          wlan = link_watchdog.wlan
+          event_log.add(eventlog.EVENT_WIFI_UP, extra=link_watchdog.tries,
+                        value=link_watchdog.last_outage())
+          if not boot_ready():
+             boot_phase("wi-fi joined")
        print("My IP address ", my_address)
        led.value(1)
        # Set up listening socket and parse commands
        create_network_service(my_address, DEFAULT_PORT)
 
-    else:
-       print("Unable to connect to network.")
-       led.value(0)
+       print("Lost the Wi-Fi connection.")
+       link_watchdog.link_lost(time.ticks_ms())
+       event_log.add(eventlog.EVENT_WIFI_DOWN)
+       my_address = False
 
     
 
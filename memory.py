@@ -0,0 +1,146 @@
+import array
+import gc
+import time
+
+# Keep an eye on the Pico's heap.
+#
+# The update loop calls check() every tick. That notices when the
+# garbage collector has run (the memory in use drops) and every
+# SAMPLE_MS records the free and used memory. It never collects or
+# allocates itself: the update loop steps the motors and the other
+# threads allocate while it runs, so it must not stall or use up the
+# heap.
+#
+# The "mem" command calls measure() from the network thread. That runs
+# a collection, timing how long the pause is, and finds the largest
+# block which could still be allocated, which is what decides whether
+# a big bytearray (a map, say) will fit. That takes several
+# collections, so it is only done when asked for.
+#
+# run_command() in main.py also tells us how much memory each command
+# allocated, so the hungry ones can be found. The update thread keeps
+# running while a command does, so these numbers are a close guide
+# rather than exact.
+
+SAMPLE_MS = 5000
+# Search for the largest free block to the nearest this many bytes
+LARGEST_BLOCK_STEP = 256
+# How many samples we keep
+HISTORY = 32
+
+
+# The biggest bytearray we could allocate right now. Each try is thrown
+# away and collected before the next, so this takes a few collections.
+def largest_free_block():
+   low = 0
+   high = gc.mem_free()
+   while high - low > LARGEST_BLOCK_STEP:
+       size = (low + high) // 2
+       try:
+           block = bytearray(size)
+           block = None
+           low = size
+       except MemoryError:
+           high = size
+       gc.collect()
+   return low
+
+
+class MemoryMonitor:
+
+   def __init__(self):
+       self.history_time = array.array("I", [0] * HISTORY)
+       self.history_free = array.array("I", [0] * HISTORY)
+       self.commands = {}
+       self.reset()
+
+
+   def reset(self):
+       self.next_sample = time.ticks_ms()
+       self.history_count = 0
+       self.last_alloc = gc.mem_alloc()
+       self.free = gc.mem_free()
+       self.allocated = self.last_alloc
+       self.lowest_free = self.free
+       self.largest_block = 0
+       self.smallest_block = 0
+       self.collections = 0
+       self.last_pause_us = 0
+       self.longest_pause_us = 0
+       self.commands.clear()
+
+
+   # Call often. Counts collections and takes a sample when one is due.
+   def check(self, now):
+       allocated = gc.mem_alloc()
+       if allocated < self.last_alloc:
+           self.collections += 1
+       self.last_alloc = allocated
+       if time.ticks_diff(now, self.next_sample) >= 0:
+           self.next_sample = time.ticks_add(now, SAMPLE_MS)
+           self.sample(now)
+
+
+   def sample(self, now):
+       self.free = gc.mem_free()
+       self.allocated = gc.mem_alloc()
+       self.last_alloc = self.allocated
+       if self.free < self.lowest_free:
+           self.lowest_free = self.free
+       index = self.history_count % HISTORY
+       self.history_time[index] = now
+       self.history_free[index] = self.free
+       self.history_count += 1
+
+
+   # Time a collection and find the largest free block. Takes several
+   # collections, so only call it when asked to.
+   def measure(self, now):
+       start = time.ticks_us()
+       gc.collect()
+       pause = time.ticks_diff(time.ticks_us(), start)
+       self.collections += 1
+       self.last_pause_us = pause
+       if pause > self.longest_pause_us:
+           self.longest_pause_us = pause
+
+       self.largest_block = largest_free_block()
+       if self.smallest_block == 0 or self.largest_block < self.smallest_block:
+           self.smallest_block = self.largest_block
+       self.sample(now)
+
+
+   # Samples we still have, oldest first, as (time_ms, free) pairs
+   def get_history(self):
+       count = min(self.history_count, HISTORY)
+       history = []
+       for sample in range(self.history_count - count, self.history_count):
+           index = sample % HISTORY
+           history.append( (self.history_time[index], self.history_free[index]) )
+       return history
+
+
+   # Record that a command allocated this many bytes. run_command()
+   # works it out from gc.mem_alloc() before and after.
+   def add_command(self, name, allocated):
+       if allocated < 0:
+           # A collection ran part way through, so we cannot tell
+           return
+       stats = self.commands.get(name)
+       if stats is None:
+           stats = [0, 0, 0]
+           self.commands[name] = stats
+       stats[0] += 1
+       stats[1] += allocated
+       if allocated > stats[2]:
+           stats[2] = allocated
+
+
+   # Commands as (name, runs, average bytes, most bytes), hungriest first
+   def get_command_stats(self):
+       results = []
+       for name in self.commands:
+           runs, total, most = self.commands[name]
+           results.append( (name, runs, total // runs, most) )
+       results.sort(key=lambda result: result[2], reverse=True)
+       return results
@@ -0,0 +1,224 @@
+import math
+import time
+import _thread
+
+# Ramp the motors up and down instead of switching them straight to a
+# new power.
+#
+# Jumping from stopped to full power makes the wheels slip and draws a
+# spike of current, and the robot does not really go the speed it was
+# set to until it has caught up. That throws out the odometry, which
+# works from the speeds we asked for.
+#
+# MotorRamp sits between the robot and the buggy. The robot calls its
+# motorOn() and motorOff() exactly as it would the buggy's, which sets
+# the power each motor should end up at. step() is called on every tick
+# of the control loop and moves each motor's real power toward that, by
+# at most "accel" (speeding up) or "decel" (slowing down) percent of
+# full power per second. The motor with the furthest to go sets the
+# pace and the other keeps in step with it, so both get there at the
+# same time. A motor changing direction slows to a stop first. With
+# accel or decel set to 0 the change is made at once.
+#
+# The robot also tells us the wheel rates (steps per second) it expects
+# at the power it asked for. get_rates() scales those by how far the
+# motors have got, so the odometry follows the ramp.
+
+DEFAULT_ACCEL = 200
+DEFAULT_DECEL = 300
+# A late step does not speed the motors up by more than this much time.
+# Slowing down is never held back.
+MAX_STEP_MS = 100
+
+
+# Motions are timed as if the motors changed speed at once. Returns how
+# long to run at top_speed, starting and finishing stopped, to cover the
+# same distance as top_speed for "seconds" would.
+def ramped_time(seconds, top_speed, accel, decel):
+   if seconds <= 0 or top_speed <= 0 or accel <= 0:
+       return seconds
+   up_time = top_speed / accel
+   down_time = 0.0
+   if decel > 0:
+       down_time = top_speed / decel
+   # Speeding up loses half the ramp's time at top speed, slowing down
+   # after we stop gains half of its
+   run_time = seconds + (up_time - down_time) / 2
+   if run_time >= up_time:
+       return run_time
+   # We never reach top speed: the power climbs for run_time and then
+   # falls, covering accel * run_time ** 2 * (1 + accel / decel) / 2
+   falling = 0.0
+   if decel > 0:
+       falling = accel / decel
+   return math.sqrt(2 * top_speed * seconds / (accel * (1 + falling)))
+
+
+class MotorRamp:
+
+   def __init__(self, buggy, forward_direction, reverse_direction,
+                accel=DEFAULT_ACCEL, decel=DEFAULT_DECEL):
+       self.buggy = buggy
+       self.forward_direction = forward_direction
+       self.reverse_direction = reverse_direction
+       self.accel = accel
+       self.decel = decel
+       # step() runs in the update thread and while motions wait,
+       # which may be in the network thread
+       self.lock = _thread.allocate_lock()
+       self.sides = ("l", "r")
+       # Power is signed, positive is forward
+       self.target = [0.0, 0.0]
+       self.power = [0.0, 0.0]
+       # The wheel rate the robot expects at full_power
+       self.full_rate = [0.0, 0.0]
+       self.full_power = [0.0, 0.0]
+       self.last_step = time.ticks_ms()
+
+
+   def set_ramps(self, accel, decel):
+       self.accel = accel
+       self.decel = decel
+
+
+   def is_ramping(self):
+       return self.power[0] != self.target[0] or self.power[1] != self.target[1]
+
+
+   def motorOn(self, side, direction, power):
+       if direction != self.forward_direction:
+           power = -power
+       self.set_target(self.sides.index(side), power)
+
+
+   def motorOff(self, side):
+       self.set_target(self.sides.index(side), 0.0)
+
+
+   def set_target(self, wheel, power):
+       if not self.is_ramping():
+           # Time the ramp from now, not from the last time we moved
+           self.last_step = time.ticks_ms()
+       self.target[wheel] = power
+       if self.accel <= 0 and self.decel <= 0:
+           # No ramps, so no need to wait for step()
+           self.set_power(wheel, power)
+
+
+   # Turn both motors off straight away, for an emergency
+   def stop_now(self):
+       with self.lock:
+           for wheel in range(2):
+               self.target[wheel] = 0.0
+               self.set_power(wheel, 0.0)
+
+
+   # The wheel rates, in steps per second, the robot expects once the
+   # motors reach the power it last asked for. A wheel being stopped
+   # keeps the rate it had, as it slows down from that.
+   def set_rates(self, left_rate, right_rate):
+       for wheel, rate in ((0, left_rate), (1, right_rate)):
+           if self.target[wheel] != 0:
+               self.full_rate[wheel] = rate
+               self.full_power[wheel] = self.target[wheel]
+
+
+   # The wheel rates at the power the motors have now
+   def get_rates(self):
+       rates = []
+       for wheel in range(2):
+           if self.full_power[wheel] == 0:
+               rates.append(0.0)
+           else:
+               rates.append(self.full_rate[wheel] * self.power[wheel] / self.full_power[wheel])
+       return rates
+
+
+   # Move the motors toward their targets. Returns True if the power
+   # changed.
+   def step(self, now):
+       with self.lock:
+           elapsed_ms = time.ticks_diff(now, self.last_step)
+           if elapsed_ms <= 0 or not self.is_ramping():
+               return False
+           self.last_step = now
+           # A motor changing direction has to stop first
+           goal = [0.0, 0.0]
+           # How long each motor needs to get there, in ms
+           time_needed = [0.0, 0.0]
+           speeding_up = False
+           for wheel in range(2):
+               power = self.power[wheel]
+               target = self.target[wheel]
+               if power * target >= 0:
+                   goal[wheel] = target
+               change = abs(goal[wheel] - power)
+               if abs(goal[wheel]) > abs(power):
+                   rate = self.accel
+                   speeding_up = True
+               else:
+                   rate = self.decel
+               if rate > 0:
+                   time_needed[wheel] = change * 1000 / rate
+           if speeding_up:
+               elapsed_ms = min(elapsed_ms, MAX_STEP_MS)
+           # Both motors get there together, so the robot keeps to the
+           # same curve while it speeds up or slows down
+           longest = max(time_needed)
+           for wheel in range(2):
+               if longest <= elapsed_ms:
+                   new_power = goal[wheel]
+               else:
+                   power = self.power[wheel]
+                   new_power = power + (goal[wheel] - power) * elapsed_ms / longest
+               self.set_power(wheel, new_power)
+           return True
+
+
+   def set_power(self, wheel, power):
+       self.power[wheel] = power
+       side = self.sides[wheel]
+       if power > 0:
+           self.buggy.motorOn(side, self.forward_direction, power)
+       elif power < 0:
+           self.buggy.motorOn(side, self.reverse_direction, -power)
+       else:
+           self.buggy.motorOff(side)
+
+
+
+# Show a ramp and check ramped_time() on a computer. Run with
+# "python motors.py".
+def demo():
+   class Buggy:
+       def motorOn(self, side, direction, power):
+           pass
+       def motorOff(self, side):
+           pass
+
+   # The computer's time module has no ticks, so we keep our own clock
+   clock = [0]
+   time.ticks_ms = lambda: clock[0]
+   time.ticks_diff = lambda new, old: new - old
+   top_speed = 60
+   for seconds in (0.1, 0.3, 1.0, 3.0):
+       run_time = ramped_time(seconds, top_speed, DEFAULT_ACCEL, DEFAULT_DECEL)
+       ramp = MotorRamp(Buggy(), "f", "r")
+       clock[0] = 0
+       ramp.motorOn("l", "f", top_speed)
+       travelled = 0.0
+       stopped = False
+       while not stopped or ramp.is_ramping():
+           if not stopped and clock[0] >= run_time * 1000:
+               ramp.motorOff("l")
+               stopped = True
+           before = ramp.power[0]
+           clock[0] += 10
+           ramp.step(clock[0])
+           travelled += (before + ramp.power[0]) / 2 * 0.01
+       print("Asked for %.1f s at %d: ran %.3f s, travelled %.2f, wanted %.2f"
+             % (seconds, top_speed, run_time, travelled, top_speed * seconds))
+
+
+if __name__ == "__main__":
+   demo()
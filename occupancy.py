@@ -0,0 +1,206 @@
+import array
+import math
+import struct
+
+# A small map of the floor around the robot, built from the distance sensors.
+#
+# The floor is cut into square cells. Each cell holds one signed byte, the
+# log-odds that something is there: negative means we have seen open floor,
+# positive means we have seen an object, zero means we do not know yet.
+# The cells live in one bytearray, so the memory used is exactly
+# width * height bytes and never grows. The robot's start position (0, 0)
+# is the centre of the map. Positions are in steps, like the rest of the
+# robot, and cell sizes are in cm.
+
+STEP_SIZE_CM = 30.0
+
+# How much one reading changes a cell's log-odds, and the limits. The
+# limits stop a cell becoming so certain it can never change its mind.
+LOG_ODDS_HIT = 12
+LOG_ODDS_MISS = -4
+LOG_ODDS_MAX = 100
+LOG_ODDS_MIN = -100
+
+# Cells above or below these values count as occupied or free
+OCCUPIED_LEVEL = 20
+FREE_LEVEL = -10
+
+# Readings further than this (cm) are too unreliable to mark an object
+MAX_RANGE_CM = 200
+
+# How many cells crossing watch_level we remember, for the planner
+CHANGE_HISTORY = 64
+
+# Header written in front of a map dump:
+# magic, version, width, height, cell size (cm)
+DUMP_HEADER = "<4sBHHH"
+DUMP_MAGIC = b"RMAP"
+DUMP_VERSION = 1
+
+
+class OccupancyGrid:
+
+   def __init__(self, width=64, height=64, cell_size_cm=10):
+       self.width = width
+       self.height = height
+       self.cell_size_cm = cell_size_cm
+       self.cell_size = cell_size_cm / STEP_SIZE_CM
+       self.cells = bytearray(width * height)
+       # Cells which went above or below watch_level, most recent last,
+       # so the planner can update just those. change_count counts them
+       # all, so anyone more than CHANGE_HISTORY behind knows it missed
+       # some.
+       self.watch_level = None
+       self.changes = array.array("H", [0] * CHANGE_HISTORY)
+       self.change_count = 0
+
+
+   def clear(self):
+       for index in range(len(self.cells)):
+           self.cells[index] = 0
+       # Every cell may have changed
+       self.change_count += CHANGE_HISTORY + 1
+
+
+   def size_in_bytes(self):
+       return len(self.cells)
+
+
+   # Which cell holds the position (x, y) in steps. Returns
+   # (column, row) which might be outside the map.
+   def cell_at(self, x, y):
+       if not (math.isfinite(x) and math.isfinite(y)):
+           # Nowhere on the map, rather than an error in the update thread
+           return (-1, -1)
+       column = int(math.floor(x / self.cell_size)) + self.width // 2
+       row = int(math.floor(y / self.cell_size)) + self.height // 2
+       return (column, row)
+
+
+   # Centre of a cell, in steps
+   def cell_centre(self, column, row):
+       x = (column - self.width // 2 + 0.5) * self.cell_size
+       y = (row - self.height // 2 + 0.5) * self.cell_size
+       return (x, y)
+
+
+   def in_map(self, column, row):
+       return column >= 0 and column < self.width and row >= 0 and row < self.height
+
+
+   # Log-odds of a cell, -128 to 127. Cells outside the map are unknown.
+   def get(self, column, row):
+       if not self.in_map(column, row):
+           return 0
+       value = self.cells[row * self.width + column]
+       if value > 127:
+           value -= 256
+       return value
+
+
+   def is_occupied(self, column, row):
+       return self.get(column, row) >= OCCUPIED_LEVEL
+
+
+   def is_free(self, column, row):
+       return self.get(column, row) <= FREE_LEVEL
+
+
+   def change(self, column, row, amount):
+       if not self.in_map(column, row):
+           return
+       index = row * self.width + column
+       value = self.cells[index]
+       if value > 127:
+           value -= 256
+       old_value = value
+       value += amount
+       if value > LOG_ODDS_MAX:
+           value = LOG_ODDS_MAX
+       elif value < LOG_ODDS_MIN:
+           value = LOG_ODDS_MIN
+       self.cells[index] = value & 0xFF
+       level = self.watch_level
+       if level is not None and (old_value >= level) != (value >= level):
+           self.changes[self.change_count % CHANGE_HISTORY] = index
+           self.change_count += 1
+
+
+   # Add one distance reading. The sensor is at (x, y) in steps, pointing
+   # in direction degrees. Every cell along the beam up to the object is
+   # more likely to be open floor and the cell at the end more likely to
+   # hold an object. A negative distance means the sensor saw nothing, so
+   # we clear the beam out to MAX_RANGE_CM.
+   def add_reading(self, x, y, direction, distance_cm):
+       hit = True
+       if distance_cm < 0 or distance_cm > MAX_RANGE_CM:
+           distance_cm = MAX_RANGE_CM
+           hit = False
+       distance = distance_cm / STEP_SIZE_CM
+       rads = math.radians(direction)
+       end_x = x + distance * math.sin(rads)
+       end_y = y + distance * math.cos(rads)
+
+       # Walk the beam half a cell at a time, marking each cell once
+       start_cell = self.cell_at(x, y)
+       end_cell = self.cell_at(end_x, end_y)
+       samples = int(distance / (self.cell_size * 0.5)) + 1
+       last_cell = None
+       for sample in range(samples):
+           fraction = sample / samples
+           cell = self.cell_at(x + (end_x - x) * fraction, y + (end_y - y) * fraction)
+           if cell == end_cell:
+               break
+           if cell != last_cell and cell != start_cell:
+               self.change(cell[0], cell[1], LOG_ODDS_MISS)
+           last_cell = cell
+       if hit:
+           self.change(end_cell[0], end_cell[1], LOG_ODDS_HIT)
+       elif end_cell != last_cell:
+           self.change(end_cell[0], end_cell[1], LOG_ODDS_MISS)
+
+
+   # Count cells which are occupied, free and unknown
+   def summary(self):
+       occupied = 0
+       free = 0
+       for value in self.cells:
+           if value > 127:
+               value -= 256
+           if value >= OCCUPIED_LEVEL:
+               occupied += 1
+           elif value <= FREE_LEVEL:
+               free += 1
+       unknown = len(self.cells) - occupied - free
+       return (occupied, free, unknown)
+
+
+   # A short header followed by the raw cells, row by row from the
+   # bottom (lowest y) up. Each cell is a signed byte.
+   def dump_header(self):
+       return struct.pack(DUMP_HEADER, DUMP_MAGIC, DUMP_VERSION,
+                          self.width, self.height, self.cell_size_cm)
+
+
+   def dump_cells(self):
+       return memoryview(self.cells)
+
+
+
+# Read a map dump on a computer. Returns (width, height, cell size in cm, rows)
+# where rows is a list of lists of log-odds values.
+def read_dump(data):
+   header_size = struct.calcsize(DUMP_HEADER)
+   magic, version, width, height, cell_size_cm = struct.unpack(DUMP_HEADER, data[:header_size])
+   if magic != DUMP_MAGIC or version != DUMP_VERSION:
+       raise ValueError("Not a robot map")
+   rows = []
+   for row in range(height):
+       start = header_size + row * width
+       values = []
+       for value in data[start:start + width]:
+           if value > 127:
+               value -= 256
+           values.append(value)
+       rows.append(values)
+   return (width, height, cell_size_cm, rows)
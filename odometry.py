@@ -0,0 +1,211 @@
+import math
+
+# Dead-reckoning for a two wheeled (differential drive) robot.
+#
+# The robot tells us how fast each wheel is being driven, in steps per second,
+# every time the motors change. Between changes both wheel speeds are constant,
+# which means the robot drives along an arc (or a straight line, or spins on
+# the spot) and we can integrate that arc exactly instead of guessing.
+#
+# Directions follow the rest of the robot code: 0 degrees is "up" the y axis
+# and angles grow clockwise, so turning right adds degrees. Positions are in
+# steps and are never rounded, the caller can round when reporting them.
+#
+# We also keep a rough estimate of how uncertain the pose is. Every step
+# driven and every degree turned adds a little error, and any heading error
+# makes the position error grow faster the further we drive.
+
+# Fraction of the distance driven we expect to be wrong (variance per step)
+DISTANCE_NOISE = 0.01
+# Heading variance (radians squared) added per radian turned
+TURN_NOISE = 0.02
+# Heading variance (radians squared) added per step driven, from wheel slip
+DRIFT_NOISE = 0.001
+
+TWO_PI = 2.0 * math.pi
+
+
+class Odometry:
+
+   def __init__(self, wheel_base):
+       # Distance between the wheels, in steps
+       self.wheel_base = wheel_base
+       self.reset()
+
+
+   def reset(self, x=0.0, y=0.0, direction=0.0):
+       self.left_rate = 0.0
+       self.right_rate = 0.0
+       self.set_pose(x, y, direction)
+
+
+   # Put the robot somewhere new. We trust the caller, so the
+   # uncertainty starts again from zero.
+   def set_pose(self, x, y, direction):
+       self.x = float(x)
+       self.y = float(y)
+       self.heading = math.fmod(math.radians(direction), TWO_PI)
+       if self.heading < 0:
+           self.heading += TWO_PI
+       self.position_variance = 0.0
+       self.heading_variance = 0.0
+       self.distance_travelled = 0.0
+
+
+   def set_position(self, x, y):
+       self.set_pose(x, y, self.get_direction())
+
+
+   def set_direction(self, direction):
+       self.set_pose(self.x, self.y, direction)
+
+
+   # The motors changed. The old wheel rates were used for "elapsed"
+   # seconds, so move along that arc, then remember the new rates.
+   def set_wheels(self, elapsed, left_rate, right_rate):
+       self.advance(elapsed)
+       self.left_rate = left_rate
+       self.right_rate = right_rate
+
+
+   # The motors sped up or slowed down steadily from the old wheel rates
+   # to these over "elapsed" seconds. Moving at the average of the two
+   # gets the distance exactly and the turn very nearly.
+   def ramp_wheels(self, elapsed, left_rate, right_rate):
+       self.left_rate = (self.left_rate + left_rate) * 0.5
+       self.right_rate = (self.right_rate + right_rate) * 0.5
+       self.advance(elapsed)
+       self.left_rate = left_rate
+       self.right_rate = right_rate
+
+
+   # Move along the current arc for "elapsed" seconds.
+   def advance(self, elapsed):
+       if elapsed <= 0:
+           return
+       if self.left_rate == 0 and self.right_rate == 0:
+           return
+       distance = (self.left_rate + self.right_rate) * 0.5 * elapsed
+       # Clockwise is positive, so the left wheel going faster turns right
+       turned = (self.left_rate - self.right_rate) * elapsed / self.wheel_base
+       self.move(distance, turned)
+
+
+   # Move "distance" steps while turning "turned" radians. Both happen at a
+   # constant rate so the path is an arc of radius distance / turned.
+   def move(self, distance, turned):
+       old_heading = self.heading
+       new_heading = old_heading + turned
+       if abs(turned) < 1e-6:
+           # Straight line, or near enough that the arc formula loses precision
+           middle = old_heading + turned * 0.5
+           self.x += distance * math.sin(middle)
+           self.y += distance * math.cos(middle)
+       else:
+           radius = distance / turned
+           self.x += radius * (math.cos(old_heading) - math.cos(new_heading))
+           self.y += radius * (math.sin(new_heading) - math.sin(old_heading))
+
+       self.heading = math.fmod(new_heading, TWO_PI)
+       if self.heading < 0:
+           self.heading += TWO_PI
+
+       # Grow the uncertainty. Heading error turns into sideways
+       # position error as we drive.
+       distance = abs(distance)
+       self.heading_variance += TURN_NOISE * abs(turned) + DRIFT_NOISE * distance
+       self.position_variance += DISTANCE_NOISE * distance
+       self.position_variance += distance * distance * self.heading_variance
+       self.distance_travelled += distance
+
+
+   def get_position(self):
+       return (self.x, self.y)
+
+
+   # Direction in degrees, always in the range 0 to just under 360
+   def get_direction(self):
+       direction = math.degrees(self.heading)
+       if direction >= 360.0:
+           direction -= 360.0
+       return direction
+
+
+   # Returns (position error in steps, heading error in degrees),
+   # each as one standard deviation.
+   def get_uncertainty(self):
+       return (math.sqrt(self.position_variance),
+               math.degrees(math.sqrt(self.heading_variance)))
+
+
+
+# Measure how far our position estimate drifts from the truth over a
+# long simulated wander, compared with the old way of tracking position
+# (rounding to two decimals each step and counting each turn as exactly
+# the angle we asked for). The simulated robot turns and drives a little
+# more or less than asked, the way the real one does when motor timing
+# and the battery vary. Run with "python odometry.py", and
+# test_odometry.py checks the results. Returns (old error, new error,
+# distance travelled, estimated uncertainty), all in steps.
+def simulate(moves=500, seed=1, verbose=True):
+   import random
+   random.seed(seed)
+
+   wheel_base = 0.4
+   speed = 1.0
+   truth = Odometry(wheel_base)
+   estimate = Odometry(wheel_base)
+   old_x = 0.0
+   old_y = 0.0
+   old_direction = 0
+
+   for move in range(moves):
+       if random.randint(0, 1):
+           # Turn, by spinning one wheel while the other is stopped
+           degrees = random.randint(-90, 90)
+           turn_rate = math.radians(270)
+           wheel_rate = turn_rate * wheel_base
+           planned_time = math.radians(abs(degrees)) / turn_rate
+           # The motors really ran a little longer, and we can measure that
+           actual_time = planned_time * random.uniform(1.0, 1.15)
+           if degrees < 0:
+               rates = (0.0, wheel_rate)
+           else:
+               rates = (wheel_rate, 0.0)
+           old_direction += degrees
+           while old_direction < 0:
+               old_direction += 360
+           while old_direction > 360:
+               old_direction -= 360
+       else:
+           steps = random.randint(1, 10) / 10.0
+           planned_time = steps / speed
+           actual_time = planned_time * random.uniform(1.0, 1.15)
+           rates = (speed, speed)
+           rads = math.radians(old_direction)
+           old_x = round(old_x + steps * math.sin(rads), 2)
+           old_y = round(old_y + steps * math.cos(rads), 2)
+
+       # The truth also has a little real wheel slip we cannot see
+       slip = random.uniform(0.99, 1.01)
+       truth.set_wheels(0, rates[0] * slip, rates[1])
+       truth.set_wheels(actual_time, 0.0, 0.0)
+       estimate.set_wheels(0, rates[0], rates[1])
+       estimate.set_wheels(actual_time, 0.0, 0.0)
+
+   old_error = math.sqrt((old_x - truth.x) ** 2 + (old_y - truth.y) ** 2)
+   new_error = math.sqrt((estimate.x - truth.x) ** 2 + (estimate.y - truth.y) ** 2)
+   travelled = truth.distance_travelled
+   uncertainty = estimate.get_uncertainty()[0]
+   if verbose:
+       print("Moves:", moves, " distance travelled:", round(travelled, 1), "steps")
+       print("Old position error:", round(old_error, 2), "steps")
+       print("New position error:", round(new_error, 2), "steps")
+       print("Estimated uncertainty:", round(uncertainty, 2), "steps")
+   return (old_error, new_error, travelled, uncertainty)
+
+
+if __name__ == "__main__":
+   for seed in range(1, 6):
+       simulate(500, seed)
+       print("")
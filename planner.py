@@ -0,0 +1,353 @@
+import array
+import math
+
+# Plan a route around known objects with the A* search.
+#
+# The search runs on a coarse version of the occupancy map: each planner
+# cell covers a square of scale x scale map cells and is blocked if any of
+# them has an object in it. That keeps the search small enough to finish
+# within one tick of the robot's update loop. All the working space is
+# allocated once, when the planner is created, and reused for every plan.
+#
+# The blocked cells are worked out from the whole map once. After that
+# the map tells us which cells crossed the blocked level, and only the
+# planner cells holding them are looked at again. A route is planned
+# again, from where the robot is, only when one of those changes lands
+# on the rest of the route. Each plan is a fresh A* search: keeping the
+# search's state between plans (D* Lite) would double the working space,
+# and a whole search already fits easily in one tick.
+#
+# Moves are to any of the eight neighbouring cells. Straight moves cost 10,
+# diagonal moves cost 14, and diagonal moves may not cut the corner of a
+# blocked cell.
+
+STRAIGHT_COST = 10
+DIAGONAL_COST = 14
+NOT_SEEN = 65535
+
+# Give up if the search takes more than this many steps
+MAX_EXPANSIONS = 4000
+
+
+class GridPlanner:
+
+   def __init__(self, occupancy, scale=2):
+       self.occupancy = occupancy
+       self.scale = scale
+       self.width = (occupancy.width + scale - 1) // scale
+       self.height = (occupancy.height + scale - 1) // scale
+       cells = self.width * self.height
+       self.blocked = bytearray(cells)
+       self.closed = bytearray(cells)
+       self.cost = array.array("H", bytes(2 * cells))
+       self.parent = array.array("H", bytes(2 * cells))
+       # The open list is a binary heap of (score, cell) packed into one
+       # number. A cell can be added again with a better score, so leave
+       # room for that.
+       self.heap = array.array("L", [0] * (2 * cells))
+       self.heap_size = 0
+       self.expansions = 0
+       # The start and goal of the plan being made
+       self.start = 0
+       self.goal = 0
+       # The blocked level and map change we last brought blocked up to
+       self.blocked_level = None
+       self.seen_changes = 0
+
+
+   # Bring the blocked planner cells up to date with the map. Any map
+   # cell with at least blocked_level log-odds makes its planner cell
+   # blocked. Returns True if any planner cell might have changed.
+   def update_blocked(self, blocked_level):
+       occupancy = self.occupancy
+       change_count = occupancy.change_count
+       if blocked_level != self.blocked_level or \
+          change_count - self.seen_changes > len(occupancy.changes):
+           # Start again from the whole map
+           occupancy.watch_level = blocked_level
+           self.blocked_level = blocked_level
+           self.seen_changes = occupancy.change_count
+           for row in range(self.height):
+               for column in range(self.width):
+                   self.update_cell(column, row)
+           return True
+       if change_count == self.seen_changes:
+           return False
+       changes = occupancy.changes
+       for change in range(self.seen_changes, change_count):
+           index = changes[change % len(changes)]
+           self.update_cell((index % occupancy.width) // self.scale,
+                            (index // occupancy.width) // self.scale)
+       self.seen_changes = change_count
+       return True
+
+
+   def update_cell(self, column, row):
+       occupancy = self.occupancy
+       scale = self.scale
+       is_blocked = 0
+       for map_row in range(row * scale, row * scale + scale):
+           for map_column in range(column * scale, column * scale + scale):
+               if occupancy.get(map_column, map_row) >= self.blocked_level:
+                   is_blocked = 1
+       self.blocked[row * self.width + column] = is_blocked
+
+
+   # Planner cell holding the position (x, y) in steps
+   def cell_at(self, x, y):
+       column, row = self.occupancy.cell_at(x, y)
+       return (column // self.scale, row // self.scale)
+
+
+   def cell_centre(self, column, row):
+       size = self.occupancy.cell_size * self.scale
+       x = (column + 0.5) * size - (self.occupancy.width // 2) * self.occupancy.cell_size
+       y = (row + 0.5) * size - (self.occupancy.height // 2) * self.occupancy.cell_size
+       return (x, y)
+
+
+   def in_grid(self, column, row):
+       return column >= 0 and column < self.width and row >= 0 and row < self.height
+
+
+   def is_blocked(self, column, row):
+       if not self.in_grid(column, row):
+           return True
+       return self.blocked[row * self.width + column] != 0
+
+
+   # Can a plan go through this cell? We are standing in the start cell
+   # and want to stand in the goal cell, so those are never blocked.
+   def is_open(self, column, row):
+       if not self.in_grid(column, row):
+           return False
+       cell = row * self.width + column
+       return self.blocked[cell] == 0 or cell == self.start or cell == self.goal
+
+
+   # Is the position (x, y), in steps, somewhere on the map we plan over?
+   def covers(self, x, y):
+       column, row = self.cell_at(x, y)
+       return self.in_grid(column, row)
+
+
+   def heuristic(self, column, row, goal_column, goal_row):
+       delta_column = abs(column - goal_column)
+       delta_row = abs(row - goal_row)
+       if delta_column > delta_row:
+           return DIAGONAL_COST * delta_row + STRAIGHT_COST * (delta_column - delta_row)
+       return DIAGONAL_COST * delta_column + STRAIGHT_COST * (delta_row - delta_column)
+
+
+   def heap_push(self, score, cell):
+       heap = self.heap
+       if self.heap_size >= len(heap):
+           return
+       item = (score << 16) | cell
+       position = self.heap_size
+       self.heap_size += 1
+       while position > 0:
+           parent = (position - 1) >> 1
+           if heap[parent] <= item:
+               break
+           heap[position] = heap[parent]
+           position = parent
+       heap[position] = item
+
+
+   def heap_pop(self):
+       heap = self.heap
+       top = heap[0]
+       self.heap_size -= 1
+       size = self.heap_size
+       if size > 0:
+           item = heap[size]
+           position = 0
+           while True:
+               child = 2 * position + 1
+               if child >= size:
+                   break
+               if child + 1 < size and heap[child + 1] < heap[child]:
+                   child += 1
+               if heap[child] >= item:
+                   break
+               heap[position] = heap[child]
+               position = child
+           heap[position] = item
+       return top & 0xFFFF
+
+
+   # Find a route from (start_x, start_y) to (goal_x, goal_y), in steps.
+   # Returns a list of (x, y) waypoints ending at the goal, leaving out the
+   # start, or None if there is no route we know of, or either end is off
+   # the map. Call update_blocked() first so the plan uses the latest map.
+   def plan(self, start_x, start_y, goal_x, goal_y):
+       if not (math.isfinite(goal_x) and math.isfinite(goal_y)):
+           return None
+       start_column, start_row = self.cell_at(start_x, start_y)
+       goal_column, goal_row = self.cell_at(goal_x, goal_y)
+       if not self.in_grid(start_column, start_row) or not self.in_grid(goal_column, goal_row):
+           return None
+       width = self.width
+       start = start_row * width + start_column
+       goal = goal_row * width + goal_column
+       self.start = start
+       self.goal = goal
+
+       for index in range(len(self.closed)):
+           self.closed[index] = 0
+           self.cost[index] = NOT_SEEN
+
+       self.heap_size = 0
+       self.cost[start] = 0
+       self.heap_push(self.heuristic(start_column, start_row, goal_column, goal_row), start)
+       self.expansions = 0
+       found = False
+       while self.heap_size > 0 and self.expansions < MAX_EXPANSIONS:
+           cell = self.heap_pop()
+           if self.closed[cell]:
+               continue
+           if cell == goal:
+               found = True
+               break
+           self.closed[cell] = 1
+           self.expansions += 1
+           column = cell % width
+           row = cell // width
+           cell_cost = self.cost[cell]
+           for delta_row in (-1, 0, 1):
+               for delta_column in (-1, 0, 1):
+                   if delta_row == 0 and delta_column == 0:
+                       continue
+                   next_column = column + delta_column
+                   next_row = row + delta_row
+                   if not self.is_open(next_column, next_row):
+                       continue
+                   if delta_row != 0 and delta_column != 0:
+                       # Do not squeeze diagonally past a blocked corner
+                       if not self.is_open(column, next_row) or not self.is_open(next_column, row):
+                           continue
+                       new_cost = cell_cost + DIAGONAL_COST
+                   else:
+                       new_cost = cell_cost + STRAIGHT_COST
+                   next_cell = next_row * width + next_column
+                   if self.closed[next_cell] or new_cost >= self.cost[next_cell]:
+                       continue
+                   self.cost[next_cell] = new_cost
+                   self.parent[next_cell] = cell
+                   score = new_cost + self.heuristic(next_column, next_row, goal_column, goal_row)
+                   self.heap_push(score, next_cell)
+
+       if not found:
+           return None
+       return self.make_waypoints(start, goal, goal_x, goal_y)
+
+
+   # Walk back from the goal to the start and keep only the cells
+   # where the route changes direction.
+   def make_waypoints(self, start, goal, goal_x, goal_y):
+       width = self.width
+       cells = []
+       cell = goal
+       while cell != start:
+           cells.append(cell)
+           cell = self.parent[cell]
+       cells.append(start)
+       cells.reverse()
+
+       waypoints = []
+       for index in range(1, len(cells) - 1):
+           before = cells[index - 1]
+           here = cells[index]
+           after = cells[index + 1]
+           if here - before != after - here:
+               waypoints.append(self.cell_centre(here % width, here // width))
+       waypoints.append( (goal_x, goal_y) )
+       return waypoints
+
+
+   # Check whether a straight line between two points (steps) crosses
+   # any blocked planner cell.
+   def line_blocked(self, from_x, from_y, to_x, to_y):
+       size = self.occupancy.cell_size * self.scale
+       distance = math.sqrt((to_x - from_x) ** 2 + (to_y - from_y) ** 2)
+       samples = int(distance / (size * 0.5)) + 1
+       start_cell = self.cell_at(from_x, from_y)
+       for sample in range(1, samples + 1):
+           fraction = sample / samples
+           cell = self.cell_at(from_x + (to_x - from_x) * fraction,
+                               from_y + (to_y - from_y) * fraction)
+           if cell != start_cell and self.is_blocked(cell[0], cell[1]):
+               return True
+       return False
+
+
+   # Is the rest of a route, from (x, y) through the waypoints, still
+   # clear? When a new object shows up we only need to plan again if it
+   # is on the route we are following.
+   def route_blocked(self, x, y, waypoints):
+       for waypoint in waypoints:
+           if self.line_blocked(x, y, waypoint[0], waypoint[1]):
+               return True
+           x, y = waypoint
+       return False
+
+
+
+# Time how long plans take on a computer. Run with "python planner.py".
+def benchmark(plans=20, seed=1):
+   import random
+   import time
+   from occupancy import OccupancyGrid
+
+   random.seed(seed)
+   grid = OccupancyGrid(64, 64, 10)
+   # Scatter some boxes and a wall with a gap in it
+   for box in range(25):
+       column = random.randint(0, 63)
+       row = random.randint(0, 63)
+       for map_row in range(row, min(64, row + 3)):
+           for map_column in range(column, min(64, column + 3)):
+               grid.change(map_column, map_row, 50)
+   for map_column in range(8, 56):
+       grid.change(map_column, 40, 50)
+
+   planner = GridPlanner(grid)
+   start = time.perf_counter()
+   planner.update_blocked(20)
+   blocked_time = time.perf_counter() - start
+
+   # Something new seen while driving only updates the cells it is in
+   for map_column in range(20, 23):
+       grid.change(map_column, 20, 50)
+   start = time.perf_counter()
+   planner.update_blocked(20)
+   changed_time = time.perf_counter() - start
+
+   total = 0.0
+   slowest = 0.0
+   found = 0
+   expansions = 0
+   for plan in range(plans):
+       start_x = random.uniform(-9.0, 9.0)
+       start_y = random.uniform(-9.0, 9.0)
+       goal_x = random.uniform(-9.0, 9.0)
+       goal_y = random.uniform(-9.0, 9.0)
+       start = time.perf_counter()
+       route = planner.plan(start_x, start_y, goal_x, goal_y)
+       taken = time.perf_counter() - start
+       total += taken
+       slowest = max(slowest, taken)
+       expansions += planner.expansions
+       if route:
+           found += 1
+   print("Planner grid:", planner.width, "x", planner.height)
+   print("Marking blocked cells:", round(blocked_time * 1000, 2), "ms")
+   print("Updating them for a new object:", round(changed_time * 1000, 2), "ms")
+   print("Plans:", plans, " routes found:", found)
+   print("Average plan:", round(total / plans * 1000, 2), "ms  slowest:", round(slowest * 1000, 2), "ms")
+   print("Average cells expanded:", expansions // plans)
+
+
+if __name__ == "__main__":
+   benchmark()
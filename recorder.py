@@ -0,0 +1,196 @@
+import struct
+import time
+import _thread
+
+# Record the robot's sensors many times a second, for tuning behaviours.
+#
+# While recording, the update loop calls sample() every tick. Each sample
+# is packed with struct into a page buffer allocated once, and when the
+# page is full it is written to the recording file in one go. Small
+# writes to flash are slow, so we only ever write whole pages (except
+# the last one, when recording stops).
+#
+# The file starts with a header (magic, version, sample size) followed by
+# the samples, each:
+#
+#   time_ms             ms since recording started
+#   x, y, direction     where the robot thinks it is (steps, degrees)
+#   front, rear         the latest distance readings (cm)
+#   lf_left, lf_centre, lf_right   the line sensors, read at the time
+#   left_motor, right_motor        -1, 0 or 1
+#   left_speed, right_speed        the speed each motor was set to
+#   action              the robot's action, ACTION_* in robot.py
+#
+# The distances are the ones the robot last measured rather than new
+# readings: the ultrasonic sensors take too long to read on every tick.
+#
+# On a computer, read_recording() reads a file into NumPy arrays.
+
+SAMPLE_FORMAT = "<IfffffHHHbbffB"
+SAMPLE_SIZE = struct.calcsize(SAMPLE_FORMAT)
+FILE_HEADER = "<4sBB"
+FILE_MAGIC = b"RREC"
+FILE_VERSION = 1
+HEADER_SIZE = struct.calcsize(FILE_HEADER)
+
+# Flash is written a block of this size at a time
+PAGE_SIZE = 4096
+SAMPLES_PER_PAGE = PAGE_SIZE // SAMPLE_SIZE
+# Stop recording before the file fills the flash
+MAX_FILE_BYTES = 512 * 1024
+RECORDING_EXTENSION = ".rec"
+
+SAMPLE_NAMES = ["time_ms", "x", "y", "direction", "front", "rear", "lf_left", "lf_centre",
+                "lf_right", "left_motor", "right_motor", "left_speed", "right_speed", "action"]
+
+
+class FlightRecorder:
+
+   def __init__(self):
+       self.page = bytearray(SAMPLES_PER_PAGE * SAMPLE_SIZE)
+       self.page_view = memoryview(self.page)
+       # sample() runs in the update thread, start() and stop() in the
+       # network thread
+       self.lock = _thread.allocate_lock()
+       self.recording_file = None
+       self.file_name = ""
+       self.samples = 0
+       self.in_page = 0
+       self.file_bytes = 0
+       self.start_time = 0
+       self.pages_written = 0
+       self.longest_write_ms = 0
+       self.stopped_because = ""
+
+
+   def is_recording(self):
+       return self.recording_file is not None
+
+
+   # Start recording to file_name, replacing any file already there.
+   # Returns False if the file cannot be created.
+   def start(self, file_name):
+       with self.lock:
+           self.close()
+           try:
+               self.recording_file = open(file_name, "wb")
+               self.recording_file.write(struct.pack(FILE_HEADER, FILE_MAGIC, FILE_VERSION, SAMPLE_SIZE))
+           except OSError:
+               self.recording_file = None
+               return False
+           self.file_name = file_name
+           self.samples = 0
+           self.in_page = 0
+           self.file_bytes = HEADER_SIZE
+           self.start_time = time.ticks_ms()
+           self.pages_written = 0
+           self.longest_write_ms = 0
+           self.stopped_because = ""
+           return True
+
+
+   def stop(self):
+       with self.lock:
+           self.close()
+
+
+   # Write what is left in the page and close the file
+   def close(self):
+       if self.recording_file is None:
+           return
+       try:
+           if self.in_page > 0:
+               self.recording_file.write(self.page_view[:self.in_page * SAMPLE_SIZE])
+               self.file_bytes += self.in_page * SAMPLE_SIZE
+           self.recording_file.close()
+       except OSError:
+           self.stopped_because = "unable to write"
+       self.recording_file = None
+       self.in_page = 0
+
+
+   def sample(self, robot, now):
+       if self.recording_file is None:
+           return
+       with self.lock:
+           if self.recording_file is None:
+               return
+           buggy = robot.buggy
+           struct.pack_into(SAMPLE_FORMAT, self.page, self.in_page * SAMPLE_SIZE,
+                            time.ticks_diff(now, self.start_time), robot.x, robot.y,
+                            robot.direction, robot.forward_distance, robot.reverse_distance,
+                            buggy.getRawLFValue("l"), buggy.getRawLFValue("c"),
+                            buggy.getRawLFValue("r"), robot.left_motor, robot.right_motor,
+                            robot.left_speed, robot.right_speed, robot.action)
+           self.samples += 1
+           self.in_page += 1
+           if self.in_page == SAMPLES_PER_PAGE:
+               self.write_page()
+
+
+   def write_page(self):
+       start = time.ticks_ms()
+       try:
+           self.recording_file.write(self.page)
+           self.recording_file.flush()
+       except OSError:
+           self.stopped_because = "unable to write"
+           self.in_page = 0
+           self.recording_file.close()
+           self.recording_file = None
+           return
+       self.longest_write_ms = max(self.longest_write_ms, time.ticks_diff(time.ticks_ms(), start))
+       self.pages_written += 1
+       self.file_bytes += len(self.page)
+       self.in_page = 0
+       if self.file_bytes + len(self.page) > MAX_FILE_BYTES:
+           self.stopped_because = "the file is full"
+           self.close()
+
+
+
+# Read a recording on a computer into a dictionary of NumPy arrays, one
+# for each of the SAMPLE_NAMES. The file is read chunk_samples samples
+# at a time, so long recordings do not need to be in memory twice.
+def read_recording(file_name, chunk_samples=4096):
+   import numpy
+
+   sample_type = numpy.dtype([("time_ms", "<u4"), ("x", "<f4"), ("y", "<f4"),
+                              ("direction", "<f4"), ("front", "<f4"), ("rear", "<f4"),
+                              ("lf_left", "<u2"), ("lf_centre", "<u2"), ("lf_right", "<u2"),
+                              ("left_motor", "i1"), ("right_motor", "i1"),
+                              ("left_speed", "<f4"), ("right_speed", "<f4"), ("action", "u1")])
+   chunks = []
+   with open(file_name, "rb") as recording:
+       magic, version, sample_size = struct.unpack(FILE_HEADER, recording.read(HEADER_SIZE))
+       if magic != FILE_MAGIC or version != FILE_VERSION or sample_size != sample_type.itemsize:
+           raise ValueError("Not a robot recording")
+       while True:
+           data = recording.read(chunk_samples * sample_size)
+           # Leave out a sample cut short if the robot lost power
+           data = data[:len(data) - len(data) % sample_size]
+           if not data:
+               break
+           chunks.append(numpy.frombuffer(data, dtype=sample_type))
+   if chunks:
+       samples = numpy.concatenate(chunks)
+   else:
+       samples = numpy.zeros(0, dtype=sample_type)
+   arrays = {}
+   for name in SAMPLE_NAMES:
+       arrays[name] = samples[name].copy()
+   return arrays
+
+
+# Summarise a recording. Run with "python recorder.py flight.rec".
+if __name__ == "__main__":
+   import sys
+   for file_name in sys.argv[1:]:
+       arrays = read_recording(file_name)
+       count = len(arrays["time_ms"])
+       print(file_name + ":", count, "samples")
+       if count > 1:
+           seconds = (int(arrays["time_ms"][-1]) - int(arrays["time_ms"][0])) / 1000.0
+           print("  %.1f seconds, %.1f samples a second" % (seconds, (count - 1) / max(seconds, 0.001)))
+           for name in SAMPLE_NAMES[1:]:
+               print("  %-12s min %10.2f  max %10.2f" % (name, arrays[name].min(), arrays[name].max()))
@@ -3,11 +3,17 @@ import socket
 import signal
 import sys
 import time
+from drivelink import find_robot, DriveSender, SEND_MS
 
 
 DEFAULT_PORT = 40801
 NETWORK_NAME = "picow"
-SLEEP_DELAY = 0.1
+SLEEP_DELAY = SEND_MS / 1000
+# Stick positions smaller than this are treated as the stick being left alone
+DEAD_ZONE = 0.15
+# Fastest wheel speed for the left (small adjustments) and right sticks
+LEFT_STICK_SPEED = 40
+RIGHT_STICK_SPEED = 80
 
 # Initialize Pygame
 pygame.init()
@@ -34,6 +40,20 @@ def display_help():
    print("")
 
 
+# Turn a stick position into left and right wheel speeds. Up drives
+# forward, left and right turn.
+def stick_to_wheels(stick_x, stick_y, top_speed):
+   if abs(stick_x) < DEAD_ZONE:
+      stick_x = 0.0
+   if abs(stick_y) < DEAD_ZONE:
+      stick_y = 0.0
+   forward = -stick_y * top_speed
+   turn = stick_x * top_speed
+   left = max(-top_speed, min(top_speed, forward + turn))
+   right = max(-top_speed, min(top_speed, forward - turn))
+   return (int(left), int(right))
+
+
 def connect_to_robot(robot_address, robot_port):
    try:
       clientsocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -79,9 +99,28 @@ def button_to_message(the_button):
 def main():
 
   signal.signal(signal.SIGINT, signal_handler)
-  client_socket = connect_to_robot(NETWORK_NAME, DEFAULT_PORT)
+  # Use the address we were given, or listen for the robot's beacon
+  robot_address = NETWORK_NAME
+  robot_port = DEFAULT_PORT
+  drive_port = None
+  if len(sys.argv) > 1:
+     robot_address = sys.argv[1]
+  else:
+     print("Looking for the robot...")
+     found = find_robot()
+     if found:
+        robot_address, robot_port, drive_port = found
+     else:
+        print("No beacon heard, trying", NETWORK_NAME)
+  client_socket = connect_to_robot(robot_address, robot_port)
   if not client_socket:
      sys.exit(1)
+  # Stick positions go over UDP, where a lost packet does not hold up
+  # the ones after it
+  if drive_port:
+     drive_sender = DriveSender(robot_address, drive_port)
+  else:
+     drive_sender = DriveSender(robot_address)
 
   print("Connected to Ron the Robot!\n")
   keep_going = True
@@ -95,7 +134,6 @@ def main():
       controller.init()
 
       while keep_going:
-          send_direction = False
           for event in pygame.event.get():
               if event.type == pygame.QUIT:
                   send_message(client_socket, "exit")
@@ -114,7 +152,6 @@ def main():
                          # client_socket.close()
                          pygame.quit()
                          sys.exit(0)
-                      time.sleep(1)
 
           # Detect axis input
           left_stick_x = controller.get_axis(0)
@@ -122,38 +159,19 @@ def main():
           right_stick_x = controller.get_axis(2)
           right_stick_y = controller.get_axis(3)
 
-          # Determine direction of left stick
-          if left_stick_x < -0.5:
-              send_direction = "turn -45\n"
-          elif left_stick_x > 0.5:
-              send_direction = "turn 45\n"
-
-          if left_stick_y < -0.5:
-              send_direction = "forward 0.4\n"
-          elif left_stick_y > 0.5:
-              send_direction = "reverse 0.4\n"
-
-          # Determine direction of right stick
-          if right_stick_x < -0.5:
-              send_direction = "turn -90\n"
-          elif right_stick_x > 0.5:
-              send_direction = "turn 90\n"
-
-          if right_stick_y < -0.5:
-              send_direction = "forward 0.8\n"
-          elif right_stick_y > 0.5:
-              send_direction = "reverse 0.8\n"
-
-          if send_direction:
-             send_message(client_socket, send_direction)
-             time.sleep(1)
-          else:
-             time.sleep(SLEEP_DELAY)
+          # Go by whichever stick is pushed further. The robot stops
+          # by itself if these stop arriving, so send them all the time.
+          left, right = stick_to_wheels(left_stick_x, left_stick_y, LEFT_STICK_SPEED)
+          if max(abs(right_stick_x), abs(right_stick_y)) > max(abs(left_stick_x), abs(left_stick_y)):
+             left, right = stick_to_wheels(right_stick_x, right_stick_y, RIGHT_STICK_SPEED)
+          drive_sender.send(left, right)
+          time.sleep(SLEEP_DELAY)
 
       # end of while loop
   else:
       print("No joysticks found.")
 
+  drive_sender.close()
   if client_socket:
      client_socket.close()
 
@@ -0,0 +1,139 @@
+# Build machine readable replies without making lots of small strings.
+#
+# The text replies are built up with str() and +, which creates a new
+# string for every piece. That is fine for people reading them, but a
+# program asking for "where" several times a second fills the heap with
+# garbage and sets off the garbage collector at bad moments. A
+# ReplyBuffer writes the reply straight into a bytearray allocated once,
+# either as key=value pairs:
+#
+#     x=1.25 y=-0.5 dir=90.0
+#
+# or as compact JSON:
+#
+#     {"x":1.25,"y":-0.5,"dir":90.0}
+#
+# Keys should be bytes constants, such as b"x", so they are not created
+# each time. Numbers are written a digit at a time.
+
+FORMAT_TEXT = 0
+FORMAT_KEY_VALUE = 1
+FORMAT_JSON = 2
+
+FORMAT_NAMES = ["text", "kv", "json"]
+
+# Powers of ten for the decimal places we allow
+SCALES = (1, 10, 100, 1000)
+
+
+class ReplyBuffer:
+
+   def __init__(self, size=256):
+       self.buffer = bytearray(size)
+       self.view = memoryview(self.buffer)
+       self.style = FORMAT_KEY_VALUE
+       self.length = 0
+       self.first = True
+       self.full = False
+
+
+   def start(self, style):
+       self.style = style
+       self.length = 0
+       self.first = True
+       self.full = False
+       if style == FORMAT_JSON:
+           self.write_byte(123)     # {
+
+
+   # The finished reply, as a memoryview of the buffer
+   def finish(self):
+       if self.style == FORMAT_JSON:
+           self.write_byte(125)     # }
+       self.write_byte(10)          # new line
+       return self.view[:self.length]
+
+
+   def write_byte(self, value):
+       if self.length >= len(self.buffer):
+           self.full = True
+           return
+       self.buffer[self.length] = value
+       self.length += 1
+
+
+   def write_bytes(self, data):
+       for index in range(len(data)):
+           self.write_byte(data[index])
+
+
+   # Write a whole number of at least min_digits digits
+   def write_digits(self, number, min_digits=1):
+       digits = 1
+       rest = number
+       while rest >= 10:
+           rest //= 10
+           digits += 1
+       while digits < min_digits:
+           self.write_byte(48)
+           min_digits -= 1
+       if self.length + digits > len(self.buffer):
+           self.full = True
+           return
+       position = self.length + digits - 1
+       while position >= self.length:
+           self.buffer[position] = 48 + number % 10
+           number //= 10
+           position -= 1
+       self.length += digits
+
+
+   def write_key(self, key):
+       if not self.first:
+           if self.style == FORMAT_JSON:
+               self.write_byte(44)  # ,
+           else:
+               self.write_byte(32)  # space
+       self.first = False
+       if self.style == FORMAT_JSON:
+           self.write_byte(34)      # "
+           self.write_bytes(key)
+           self.write_byte(34)
+           self.write_byte(58)      # :
+       else:
+           self.write_bytes(key)
+           self.write_byte(61)      # =
+
+
+   def add_int(self, key, value):
+       self.write_key(key)
+       if value < 0:
+           self.write_byte(45)      # -
+           value = -value
+       self.write_digits(value)
+
+
+   # Add a number rounded to places decimal places (up to 3)
+   def add_float(self, key, value, places):
+       self.write_key(key)
+       scale = SCALES[places]
+       if value < 0:
+           scaled = int(-value * scale + 0.5)
+           # Do not write -0.00
+           if scaled > 0:
+               self.write_byte(45)
+       else:
+           scaled = int(value * scale + 0.5)
+       self.write_digits(scaled // scale)
+       if places > 0:
+           self.write_byte(46)      # .
+           self.write_digits(scaled % scale, places)
+
+
+   def add_bool(self, key, value):
+       self.write_key(key)
+       if value:
+           self.write_bytes(b"true")
+       else:
+           self.write_bytes(b"false")
+
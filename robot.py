@@ -1,7 +1,17 @@
 import math
 import random
 import time
+import _thread
 import PicoAutonomousRobotics
+from calibration import Calibration, interpolate
+from odometry import Odometry
+from motors import MotorRamp, ramped_time
+from occupancy import OccupancyGrid
+from coverage import CoverageMap
+from planner import GridPlanner
+from trajectory import TrajectoryRecorder
+from drawing import polygon
+import occupancy
 
 # User facing functions
 # reset - reset the robot's position and direction to (0,0) and 0 degrees and turn off lights
@@ -21,6 +31,8 @@ import PicoAutonomousRobotics
 # reverse_steps - move backward a given number of feet (30 cm)
 # spin - spin in place to the left ("l") or right ("r")
 # turn - turn left or right a specified number of degrees
+# get_calibration - return the dictionary of calibration values
+# set_calibration - change a calibration value, it takes effect immediately
 
 
 # Constants
@@ -54,6 +66,90 @@ RIGHT_MOTOR_ADJUST = 1.0
 RIGHT_TURN_MODIFIER = 0.70
 LEFT_TURN_MODIFIER = 0.80
 
+# Estimated rate the buggy turns at. The bot turns a little slower
+# than 360 degrees per second. About 270 at default speed.
+TURN_DEGREES_PER_SECOND = 270
+
+# How quickly the motors speed up and slow down, in percent of full
+# power per second. Ramping the power stops the wheels slipping, so the
+# robot goes where the odometry thinks. 0 switches straight to the new power.
+MOTOR_ACCEL = 200
+MOTOR_DECEL = 300
+
+# The values above are only defaults. The user can change them with the
+# "calibrate" command and the new values are saved to flash, then loaded
+# the next time the robot starts. Each value has a sensible range.
+CALIBRATION_LIMITS = {
+    "default_speed": (1, 100),
+    "left_motor_adjust": (0.5, 2.0),
+    "right_motor_adjust": (0.5, 2.0),
+    "left_turn_modifier": (0.1, 3.0),
+    "right_turn_modifier": (0.1, 3.0),
+    "turn_degrees_per_second": (30, 1000),
+    "motor_accel": (0, 2000),
+    "motor_decel": (0, 2000),
+}
+
+# Turn rate calibration. The robot spins over a straight dark line on the
+# floor and times the centre light sensor crossing it. Each complete circle
+# crosses the line twice. These are the speeds we measure at, how many
+# crossings we wait for and how long (ms) before we give up on finding the line.
+TURN_CALIBRATION_SPEEDS = [40, 60, 80]
+TURN_CALIBRATION_CROSSINGS = 5
+TURN_CALIBRATION_TIMEOUT = 15000
+
+# Distance between the wheels, in steps (30 cm), used to work out
+# how driving the wheels at different speeds turns the buggy.
+WHEEL_BASE = 0.4
+# How far a wheel travels in a second at a speed of 1, in steps.
+# Moving forward one step at speed 50 takes one second.
+STEPS_PER_SECOND_PER_SPEED = 1.0 / 50
+
+# Going to a position. We are there when we are this close (steps).
+GOTO_CLOSE_ENOUGH = 0.2
+# Turn to face the target if we are pointing more than this many degrees away.
+GOTO_TURN_TOLERANCE = 3
+# While driving toward the target, check our course this often (seconds)
+DRIVE_CHECK_TIME = 0.1
+# How much to speed up one wheel and slow the other, per degree off course
+DRIVE_STEER_GAIN = 0.5
+# Stop and plan again if we drift this many degrees off course
+DRIVE_MAX_ERROR = 30
+# While waiting for a motion to finish, check for a stop this often (ms)
+STOP_CHECK_MS = 20
+
+# The map of nearby objects built from the distance sensors. Each cell
+# takes one byte of RAM, so the default 64 x 64 map of 10 cm cells covers
+# 6.4 metres square in 4 KB. MAP_MAX_BYTES is the most we will let the
+# user ask for with the "map size" command, and MAP_MAX_CELL_SIZE the
+# largest cell (cm) it will accept.
+MAP_WIDTH = 64
+MAP_HEIGHT = 64
+MAP_CELL_SIZE = 10
+MAP_MAX_BYTES = 16384
+MAP_MAX_CELL_SIZE = 1000
+
+# When exploring, every map cell within this distance (cm) of the
+# centre of the buggy counts as covered.
+COVERAGE_RADIUS = 10
+
+# Routes for goto and home are planned on a coarser copy of the map, with
+# each planner cell covering PLANNER_SCALE x PLANNER_SCALE map cells. A
+# map cell counts as blocked once it has been seen to hold an object once.
+PLANNER_SCALE = 2
+PLAN_BLOCKED_LEVEL = occupancy.LOG_ODDS_HIT
+
+# How many motions to remember for the trail. Each takes 17 bytes
+# and the oldest are forgotten once the trail is full.
+TRAJECTORY_ROWS = 512
+
+# Drawing. Lines are drawn to within this many steps of their end and
+# we turn to within this many degrees. The pen servo needs a moment
+# (seconds) to move before we start driving.
+DRAW_CLOSE_ENOUGH = 0.02
+DRAW_TURN_TOLERANCE = 1
+PEN_MOVE_TIME = 0.2
+
 # From here on, do not change variables unless you need to make
 # big changes to behaviour/logic.
 
@@ -70,6 +166,10 @@ ACTION_ART = 8
 ACTION_PLAY = 9
 ACTION_TRACK_BLACK = 10
 ACTION_TRACK_WHITE = 11
+ACTION_EXPLORE = 12
+# Short names for the actions, in the same order, for reports
+ACTION_NAMES = ["manual", "wander", "follow", "home", "line black", "line white", "avoid",
+                "goto", "art", "play", "track black", "track white", "explore"]
 
 
 
@@ -86,17 +186,62 @@ class Robot:
    def __init__(self):
        # Init the buggy, make sure it is stopped, quiet, and dark
        self.buggy = PicoAutonomousRobotics.KitronikPicoRobotBuggy()
+       # The motors are driven through this, which ramps their power
+       self.motors = MotorRamp(self.buggy, FORWARD_DIRECTION, REVERSE_DIRECTION)
+       # Load the calibration once, at boot, before we touch the motors
+       self.calibration = Calibration( {
+           "default_speed": DEFAULT_SPEED,
+           "left_motor_adjust": LEFT_MOTOR_ADJUST,
+           "right_motor_adjust": RIGHT_MOTOR_ADJUST,
+           "left_turn_modifier": LEFT_TURN_MODIFIER,
+           "right_turn_modifier": RIGHT_TURN_MODIFIER,
+           "turn_degrees_per_second": TURN_DEGREES_PER_SECOND,
+           "motor_accel": MOTOR_ACCEL,
+           "motor_decel": MOTOR_DECEL,
+           "left_turn_rates": [],
+           "right_turn_rates": [] } )
+       self.calibration.load()
+       self.apply_calibration()
+       # Keep track of where we are from the motor commands
+       self.odometry = Odometry(WHEEL_BASE)
+       self.odometry_ticks = time.ticks_ms()
+       # update_odometry() runs in the update thread and in whichever
+       # thread is driving, so only one may move the odometry on at a time
+       self.odometry_lock = _thread.allocate_lock()
+       self.map = OccupancyGrid(MAP_WIDTH, MAP_HEIGHT, MAP_CELL_SIZE)
+       self.coverage = CoverageMap(MAP_WIDTH, MAP_HEIGHT)
+       self.planner = GridPlanner(self.map, PLANNER_SCALE)
+       self.waypoints = None
+       self.explore_start = time.ticks_ms()
+       self.trajectory = TrajectoryRecorder(TRAJECTORY_ROWS)
+       self.trajectory_start = time.ticks_ms()
+       # Called with the distance when we stop for something in the way
+       self.too_close_callback = None
+       # Set by emergency_stop(). Motions do not start while it is set.
+       self.stop_requested = False
+       # Called while we wait, to look for a stop coming in
+       self.stop_poll = None
+       # Goes up on every halt(), so a long motion can tell it has been
+       # stopped by something else
+       self.halt_count = 0
+       self.speed = 0
+       self.left_motor = 0
+       self.right_motor = 0
        self.halt() 
        self.reset()
        self.buggy.setMeasurementsTo("cm")
 
 
    def reset(self):
-       self.x = 0
-       self.y = 0
+       self.odometry.reset()
+       self.update_odometry()
+       self.map.clear()
+       self.coverage.clear()
+       self.clear_trajectory()
        self.goto_x = 0.0
        self.goto_y = 0.0
-       self.direction = 0
+       self.trip_start = time.ticks_ms()
+       self.last_trip_time = 0.0
        self.get_forward_distance()
        self.get_reverse_distance()
        self.set_light_level(LIGHT_LEVEL)
@@ -110,16 +255,243 @@ class Robot:
        self.action = ACTION_MANUAL
        self.pen_up()
        self.shape_size = 0.1
+       self.last_draw_time = 0.0
        self.detect_red = LIGHT_RED   
        self.detect_yellow = LIGHT_YELLOW
        self.detect_blue = LIGHT_BLUE
 
 
+   # Copy the calibration values into the attributes the motion
+   # functions use, so they do not need to look them up every time.
+   def apply_calibration(self):
+       self.default_speed = int(self.calibration.get("default_speed"))
+       self.left_motor_adjust = self.calibration.get("left_motor_adjust")
+       self.right_motor_adjust = self.calibration.get("right_motor_adjust")
+       self.left_turn_modifier = self.calibration.get("left_turn_modifier")
+       self.right_turn_modifier = self.calibration.get("right_turn_modifier")
+       self.turn_degrees_per_second = self.calibration.get("turn_degrees_per_second")
+       self.left_turn_rates = self.calibration.get("left_turn_rates")
+       self.right_turn_rates = self.calibration.get("right_turn_rates")
+       self.motor_accel = self.calibration.get("motor_accel")
+       self.motor_decel = self.calibration.get("motor_decel")
+       self.motors.set_ramps(self.motor_accel, self.motor_decel)
+
+
+   def get_calibration(self):
+       calibration = {}
+       for name in self.calibration.names():
+           calibration[name] = self.calibration.get(name)
+       return calibration
+
+
+   # Is this a calibration value we can set, within its limits?
+   def valid_calibration(self, name, new_value):
+       if name not in CALIBRATION_LIMITS:
+           return False
+       limits = CALIBRATION_LIMITS[name]
+       return new_value >= limits[0] and new_value <= limits[1]
+
+
+   # Change one calibration value. The new value is used right away
+   # and saved to flash if it is different from the old one. Returns
+   # False if it is not valid, or could not be saved.
+   def set_calibration(self, name, new_value):
+       if not self.valid_calibration(name, new_value):
+           return False
+       status = self.calibration.set(name, new_value)
+       self.apply_calibration()
+       # If the motors are running, use the new adjustments now
+       if self.left_motor != 0 or self.right_motor != 0:
+           self.set_speed(self.speed)
+       return status
+
+
+   # Measure how fast we really turn, left and right, at each of the speeds.
+   # The robot must be sitting over a straight dark line. The results are
+   # saved as speed -> degrees per second tables which "turn" then uses.
+   # Returns a list of (speed, left rate, right rate), with a rate of 0
+   # where the line could not be found.
+   def calibrate_turn(self, speeds=TURN_CALIBRATION_SPEEDS):
+       self.enter_manual_mode()
+       old_speed = self.speed
+       results = []
+       left_table = []
+       right_table = []
+       for speed in speeds:
+           left_rate = self.measure_turn_rate("l", speed)
+           right_rate = self.measure_turn_rate("r", speed)
+           results.append( (speed, left_rate, right_rate) )
+           if left_rate > 0:
+               left_table.append( (float(speed), left_rate) )
+           if right_rate > 0:
+               right_table.append( (float(speed), right_rate) )
+       self.set_speed(old_speed)
+
+       if left_table:
+           self.calibration.set("left_turn_rates", left_table)
+       if right_table:
+           self.calibration.set("right_turn_rates", right_table)
+       self.apply_calibration()
+       return results
+
+
+   # Spin at the given speed and time the centre eye passing over
+   # the line. Returns degrees per second, or 0 if we did not see
+   # enough crossings.
+   def measure_turn_rate(self, left_right, speed):
+       self.set_speed(speed)
+       # Use a little hysteresis so sensor noise on the edge
+       # of the line is not counted as extra crossings.
+       dark_level = self.light_barrier
+       light_level = self.light_barrier * 0.9
+       crossings = []
+
+       self.spin(left_right)
+       # Time the turn once the motor is up to speed
+       self.settle()
+       on_line = self.buggy.getRawLFValue("c") > dark_level
+       start_time = time.ticks_ms()
+       while len(crossings) < TURN_CALIBRATION_CROSSINGS:
+           now = time.ticks_ms()
+           if time.ticks_diff(now, start_time) > TURN_CALIBRATION_TIMEOUT:
+               break
+           level = self.buggy.getRawLFValue("c")
+           if not on_line and level > dark_level:
+               on_line = True
+               crossings.append(now)
+           elif on_line and level < light_level:
+               on_line = False
+       self.halt()
+
+       # Crossing N and crossing N+2 are exactly one circle apart, no
+       # matter where the line passes under the robot.
+       if len(crossings) < 3:
+           return 0.0
+       circles = 0
+       total_time = 0
+       for index in range(len(crossings) - 2):
+           total_time += time.ticks_diff(crossings[index + 2], crossings[index])
+           circles += 1
+       if total_time <= 0:
+           return 0.0
+       return round(360000.0 * circles / total_time, 1)
+
+
+   # How many degrees per second we expect to turn left or right
+   # at the current speed, or the speed given. Uses the measured table
+   # if we have one, otherwise the estimated rate and turn modifiers.
+   def turn_rate(self, left_right, speed=None):
+       if speed is None:
+           speed = self.speed
+       if left_right == "l":
+           table = self.left_turn_rates
+           modifier = self.left_turn_modifier
+       else:
+           table = self.right_turn_rates
+           modifier = self.right_turn_modifier
+       if table:
+           return interpolate(table, speed)
+       return self.turn_degrees_per_second / modifier * speed / self.default_speed
+
+
+   def reset_calibration(self):
+       status = self.calibration.restore_defaults()
+       self.apply_calibration()
+       return status
+
+
    def halt(self):
-       self.buggy.motorOff("l")
-       self.buggy.motorOff("r")
+       was_moving = self.left_motor != 0 or self.right_motor != 0
+       self.motors.motorOff("l")
+       self.motors.motorOff("r")
        self.left_motor = 0
        self.right_motor = 0
+       self.left_speed = 0
+       self.right_speed = 0
+       self.halt_count += 1
+       self.motors_changed()
+       # We finished a motion, add it to the trail
+       if was_moving:
+           elapsed = time.ticks_diff(time.ticks_ms(), self.trajectory_start)
+           self.trajectory.add(elapsed, self.x, self.y, self.direction, self.action)
+
+
+   # Bring our position up to date with however long the motors
+   # have been running since we last checked. ramped_rates are the
+   # wheel rates the motors have just ramped to, if they have.
+   def update_odometry(self, ramped_rates=None):
+       with self.odometry_lock:
+           now = time.ticks_ms()
+           elapsed = time.ticks_diff(now, self.odometry_ticks) / 1000.0
+           self.odometry_ticks = now
+           if ramped_rates:
+               self.odometry.ramp_wheels(elapsed, ramped_rates[0], ramped_rates[1])
+           else:
+               self.odometry.advance(elapsed)
+           self.x, self.y = self.odometry.get_position()
+           self.direction = self.odometry.get_direction()
+       # Remember we have been here
+       column, row = self.map.cell_at(self.x, self.y)
+       self.coverage.mark(column, row, int(COVERAGE_RADIUS / self.map.cell_size_cm + 0.5))
+
+
+   # Called whenever the motors are switched on, off, or change speed.
+   # Finish the movement we were making and tell the odometry how fast
+   # each wheel is going now.
+   def motors_changed(self):
+       self.update_odometry()
+       left_rate = 0.0
+       right_rate = 0.0
+       if self.left_motor != 0 and self.right_motor != 0:
+           left_rate = self.left_speed * STEPS_PER_SECOND_PER_SPEED * self.left_motor
+           right_rate = self.right_speed * STEPS_PER_SECOND_PER_SPEED * self.right_motor
+       elif self.left_motor != 0:
+           # Pivoting on the stopped right wheel: right if the left
+           # wheel goes forward, left if it goes back
+           if self.left_motor > 0:
+               turn = self.turn_rate("r", self.left_speed)
+           else:
+               turn = self.turn_rate("l", self.left_speed)
+           left_rate = math.radians(turn) * WHEEL_BASE * self.left_motor
+       elif self.right_motor != 0:
+           if self.right_motor > 0:
+               turn = self.turn_rate("l", self.right_speed)
+           else:
+               turn = self.turn_rate("r", self.right_speed)
+           right_rate = math.radians(turn) * WHEEL_BASE * self.right_motor
+       # Those are the rates once the motors get there. They ramp
+       # toward them a little at a time, see step_motors().
+       self.motors.set_rates(left_rate, right_rate)
+       with self.odometry_lock:
+           left_rate, right_rate = self.motors.get_rates()
+           self.odometry.set_wheels(0, left_rate, right_rate)
+
+
+   # Move the motors' power a step closer to what it was set to, and
+   # keep the odometry up with them. Called on every tick of the update
+   # loop and while motions wait.
+   def step_motors(self):
+       if self.motors.step(time.ticks_ms()):
+           self.update_odometry(self.motors.get_rates())
+
+
+   # How long to run the motors for a move worked out as if they
+   # changed speed at once. power is the most power either motor gets.
+   def ramped(self, seconds, power):
+       return ramped_time(seconds, power, self.motor_accel, self.motor_decel)
+
+
+   def largest_adjust(self):
+       return max(self.left_motor_adjust, self.right_motor_adjust)
+
+
+   # Wait for the motors to finish slowing down after a halt. Returns
+   # False if we were stopped meanwhile.
+   def settle(self):
+       while self.motors.is_ramping():
+           if not self.wait(STOP_CHECK_MS / 1000):
+               return False
+       return True
 
 
 
@@ -169,7 +541,8 @@ class Robot:
        # This function causes the buggy to wander,
        # create a random shape. This loops as long as we are in art mode.
        self.pen_up()
-       self.wander(self.shape_size)
+       # Move to a part of the floor we have not drawn on yet
+       self.explore(self.shape_size)
        self.pen_down()
        next_shape = random.randint(0, 3)
        if next_shape == 0:
@@ -188,7 +561,8 @@ class Robot:
       # front of us. So wait about half a second, check to see if things
       # are moving away. 
       old_distance = self.forward_distance
-      time.sleep(0.3)
+      if not self.wait(0.3):
+         return False
       new_distance = self.get_forward_distance()
 
       # If they are further away, move forward an amount
@@ -285,27 +659,24 @@ class Robot:
 
    # Turn toward a specified direction. Return true if we turned.
    # Return false if we cannot turn or have finished the turn.
-   def turn_to_direction(self, target_direction):
+   # By default we only turn if we are 15 degrees or more off course
+   # and turn no more than 45 degrees at once.
+   def turn_to_direction(self, target_direction, tolerance=15, max_turn=45):
         # Turn from our current direction to a new
         # direction.
-        if target_direction < 0 or target_direction > 359:
+        if target_direction < 0 or target_direction >= 360:
             return False
 
         # We know which way we want to go, compare that to our current course
-        delta_direction = round(target_direction - self.direction, 0)
-        # Avoid turning 3/4 of a circle right when we could turn left
-        if delta_direction > 180:
-            delta_direction -= 360
-        elif delta_direction < -180:
-            delta_direction += 360
+        delta_direction = round(self.direction_error(target_direction), 0)
 
-        # Only attempt to turn buggy if the different is 15 degrees or more
-        if abs(delta_direction) >= 15:
+        # Only attempt to turn buggy if the difference is large enough
+        if abs(delta_direction) >= tolerance:
             # We are off course, need to turn, but don't spin too much at once
-            if delta_direction > 45:
-                delta_direction = 45
-            elif delta_direction < -45:
-                delta_direction = -45
+            if delta_direction > max_turn:
+                delta_direction = max_turn
+            elif delta_direction < -max_turn:
+                delta_direction = -max_turn
             self.turn(delta_direction)
             return True
 
@@ -313,45 +684,359 @@ class Robot:
         return False
 
 
+   # How many degrees we need to turn to face target_direction,
+   # in the range -180 (left) to 180 (right).
+   def direction_error(self, target_direction):
+        self.update_odometry()
+        delta_direction = target_direction - self.direction
+        # Avoid turning 3/4 of a circle right when we could turn left
+        if delta_direction > 180:
+            delta_direction -= 360
+        elif delta_direction < -180:
+            delta_direction += 360
+        return delta_direction
+
+
+   # Returns the distance (steps) and compass direction (degrees)
+   # from where we are to the point (x, y).
+   def distance_and_bearing(self, x, y):
+        self.update_odometry()
+        relative_x = x - self.x
+        relative_y = y - self.y
+        distance = math.sqrt( (relative_x)**2 + (relative_y)**2 )
+        bearing = math.degrees(math.atan2(relative_x, relative_y))
+        if bearing < 0:
+            bearing += 360
+        if bearing >= 360:
+            bearing -= 360
+        return (distance, bearing)
+
+
    def goto_position(self):
+        if not (math.isfinite(self.goto_x) and math.isfinite(self.goto_y)):
+            # Nowhere we could ever get to
+            self.enter_manual_mode()
+            return
         # Figure out where we are relative to destination
-        relative_x = self.x - self.goto_x
-        relative_y = self.y - self.goto_y
-        distance = math.sqrt( (relative_x)**2 + (relative_y)**2 )
-        distance = round(distance, 2)
+        distance, target_direction = self.distance_and_bearing(self.goto_x, self.goto_y)
 
         # We reached our destination
-        if distance < 0.5:
+        if distance < GOTO_CLOSE_ENOUGH:
+           self.last_trip_time = time.ticks_diff(time.ticks_ms(), self.trip_start) / 1000.0
            self.enter_manual_mode()
            return  
-    
-        # special case for x being close to zero
-        if relative_x < 0.3 and relative_x > -0.3:
-           if relative_y > 0:
-               target_direction = 180
-           else:
-               target_direction = 0
-        # Assume X is not near to zero
-        else:
-           target_direction = math.atan2(relative_x, relative_y)
-           # Convert radians to degrees
-           target_direction = math.degrees(target_direction)
-           # Direction is backwards, flip compass
-           target_direction += 180
-           while target_direction >= 360:
-               target_direction -= 360
-
-        turn_status = self.turn_to_direction(target_direction)
-        # If we turned we can stop processing here for now
-        # and move next time
-        if turn_status:
-            return
 
-        # Pointed in the right direction, move toward target
-        move_status = self.forward_steps(0.4)
-        if not move_status:
-            # Something is in the way, wander for now, try to find target location later.
+        # Plan a route around anything on the map. If we already have a
+        # route we only plan again when something new is in the way.
+        # The map does not reach everywhere; off it we head straight for
+        # the goal.
+        changed = self.planner.update_blocked(PLAN_BLOCKED_LEVEL)
+        if not self.waypoints or (changed and self.planner.route_blocked(self.x, self.y, self.waypoints)):
+            if self.planner.covers(self.x, self.y) and self.planner.covers(self.goto_x, self.goto_y):
+                self.waypoints = self.planner.plan(self.x, self.y, self.goto_x, self.goto_y)
+            else:
+                self.waypoints = [ (self.goto_x, self.goto_y) ]
+        if not self.waypoints:
+            # We do not know a way there, wander for now, try to find target location later.
             self.wander()
+            return
+
+        # Skip any waypoints we have already reached
+        waypoint_x, waypoint_y = self.waypoints[0]
+        distance, target_direction = self.distance_and_bearing(waypoint_x, waypoint_y)
+        while distance < GOTO_CLOSE_ENOUGH and len(self.waypoints) > 1:
+            self.waypoints.pop(0)
+            waypoint_x, waypoint_y = self.waypoints[0]
+            distance, target_direction = self.distance_and_bearing(waypoint_x, waypoint_y)
+
+        # Make one accurate turn to face the waypoint, then drive the
+        # whole way there, correcting our course as we go. If we are
+        # stopped, the map now shows what stopped us and the route is
+        # checked again next time.
+        self.turn_to_direction(target_direction, GOTO_TURN_TOLERANCE, 180)
+        if self.drive_to(waypoint_x, waypoint_y):
+            self.waypoints.pop(0)
+
+
+   # The waypoints we are following to get to a goto or home
+   # position, or None if we do not have a route.
+   def get_route(self):
+        return self.waypoints
+
+
+   # Drive forward to the point (x, y) in one motion. While we drive
+   # we keep checking for obstacles and steer to stay on course.
+   # Returns True if we got there, False if we had to stop early
+   # because something is in the way or we drifted too far off course.
+   def drive_to(self, x, y, close_enough=GOTO_CLOSE_ENOUGH):
+        distance, bearing = self.distance_and_bearing(x, y)
+        if not math.isfinite(distance):
+            # We would never arrive
+            return False
+        if not self.forward():
+            return False
+        # If anything else halts us or changes what we are doing, even
+        # from another thread, the drive is over and the motors are no
+        # longer ours to touch
+        action = self.action
+        halts = self.halt_count
+
+        rate = self.speed * STEPS_PER_SECOND_PER_SPEED
+        arrived = False
+        status = True
+        while not arrived:
+            # Halt early enough that slowing down takes us the rest of
+            # the way. Check again soon, or exactly when that is.
+            time_to_arrive = max(0.0, distance - self.stopping_distance()) / rate
+            if not self.wait(min(DRIVE_CHECK_TIME, time_to_arrive)):
+                return False
+            if self.drive_interrupted(action, halts):
+                return False
+            distance, bearing = self.distance_and_bearing(x, y)
+            error = self.direction_error(bearing)
+            remaining = distance - self.stopping_distance()
+            if abs(error) > 90:
+                # We have just gone past it
+                arrived = True
+            elif remaining < close_enough:
+                # Close enough, carry on to where halting leaves us on it
+                if remaining > 0 and not self.wait(remaining / rate):
+                    return False
+                if self.drive_interrupted(action, halts):
+                    return False
+                arrived = True
+            elif self.check_front_blocked():
+                status = False
+                break
+            elif abs(error) > DRIVE_MAX_ERROR:
+                status = False
+                break
+            else:
+                # Speed up one wheel and slow the other to steer
+                self.steer(error * DRIVE_STEER_GAIN)
+        self.halt()
+        # Let the odometry catch up before the next turn
+        if not self.settle():
+            return False
+        return status
+
+
+   # Has something else halted us, or changed what we are doing, since
+   # a drive started? A halt means the motors are no longer ours. A new
+   # action which has not halted yet has not used them, so we stop them.
+   def drive_interrupted(self, action, halts):
+        if self.halt_count != halts:
+            return True
+        if self.action != action:
+            self.halt()
+            return True
+        return False
+
+
+   # How far we roll on after a halt while the motors slow down, in
+   # steps, going by how fast they are turning now
+   def stopping_distance(self):
+        if self.motor_decel <= 0:
+            return 0.0
+        left_rate, right_rate = self.motors.get_rates()
+        power = max(abs(self.motors.power[0]), abs(self.motors.power[1]))
+        return abs(left_rate + right_rate) / 2 * (power / self.motor_decel) / 2
+
+
+   # Read the front distance sensor while moving. Returns True if
+   # something is too close to keep going.
+   def check_front_blocked(self):
+        front_distance = self.get_forward_distance()
+        self.update_map(True, False)
+        if front_distance <= TOO_CLOSE and front_distance > 1:
+            self.report_too_close(front_distance)
+            return True
+        return False
+
+
+   # callback(distance) is called whenever we stop because
+   # something is too close in front of us
+   def on_too_close(self, callback):
+        self.too_close_callback = callback
+
+
+   def report_too_close(self, distance):
+        if self.too_close_callback:
+            self.too_close_callback(distance)
+
+
+   # callback() is called every STOP_CHECK_MS while a motion waits, so
+   # a stop arriving over the network is seen during the motion
+   def on_stop_poll(self, callback):
+        self.stop_poll = callback
+
+
+   # Stop whatever we are doing straight away. This can be called from
+   # any thread: a motion waiting in wait() notices within STOP_CHECK_MS
+   # and gives up, and no new motion starts until clear_stop().
+   def emergency_stop(self):
+        self.stop_requested = True
+        self.action = ACTION_MANUAL
+        # Off at once, no slowing down
+        self.motors.stop_now()
+        self.halt()
+
+
+   def clear_stop(self):
+        self.stop_requested = False
+
+
+   # Wait for seconds while a motion runs, looking for a stop. Returns
+   # True if we waited the whole time, or False if we were stopped, in
+   # which case the motors are off.
+   def wait(self, seconds):
+        end = time.ticks_add(time.ticks_ms(), int(seconds * 1000))
+        while True:
+            self.step_motors()
+            if self.stop_poll:
+                self.stop_poll()
+            if self.stop_requested:
+                self.halt()
+                return False
+            time_left = time.ticks_diff(end, time.ticks_ms())
+            if time_left <= 0:
+                return True
+            time.sleep_ms(min(time_left, STOP_CHECK_MS))
+
+
+   # Drive both wheels forward, one faster than the other to turn
+   # gently. A positive correction turns right.
+   def steer(self, correction):
+        if self.left_motor == 0 and self.right_motor == 0:
+            # Something halted us, so there is nothing to steer
+            return
+        left_speed = max(0, min(100, self.speed + correction))
+        right_speed = max(0, min(100, self.speed - correction))
+        if left_speed == self.left_speed and right_speed == self.right_speed:
+            return
+        self.left_speed = left_speed
+        self.right_speed = right_speed
+        self.motors.motorOn("r", FORWARD_DIRECTION, right_speed * self.right_motor_adjust)
+        self.motors.motorOn("l", FORWARD_DIRECTION, left_speed * self.left_motor_adjust)
+        self.motors_changed()
+
+
+   # Drive each wheel at its own speed, -100 (full reverse) to 100
+   # (full forward). The motor adjustments are applied here. Returns
+   # False if we have been told to stop.
+   def drive_wheels(self, left_speed, right_speed):
+        if self.stop_requested:
+            self.halt()
+            return False
+        left_speed = max(-100, min(100, left_speed))
+        right_speed = max(-100, min(100, right_speed))
+        for side, wheel_speed, adjust in (("l", left_speed, self.left_motor_adjust),
+                                          ("r", right_speed, self.right_motor_adjust)):
+            if wheel_speed > 0:
+                self.motors.motorOn(side, FORWARD_DIRECTION, wheel_speed * adjust)
+            elif wheel_speed < 0:
+                self.motors.motorOn(side, REVERSE_DIRECTION, -wheel_speed * adjust)
+            else:
+                self.motors.motorOff(side)
+        self.left_motor = (left_speed > 0) - (left_speed < 0)
+        self.right_motor = (right_speed > 0) - (right_speed < 0)
+        self.left_speed = abs(left_speed)
+        self.right_speed = abs(right_speed)
+        self.motors_changed()
+        return True
+
+
+   # Drive along an arc of the given radius (steps), sweeping round the
+   # given number of degrees. Positive degrees curve to the right,
+   # negative to the left. The outside wheel goes faster than the inside
+   # one in proportion to their distance from the centre of the arc, so
+   # the whole arc is one smooth motion. Returns False if we could not
+   # start or something got in the way.
+   def arc(self, radius, degrees):
+        self.halt()
+        if radius <= 0 or degrees == 0 or abs(degrees) > 720:
+            return False
+        if self.forward_distance >= 0 and self.forward_distance <= MIDDLE_DISTANCE:
+            return False
+        if self.speed <= 0:
+            self.set_speed(self.default_speed)
+
+        outer_speed = self.speed * (radius + WHEEL_BASE / 2) / radius
+        inner_speed = self.speed * (radius - WHEEL_BASE / 2) / radius
+        # Do not ask the outside motor for more than full power
+        if outer_speed > 100:
+            inner_speed = inner_speed * 100 / outer_speed
+            outer_speed = 100
+        centre_speed = (outer_speed + inner_speed) / 2
+        if centre_speed <= 0:
+            return False
+        arc_length = radius * math.radians(abs(degrees))
+        time_to_drive = arc_length / (centre_speed * STEPS_PER_SECOND_PER_SPEED)
+        time_to_drive = self.ramped(time_to_drive, outer_speed * self.largest_adjust())
+
+        if degrees > 0:
+            self.drive_wheels(outer_speed, inner_speed)
+        else:
+            self.drive_wheels(inner_speed, outer_speed)
+        start_time = time.ticks_ms()
+        status = True
+        time_left = time_to_drive
+        while time_left > 0:
+            if not self.wait(min(DRIVE_CHECK_TIME, time_left)):
+                status = False
+                break
+            if self.check_front_blocked():
+                status = False
+                break
+            time_left = time_to_drive - time.ticks_diff(time.ticks_ms(), start_time) / 1000.0
+        self.halt()
+        self.settle()
+        return status
+
+
+   # This is called about once a second by the update function.
+   # Head for the nearest part of the floor we have not been to yet.
+   # If distance_to_move is given we only go that far toward it.
+   def explore(self, distance_to_move = 0.0):
+      self.update_odometry()
+      column, row = self.map.cell_at(self.x, self.y)
+      target = self.coverage.nearest_frontier(column, row, self.map)
+      if not target:
+          # We have covered everything we can reach, or we are off
+          # the edge of the map. Move about at random instead.
+          self.wander(distance_to_move)
+          return
+
+      target_x, target_y = self.map.cell_centre(target[0], target[1])
+      distance, bearing = self.distance_and_bearing(target_x, target_y)
+      if distance_to_move >= 0.1 and distance > distance_to_move:
+          rads = math.radians(bearing)
+          target_x = self.x + distance_to_move * math.sin(rads)
+          target_y = self.y + distance_to_move * math.cos(rads)
+      self.turn_to_direction(bearing, GOTO_TURN_TOLERANCE, 180)
+      if not self.drive_to(target_x, target_y):
+          # We cannot get there, do not keep trying the same spot
+          self.coverage.mark(target[0], target[1])
+
+
+   # Returns (percent of the floor we know about which we have covered,
+   # percent per minute since we started exploring, area covered in
+   # square metres).
+   def get_coverage(self):
+      percent = self.coverage.percent_covered(self.map)
+      minutes = time.ticks_diff(time.ticks_ms(), self.explore_start) / 60000.0
+      if minutes > 0:
+          per_minute = percent / minutes
+      else:
+          per_minute = 0.0
+      cell_area = (self.map.cell_size_cm / 100.0) ** 2
+      area = self.coverage.visited_count * cell_area
+      return (percent, per_minute, area)
+
+
+   def clear_coverage(self):
+      self.coverage.clear()
+      self.explore_start = time.ticks_ms()
 
 
    def play(self):
@@ -407,12 +1092,14 @@ class Robot:
        self.forward_distance = front_distance
        rear_distance = self.buggy.getDistance(REVERSE_DIRECTION)
        self.reverse_distance = rear_distance
+       self.update_map(True, True)
        if front_distance <= TOO_CLOSE and front_distance > 1:
            if self.lights_auto:
                 self.set_lights([0,1,2,3], self.buggy.RED)
            # if we are moving forward, check for objects
            if self.left_motor > 0 and self.right_motor > 0:
                self.halt()
+               self.report_too_close(front_distance)
        elif rear_distance <= TOO_CLOSE and rear_distance > 1:
            if self.lights_auto:
                 self.set_lights([0,1,2,3], self.buggy.RED)
@@ -445,9 +1132,43 @@ class Robot:
            self.create_art()
        elif self.action == ACTION_PLAY:
            self.play()
+       elif self.action == ACTION_EXPLORE:
+           self.explore()
 
 
 
+   # Add the latest distance readings to the map. The front sensor
+   # looks the way we are facing, the rear one the opposite way.
+   def update_map(self, use_front, use_rear):
+       self.update_odometry()
+       if use_front:
+           self.map.add_reading(self.x, self.y, self.direction, self.forward_distance)
+       if use_rear:
+           self.map.add_reading(self.x, self.y, self.direction + 180, self.reverse_distance)
+
+
+   def get_map(self):
+       return self.map
+
+
+   # Replace the map with an empty one of a new size. Returns
+   # False if the map would use too much memory.
+   def set_map_size(self, width, height, cell_size):
+       if width < 1 or height < 1 or cell_size < 1 or cell_size > MAP_MAX_CELL_SIZE:
+           return False
+       if width * height > MAP_MAX_BYTES or width > 65535 or height > 65535:
+           return False
+       # Build the new maps before swapping them in, the update
+       # thread might be using the old ones right now.
+       new_map = OccupancyGrid(width, height, cell_size)
+       new_coverage = CoverageMap(width, height)
+       self.map = new_map
+       self.coverage = new_coverage
+       self.planner = GridPlanner(new_map, PLANNER_SCALE)
+       self.waypoints = None
+       return True
+
+
    def set_lights(self, light_array, colour):
        for light in light_array:
            if light >= 0 and light <= 3:
@@ -463,27 +1184,38 @@ class Robot:
        
        
    def get_direction(self):
+       self.update_odometry()
        return self.direction
 
 
    def set_direction(self, new_direction):
        if new_direction >= 0 and new_direction < 360:
-           self.direction = new_direction
+           self.update_odometry()
+           self.odometry.set_direction(new_direction)
+           self.update_odometry()
            return True
        return False
 
 
    def get_coordinates(self):
+       self.update_odometry()
        position = (self.x, self.y)       
        return position
 
 
    def set_coordinates(self, x, y):
-       self.x = x
-       self.y = y
+       self.update_odometry()
+       self.odometry.set_position(x, y)
+       self.update_odometry()
        return True
 
 
+   # How far off our position (steps) and direction (degrees)
+   # might be, one standard deviation.
+   def get_uncertainty(self):
+       return self.odometry.get_uncertainty()
+
+
 
    def get_light_level(self):
        return self.light_level
@@ -505,19 +1237,22 @@ class Robot:
    def set_speed(self, new_speed):
       if new_speed >= 0 and new_speed <= 100:
            self.speed = new_speed
+           self.left_speed = new_speed
+           self.right_speed = new_speed
            # if motors are running, engage them at new speed
            if self.left_motor < 0:
-               self.buggy.motorOn("l", REVERSE_DIRECTION, self.speed * LEFT_MOTOR_ADJUST)
+               self.motors.motorOn("l", REVERSE_DIRECTION, self.speed * self.left_motor_adjust)
            elif self.left_motor > 0:
-               self.buggy.motorOn("l", FORWARD_DIRECTION, self.speed * LEFT_MOTOR_ADJUST)
+               self.motors.motorOn("l", FORWARD_DIRECTION, self.speed * self.left_motor_adjust)
            else:
-               self.buggy.motorOff("l")
+               self.motors.motorOff("l")
            if self.right_motor < 0:
-               self.buggy.motorOn("r", REVERSE_DIRECTION, self.speed * RIGHT_MOTOR_ADJUST)
-           elif self.left_motor > 0:
-               self.buggy.motorOn("r", FORWARD_DIRECTION, self.speed * RIGHT_MOTOR_ADJUST)
+               self.motors.motorOn("r", REVERSE_DIRECTION, self.speed * self.right_motor_adjust)
+           elif self.right_motor > 0:
+               self.motors.motorOn("r", FORWARD_DIRECTION, self.speed * self.right_motor_adjust)
            else:
-               self.buggy.motorOff("r")
+               self.motors.motorOff("r")
+           self.motors_changed()
            return True
       return False
 
@@ -571,6 +1306,8 @@ class Robot:
            return "Creating Art"
        if self.action == ACTION_AVOID:
            return "Avoiding"
+       if self.action == ACTION_EXPLORE:
+           return "Exploring"
        if self.action == ACTION_FOLLOW:
            return "Following"
        if self.action == ACTION_HOME:
@@ -603,6 +1340,8 @@ class Robot:
        self.halt()
        self.goto_x = new_x
        self.goto_y = new_y
+       self.waypoints = None
+       self.trip_start = time.ticks_ms()
 
         
    def enter_home_mode(self):
@@ -610,6 +1349,46 @@ class Robot:
        self.halt()
        self.goto_x = 0.0
        self.goto_y = 0.0
+       self.waypoints = None
+       self.trip_start = time.ticks_ms()
+
+
+   # Drive back over the trail we have recorded, starting from the
+   # oldest position we remember.
+   def enter_replay_mode(self):
+       route = self.trajectory.get_route(GOTO_CLOSE_ENOUGH * 2)
+       if not route:
+           return False
+       self.enter_goto_mode(route[-1][0], route[-1][1])
+       self.waypoints = route
+       return True
+
+
+   # Go home by driving back along the trail, newest position first.
+   # We know that way is clear, so there is no need to plan a route.
+   def enter_retrace_mode(self):
+       route = self.trajectory.get_route(GOTO_CLOSE_ENOUGH * 2)
+       if not route:
+           return False
+       route.reverse()
+       route.append( (0.0, 0.0) )
+       self.enter_home_mode()
+       self.waypoints = route
+       return True
+
+
+   def get_trajectory(self):
+       return self.trajectory
+
+
+   def clear_trajectory(self):
+       self.trajectory.clear()
+       self.trajectory_start = time.ticks_ms()
+
+
+   # How long (seconds) our last goto or home took to get there
+   def get_last_trip_time(self):
+       return self.last_trip_time
  
 
    def enter_line_follow_mode(self, colour):
@@ -650,6 +1429,12 @@ class Robot:
        self.action = ACTION_WANDER
        
 
+   def enter_explore_mode(self):
+       self.halt()
+       self.action = ACTION_EXPLORE
+       self.clear_coverage()
+
+
    def enter_follow_mode(self):
        self.halt()
        self.action = ACTION_FOLLOW
@@ -666,17 +1451,22 @@ class Robot:
 
    def forward(self):
        # check there is nothing in front of us
+       if self.stop_requested:
+           return False
        distance = self.forward_distance
        if distance > MIDDLE_DISTANCE or distance < 0:
            # Check if we need to engage throttle
            if self.speed <= 0:
-              self.set_speed(DEFAULT_SPEED)
+              self.set_speed(self.default_speed)
               
            self.left_motor = 1
            self.right_motor = 1
+           self.left_speed = self.speed
+           self.right_speed = self.speed
            # Logic is reversed to handle broken motor
-           self.buggy.motorOn("r", FORWARD_DIRECTION, self.speed * RIGHT_MOTOR_ADJUST)
-           self.buggy.motorOn("l", FORWARD_DIRECTION, self.speed * LEFT_MOTOR_ADJUST)
+           self.motors.motorOn("r", FORWARD_DIRECTION, self.speed * self.right_motor_adjust)
+           self.motors.motorOn("l", FORWARD_DIRECTION, self.speed * self.left_motor_adjust)
+           self.motors_changed()
            return True
        # we are too close to things in front, stop
        return False
@@ -695,28 +1485,35 @@ class Robot:
           
       # Avoid divide by zero error
       if self.speed <= 0:
-              self.set_speed(DEFAULT_SPEED)
+              self.set_speed(self.default_speed)
       time_to_wait = (100 / self.speed) * number_of_steps
       time_to_wait /= 2.0
+      # Longer or shorter, to make up for the motors ramping up and down
+      time_to_wait = self.ramped(time_to_wait, self.speed * self.largest_adjust())
       status = self.forward()
       if status:
-          time.sleep(time_to_wait)
+          status = self.wait(time_to_wait)
           self.halt()
-          self.update_position(number_of_steps)
+          self.settle()
       return status
 
 
 
    def reverse(self):
+       if self.stop_requested:
+           return False
        distance = self.reverse_distance
        if distance > MIDDLE_DISTANCE or distance < 0:
            if self.speed <= 0:
-               self.set_speed(DEFAULT_SPEED)
+               self.set_speed(self.default_speed)
        
            self.left_motor = -1
            self.right_motor = -1
-           self.buggy.motorOn("r", REVERSE_DIRECTION, self.speed * RIGHT_MOTOR_ADJUST)
-           self.buggy.motorOn("l", REVERSE_DIRECTION, self.speed * LEFT_MOTOR_ADJUST)
+           self.left_speed = self.speed
+           self.right_speed = self.speed
+           self.motors.motorOn("r", REVERSE_DIRECTION, self.speed * self.right_motor_adjust)
+           self.motors.motorOn("l", REVERSE_DIRECTION, self.speed * self.left_motor_adjust)
+           self.motors_changed()
            return True
        # Not enough room to back up, refuse. 
        return False
@@ -733,14 +1530,15 @@ class Robot:
       
       # Avoid divide by zero error
       if self.speed <= 0:
-              self.set_speed(DEFAULT_SPEED)
+              self.set_speed(self.default_speed)
       time_to_wait = (100 / self.speed) * number_of_steps
       time_to_wait /= 2.0
+      time_to_wait = self.ramped(time_to_wait, self.speed * self.largest_adjust())
       status = self.reverse()
       if status:
-          time.sleep(time_to_wait)
+          status = self.wait(time_to_wait)
           self.halt()
-          self.update_position(number_of_steps)
+          self.settle()
       return status
 
 
@@ -748,14 +1546,21 @@ class Robot:
    def spin(self, left_right):
        # Stop before we do the next action
        self.halt()
+       if self.stop_requested:
+           return
        # Spin in place
        if self.speed <= 0:
-           self.set_speed(DEFAULT_SPEED) 
+           self.set_speed(self.default_speed) 
 
+       self.left_speed = self.speed
+       self.right_speed = self.speed
        if left_right == "r":   # spin right
-          self.buggy.motorOn("l", FORWARD_DIRECTION, self.speed * LEFT_MOTOR_ADJUST)
+          self.left_motor = 1
+          self.motors.motorOn("l", FORWARD_DIRECTION, self.speed * self.left_motor_adjust)
        else:    # spin left
-          self.buggy.motorOn("r", FORWARD_DIRECTION, self.speed * RIGHT_MOTOR_ADJUST)
+          self.right_motor = 1
+          self.motors.motorOn("r", FORWARD_DIRECTION, self.speed * self.right_motor_adjust)
+       self.motors_changed()
 
 
    # Work out how long it will take us to turn
@@ -766,50 +1571,72 @@ class Robot:
        self.halt()
        if degrees > 359 or degrees < -359:
           return False
-       # Estimated time it will take to turn us in a circle
-       # The bot turns a little slower than 360 degrees per second.
-       # About 270 at default speed.
-       degrees_per_second = 270
-
-       # Update which way we think we are pointing.
-       self.update_direction(degrees)
-
-       degrees_to_turn = abs(degrees)
-       sleep_time = degrees_to_turn / degrees_per_second
+       # Which way we are pointing is updated by the odometry
+       # once the turn has actually happened.
        if degrees < 0:
-          self.spin("l")
-          sleep_time *= LEFT_TURN_MODIFIER
+          left_right = "l"
        else:
-          self.spin("r")
-          sleep_time *= RIGHT_TURN_MODIFIER
-       time.sleep(sleep_time)
+          left_right = "r"
+       self.spin(left_right)
+       # Estimated time it will take to turn, now spin has set our speed
+       degrees_per_second = self.turn_rate(left_right)
+       sleep_time = abs(degrees) / degrees_per_second
+       # Spinning right drives the left wheel
+       if left_right == "r":
+           sleep_time = self.ramped(sleep_time, self.speed * self.left_motor_adjust)
+       else:
+           sleep_time = self.ramped(sleep_time, self.speed * self.right_motor_adjust)
+       status = self.wait(sleep_time)
        self.halt()
-       return True
+       self.settle()
+       return status
+
+
+   # Draw a list of (pen, x, y) moves, see drawing.py. Positions are
+   # relative to where we are now, with y straight ahead. We only move
+   # the pen when it needs to change and we do not stop between lines
+   # any longer than it takes to turn. If final_direction is given we
+   # turn back to it once we are finished. Returns False if something
+   # got in the way.
+   def draw(self, moves, final_direction=None):
+        start_time = time.ticks_ms()
+        self.update_odometry()
+        origin_x = self.x
+        origin_y = self.y
+        rads = math.radians(self.direction)
+        sin_heading = math.sin(rads)
+        cos_heading = math.cos(rads)
+
+        status = True
+        for pen, move_x, move_y in moves:
+            if pen is not None and pen != (self.pen_position == "down"):
+                if pen:
+                    self.pen_down()
+                else:
+                    self.pen_up()
+                time.sleep(PEN_MOVE_TIME)
+            # Turn the drawing to match the way we were facing
+            x = origin_x + move_x * cos_heading + move_y * sin_heading
+            y = origin_y - move_x * sin_heading + move_y * cos_heading
+            distance, bearing = self.distance_and_bearing(x, y)
+            if distance < DRAW_CLOSE_ENOUGH:
+                continue
+            self.turn_to_direction(bearing, DRAW_TURN_TOLERANCE, 180)
+            if not self.drive_to(x, y, DRAW_CLOSE_ENOUGH):
+                status = False
+                break
+
+        if status and final_direction is not None:
+            self.turn_to_direction(final_direction, DRAW_TURN_TOLERANCE, 180)
+        self.last_draw_time = time.ticks_diff(time.ticks_ms(), start_time) / 1000.0
+        return status
+
+
+   # How long (seconds) the last drawing or shape took
+   def get_last_draw_time(self):
+        return self.last_draw_time
 
 
-   # Figure out which way the buggy is pointing.
-   def update_direction(self, degrees):
-       self.direction += degrees
-       while self.direction < 0:
-          self.direction += 360
-       while self.direction > 360:
-          self.direction -= 360    
-
-
-   # Based on where we were, which way we are pointing
-   # and how fast we are going, try to determine where we
-   # are relative wot where we started.
-   def update_position(self, steps_taken):
-       # Convert direction from degrees to radians
-       rads = math.radians(self.direction)
-       # Calculate new position
-       new_y = self.y + steps_taken * math.cos(rads)
-       new_x = self.x + steps_taken * math.sin(rads)
-       self.x = round(new_x, 2)
-       self.y = round(new_y, 2)
-  
-      
-
    # Draw a circle with our buggy.
    # Assume we are on the parameter and want to draw
    # by moving forward and to the right.
@@ -817,13 +1644,11 @@ class Robot:
        if radius < 0.1 or radius > 10.0:
            return False
         
-       # A hexagon is basically a crude circle with radian-length sides
-       for side in range(6):
-           self.forward_steps(radius)
-           time.sleep(1)
-           self.turn(60)
-           time.sleep(1)
-       return True
+       # Drive all the way round, curving to the right
+       start_time = time.ticks_ms()
+       status = self.arc(radius, 360)
+       self.last_draw_time = time.ticks_diff(time.ticks_ms(), start_time) / 1000.0
+       return status
     
     
    # Draw a square by moving forward and turning right
@@ -832,39 +1657,17 @@ class Robot:
         if line_length < 0.1 or line_length > 10.0:
             return False
     
-        for sides in range(4):
-           self.forward_steps(line_length)
-           time.sleep(1)
-           self.turn(90)
-           time.sleep(1)
-        return True
+        return self.draw(polygon(4, line_length), self.get_direction())
     
     
    # Draw a triangle. Assume we are starting from the bottom-left
    # corner, facing "up". We need to turn, then
    # draw an equaterial triangle.
-   # We break the turns into smaller chunks because
-   # turns become more inaccurate the longer they are.
    def draw_triangle(self, line_length):
         if line_length < 0.1 or line_length > 10.0:
             return False
         
-        self.turn(30)
-        time.sleep(1)
-        self.forward_steps(line_length)
-        time.sleep(1)
-        self.turn(60)
-        self.turn(60)
-        time.sleep(1)
-        self.forward_steps(line_length)
-        time.sleep(1)
-        self.turn(60)
-        self.turn(60)
-        time.sleep(1)
-        self.forward_steps(line_length)
-        time.sleep(1)
-        self.turn(90)
-        return True
+        return self.draw(polygon(3, line_length, 30), self.get_direction())
     
 
 
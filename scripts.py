@@ -0,0 +1,92 @@
+import os
+
+# Store scripts of robot commands on the Pico's flash so they can be run
+# later without a computer sending each command over the network.
+# Each script is a text file in the "scripts" folder with one command per
+# line. Lines which are empty or start with # are ignored when running.
+
+SCRIPT_FOLDER = "scripts"
+MAX_NAME_LENGTH = 20
+
+
+# Script names become file names, so only allow letters, numbers,
+# dashes and underscores.
+def valid_name(name):
+   if not name or len(name) > MAX_NAME_LENGTH:
+       return False
+   for character in name:
+       if not (character.isalpha() or character.isdigit() or character in "-_"):
+           return False
+   return True
+
+
+def script_path(name):
+   return SCRIPT_FOLDER + "/" + name + ".txt"
+
+
+def make_folder():
+   try:
+       os.mkdir(SCRIPT_FOLDER)
+   except OSError:
+       # The folder is already there
+       pass
+
+
+# Save the lines as a script, replacing any script with the same name.
+# We write a temporary file and rename it, so an old script is never
+# left half overwritten.
+def save_script(name, lines):
+   if not valid_name(name):
+       return False
+   make_folder()
+   path = script_path(name)
+   temp_path = path + ".tmp"
+   try:
+       my_file = open(temp_path, "w")
+       for line in lines:
+           my_file.write(line.strip() + "\n")
+       my_file.close()
+       os.rename(temp_path, path)
+   except OSError:
+       return False
+   return True
+
+
+# Returns the commands in the script, or None if there is no such script
+def load_script(name):
+   if not valid_name(name):
+       return None
+   try:
+       my_file = open(script_path(name), "r")
+   except OSError:
+       return None
+   commands = []
+   for line in my_file:
+       line = line.strip()
+       if line and line[0] != "#":
+           commands.append(line)
+   my_file.close()
+   return commands
+
+
+def list_scripts():
+   try:
+       files = os.listdir(SCRIPT_FOLDER)
+   except OSError:
+       return []
+   names = []
+   for file_name in files:
+       if file_name.endswith(".txt"):
+           names.append(file_name[:-4])
+   names.sort()
+   return names
+
+
+def delete_script(name):
+   if not valid_name(name):
+       return False
+   try:
+       os.remove(script_path(name))
+   except OSError:
+       return False
+   return True
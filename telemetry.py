@@ -0,0 +1,191 @@
+import gc
+import struct
+import time
+
+# Push telemetry frames to a client instead of making it poll "status".
+#
+# A client subscribes to some fields and a rate. The update loop then
+# calls is_due() every tick and, when a frame is due, build() packs the
+# latest readings into a buffer allocated once when the subscription
+# starts. Building a frame does not allocate any memory, so frequent
+# frames do not fragment the heap or set off the garbage collector.
+#
+# Frames are binary: a header of magic, frame size, fields and time in
+# ms, followed by the chosen fields in the order they are listed in
+# FIELDS. read_frames() decodes them on a computer.
+
+FRAME_HEADER = "<2sBBI"
+FRAME_MAGIC = b"RT"
+HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
+# Name, bit in the fields byte, and how the values are packed
+FIELDS = [
+    ("pose", 1, "<fff"),        # x, y (steps) and direction (degrees)
+    ("motors", 2, "<bbff"),     # left and right motor (-1, 0, 1) and speeds
+    ("distance", 4, "<ff"),     # front and rear distance in cm
+    ("lf", 8, "<HHH"),          # left, centre and right line sensors
+    ("mode", 16, "<B"),         # the robot's action, ACTION_* in robot.py
+    ("mem", 32, "<IIH"),        # free and used heap bytes, garbage collections
+]
+
+MAX_RATE = 20
+
+
+# Turn "pose,distance" or "all" into the fields byte. Returns
+# 0 if any of the names are not fields we know.
+def parse_fields(text):
+   if text == "all":
+       fields = 0
+       for name, bit, field_format in FIELDS:
+           fields |= bit
+       return fields
+   fields = 0
+   for name in text.split(","):
+       found = False
+       for field_name, bit, field_format in FIELDS:
+           if name == field_name:
+               fields |= bit
+               found = True
+       if not found:
+           return 0
+   return fields
+
+
+def field_names(fields):
+   names = []
+   for name, bit, field_format in FIELDS:
+       if fields & bit:
+           names.append(name)
+   return ",".join(names)
+
+
+def frame_size(fields):
+   size = HEADER_SIZE
+   for name, bit, field_format in FIELDS:
+       if fields & bit:
+           size += struct.calcsize(field_format)
+   return size
+
+
+class Telemetry:
+
+   def __init__(self):
+       self.frame = bytearray(frame_size(255))
+       # A MemoryMonitor, from memory.py, which counts the collections
+       self.memory = None
+       self.stop()
+
+
+   def stop(self):
+       self.destination = None
+       self.fields = 0
+       self.rate = 0
+       self.period_ms = 0
+       self.next_frame = 0
+       self.frame_view = None
+       self.frames_sent = 0
+       self.frames_dropped = 0
+
+
+   # Send the fields rate times a second to destination, which is
+   # whatever the caller uses to send the frames (a socket).
+   def start(self, fields, rate, destination, now):
+       size = frame_size(fields)
+       self.destination = destination
+       self.fields = fields
+       self.rate = rate
+       self.period_ms = 1000 // rate
+       self.next_frame = now
+       # Slicing a memoryview makes a new object, so do it once here
+       self.frame_view = memoryview(self.frame)[:size]
+       self.frames_sent = 0
+       self.frames_dropped = 0
+
+
+   def is_running(self):
+       return self.destination is not None
+
+
+   def is_due(self, now):
+       if self.destination is None:
+           return False
+       return time.ticks_diff(now, self.next_frame) >= 0
+
+
+   # Pack the latest readings into the frame and return it, ready to
+   # send. now is the ticks_ms() time the frame was taken.
+   def build(self, robot, now):
+       # Keep to the rate, but do not try to catch up on frames we missed
+       self.next_frame = time.ticks_add(self.next_frame, self.period_ms)
+       if time.ticks_diff(now, self.next_frame) > 0:
+           self.next_frame = time.ticks_add(now, self.period_ms)
+       frame = self.frame
+       fields = self.fields
+       struct.pack_into(FRAME_HEADER, frame, 0, FRAME_MAGIC, len(self.frame_view), fields, now)
+       offset = HEADER_SIZE
+       if fields & 1:
+           struct.pack_into("<fff", frame, offset, robot.x, robot.y, robot.direction)
+           offset += 12
+       if fields & 2:
+           struct.pack_into("<bbff", frame, offset, robot.left_motor, robot.right_motor,
+                            robot.left_speed, robot.right_speed)
+           offset += 10
+       if fields & 4:
+           struct.pack_into("<ff", frame, offset, robot.forward_distance, robot.reverse_distance)
+           offset += 8
+       if fields & 8:
+           buggy = robot.buggy
+           struct.pack_into("<HHH", frame, offset, buggy.getRawLFValue("l"),
+                            buggy.getRawLFValue("c"), buggy.getRawLFValue("r"))
+           offset += 6
+       if fields & 16:
+           struct.pack_into("<B", frame, offset, robot.action)
+           offset += 1
+       if fields & 32:
+           collections = 0
+           if self.memory:
+               collections = self.memory.collections & 0xFFFF
+           struct.pack_into("<IIH", frame, offset, gc.mem_free(), gc.mem_alloc(), collections)
+           offset += 10
+       self.frames_sent += 1
+       return self.frame_view
+
+
+
+# Decode telemetry frames on a computer. data holds what was received
+# from the robot, which can include ordinary text replies between the
+# frames, which are skipped. Returns a list of dictionaries, one per
+# frame, and the start of a frame which has not all arrived yet, to
+# put in front of the next data received.
+def read_frames(data):
+   frames = []
+   position = 0
+   while True:
+       start = data.find(FRAME_MAGIC, position)
+       if start < 0:
+           # Keep a last byte which could be the start of the magic
+           position = max(position, len(data) - 1)
+           break
+       if start + HEADER_SIZE > len(data):
+           position = start
+           break
+       magic, size, fields, time_ms = struct.unpack_from(FRAME_HEADER, data, start)
+       if size != frame_size(fields):
+           # Not really a frame, just text which happens to look like one
+           position = start + 1
+           continue
+       if start + size > len(data):
+           position = start
+           break
+       frame = {"time_ms": time_ms}
+       offset = start + HEADER_SIZE
+       for name, bit, field_format in FIELDS:
+           if fields & bit:
+               values = struct.unpack_from(field_format, data, offset)
+               offset += struct.calcsize(field_format)
+               if len(values) == 1:
+                   values = values[0]
+               frame[name] = values
+       frames.append(frame)
+       position = start + size
+   return (frames, data[position:])
@@ -0,0 +1,125 @@
+import unittest
+
+from latency import LatencyStats, CommandTimes, bucket_for, bucket_top, BUCKETS, MAX_COUNT
+
+# Tests for latency.py. They run on a computer, not the Pico:
+#
+#   python3 -m unittest test_latency
+
+# Each bucket is about this many times wider than the one before
+BUCKET_GROWTH = 1.5
+
+
+class TestBuckets(unittest.TestCase):
+
+   def test_small_times(self):
+       self.assertEqual(bucket_for(0), 0)
+       self.assertEqual(bucket_for(1), 0)
+       self.assertEqual(bucket_top(0), 1)
+
+
+   def test_time_fits_its_bucket(self):
+       for time_us in range(2, 100000, 13):
+           bucket = bucket_for(time_us)
+           self.assertLessEqual(time_us, bucket_top(bucket), str(time_us))
+           self.assertGreater(time_us, bucket_top(bucket - 1), str(time_us))
+
+
+   def test_buckets_in_order(self):
+       for bucket in range(1, BUCKETS):
+           self.assertGreater(bucket_top(bucket), bucket_top(bucket - 1))
+           self.assertEqual(bucket_for(bucket_top(bucket)), bucket)
+           self.assertEqual(bucket_for(bucket_top(bucket - 1) + 1), bucket)
+
+
+   def test_long_times_go_in_the_last_bucket(self):
+       self.assertEqual(bucket_for(1 << 40), BUCKETS - 1)
+
+
+
+class TestPercentiles(unittest.TestCase):
+
+   def test_no_runs(self):
+       self.assertEqual(CommandTimes().percentile(50), 0)
+
+
+   def test_one_time(self):
+       times = CommandTimes()
+       for run in range(10):
+           times.add(300, False)
+       # The bucket top is above 300, but nothing took longer than 300
+       self.assertEqual(times.percentile(50), 300)
+       self.assertEqual(times.percentile(95), 300)
+
+
+   def test_slow_tail(self):
+       times = CommandTimes()
+       for run in range(90):
+           times.add(100, False)
+       for run in range(10):
+           times.add(10000, False)
+       p50 = times.percentile(50)
+       self.assertGreaterEqual(p50, 100)
+       self.assertLess(p50, 100 * BUCKET_GROWTH)
+       self.assertEqual(times.percentile(95), 10000)
+
+
+   def test_percentile_boundary(self):
+       # 95 fast runs and 5 slow ones: the 95th percentile is still fast
+       times = CommandTimes()
+       for run in range(95):
+           times.add(50, False)
+       for run in range(5):
+           times.add(5000, False)
+       self.assertLess(times.percentile(95), 50 * BUCKET_GROWTH)
+       self.assertGreaterEqual(times.percentile(96), 5000)
+
+
+   def test_within_a_bucket_of_the_real_value(self):
+       times = CommandTimes()
+       samples = []
+       for run in range(1000):
+           time_us = (run * 7919) % 20000 + 1
+           samples.append(time_us)
+           times.add(time_us, False)
+       samples.sort()
+       for percent in (50, 90, 95, 99):
+           real = samples[percent * 10 - 1]
+           found = times.percentile(percent)
+           self.assertGreaterEqual(found, real)
+           self.assertLess(found, real * BUCKET_GROWTH)
+
+
+   def test_counts_stop_at_the_limit(self):
+       times = CommandTimes()
+       bucket = bucket_for(10)
+       times.counts[bucket] = MAX_COUNT
+       times.add(10, False)
+       self.assertEqual(times.counts[bucket], MAX_COUNT)
+       self.assertEqual(times.runs, 1)
+
+
+
+class TestReport(unittest.TestCase):
+
+   def test_slowest_first(self):
+       stats = LatencyStats()
+       stats.add("where", 200, False)
+       stats.add("goto", 90000, True)
+       stats.add("where", 400, False)
+       report = stats.get_report()
+       self.assertEqual([line[0] for line in report], ["goto", "where"])
+       name, runs, errors, p50, p95, longest = report[1]
+       self.assertEqual((runs, errors, longest), (2, 0, 400))
+       self.assertEqual(report[0][2], 1)
+
+
+   def test_reset(self):
+       stats = LatencyStats()
+       stats.add("where", 200, False)
+       stats.reset()
+       self.assertEqual(stats.get_report(), [])
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,183 @@
+import unittest
+
+from occupancy import OccupancyGrid, read_dump, LOG_ODDS_HIT, LOG_ODDS_MISS, LOG_ODDS_MAX, \
+    LOG_ODDS_MIN, MAX_RANGE_CM, CHANGE_HISTORY
+
+# Tests for occupancy.py. They run on a computer, not the Pico:
+#
+#   python3 -m unittest test_occupancy
+#
+# The map is 64 x 64 cells of 30 cm, one step each, so the cell at
+# column 32 + x, row 32 + y holds the position (x, y) in steps.
+
+CENTRE = 32
+
+
+def make_grid():
+   return OccupancyGrid(64, 64, 30)
+
+
+class TestCells(unittest.TestCase):
+
+   def test_cell_at(self):
+       grid = make_grid()
+       self.assertEqual(grid.cell_at(0.0, 0.0), (CENTRE, CENTRE))
+       self.assertEqual(grid.cell_at(2.5, -0.5), (CENTRE + 2, CENTRE - 1))
+       self.assertEqual(grid.cell_at(-40.0, 0.0), (-8, CENTRE))
+
+
+   def test_cell_at_not_a_number(self):
+       grid = make_grid()
+       cell = grid.cell_at(float("nan"), 0.0)
+       self.assertFalse(grid.in_map(cell[0], cell[1]))
+       cell = grid.cell_at(0.0, float("-inf"))
+       self.assertFalse(grid.in_map(cell[0], cell[1]))
+
+
+   def test_centre_is_in_its_cell(self):
+       grid = make_grid()
+       for column, row in ((0, 0), (CENTRE, CENTRE), (63, 10)):
+           x, y = grid.cell_centre(column, row)
+           self.assertEqual(grid.cell_at(x, y), (column, row))
+
+
+   def test_negative_values(self):
+       grid = make_grid()
+       grid.change(1, 2, -30)
+       self.assertEqual(grid.get(1, 2), -30)
+       self.assertTrue(grid.is_free(1, 2))
+
+
+   def test_limits(self):
+       grid = make_grid()
+       for reading in range(20):
+           grid.change(3, 3, 50)
+           grid.change(4, 4, -50)
+       self.assertEqual(grid.get(3, 3), LOG_ODDS_MAX)
+       self.assertEqual(grid.get(4, 4), LOG_ODDS_MIN)
+
+
+   def test_outside_is_unknown(self):
+       grid = make_grid()
+       grid.change(-1, 5, 50)
+       grid.change(64, 5, 50)
+       self.assertEqual(grid.get(-1, 5), 0)
+       self.assertEqual(grid.summary(), (0, 0, 64 * 64))
+
+
+
+class TestReadings(unittest.TestCase):
+
+   def test_object_ahead(self):
+       grid = make_grid()
+       # Facing up, something 3 steps (90 cm) away
+       grid.add_reading(0.0, 0.0, 0, 90)
+       self.assertEqual(grid.get(CENTRE, CENTRE + 3), LOG_ODDS_HIT)
+       self.assertEqual(grid.get(CENTRE, CENTRE + 1), LOG_ODDS_MISS)
+       self.assertEqual(grid.get(CENTRE, CENTRE + 2), LOG_ODDS_MISS)
+       # Not the cell we are standing in, or anything beyond the object
+       self.assertEqual(grid.get(CENTRE, CENTRE), 0)
+       self.assertEqual(grid.get(CENTRE, CENTRE + 4), 0)
+
+
+   def test_object_to_the_right(self):
+       grid = make_grid()
+       grid.add_reading(0.0, 0.0, 90, 60)
+       self.assertEqual(grid.get(CENTRE + 2, CENTRE), LOG_ODDS_HIT)
+       self.assertEqual(grid.get(CENTRE + 1, CENTRE), LOG_ODDS_MISS)
+
+
+   def test_each_cell_once(self):
+       grid = make_grid()
+       grid.add_reading(0.5, 0.5, 45, 150)
+       for value in grid.cells:
+           if value > 127:
+               value -= 256
+           self.assertIn(value, (0, LOG_ODDS_MISS, LOG_ODDS_HIT))
+
+
+   def test_nothing_seen(self):
+       grid = make_grid()
+       grid.add_reading(0.0, 0.0, 180, -1)
+       occupied, free, unknown = grid.summary()
+       self.assertEqual(occupied, 0)
+       steps = MAX_RANGE_CM // 30
+       for distance in range(1, steps):
+           self.assertEqual(grid.get(CENTRE, CENTRE - distance), LOG_ODDS_MISS)
+
+
+   def test_too_far(self):
+       grid = make_grid()
+       grid.add_reading(0.0, 0.0, 0, MAX_RANGE_CM + 100)
+       self.assertEqual(grid.summary()[0], 0)
+
+
+   def test_repeated_readings(self):
+       grid = make_grid()
+       for reading in range(3):
+           grid.add_reading(0.0, 0.0, 0, 90)
+       self.assertTrue(grid.is_occupied(CENTRE, CENTRE + 3))
+       self.assertEqual(grid.get(CENTRE, CENTRE + 1), 3 * LOG_ODDS_MISS)
+
+
+   def test_beam_off_the_map(self):
+       grid = make_grid()
+       grid.add_reading(30.0, 0.0, 90, 150)
+       self.assertEqual(grid.get(63, CENTRE), LOG_ODDS_MISS)
+       self.assertEqual(grid.summary()[0], 0)
+
+
+
+class TestChanges(unittest.TestCase):
+
+   def test_not_watching(self):
+       grid = make_grid()
+       grid.change(5, 5, 50)
+       self.assertEqual(grid.change_count, 0)
+
+
+   def test_crossing_the_level(self):
+       grid = make_grid()
+       grid.watch_level = 20
+       grid.change(5, 6, 10)
+       self.assertEqual(grid.change_count, 0)
+       grid.change(5, 6, 10)
+       self.assertEqual(grid.change_count, 1)
+       self.assertEqual(grid.changes[0], 6 * 64 + 5)
+       grid.change(5, 6, 10)
+       self.assertEqual(grid.change_count, 1)
+       grid.change(5, 6, -20)
+       self.assertEqual(grid.change_count, 2)
+
+
+   def test_clear_misses_everything(self):
+       grid = make_grid()
+       grid.watch_level = 20
+       grid.clear()
+       self.assertGreater(grid.change_count, CHANGE_HISTORY)
+
+
+
+class TestDump(unittest.TestCase):
+
+   def test_round_trip(self):
+       grid = OccupancyGrid(8, 4, 10)
+       grid.change(0, 0, -7)
+       grid.change(7, 3, 99)
+       grid.change(2, 1, 12)
+       data = grid.dump_header() + bytes(grid.dump_cells())
+       width, height, cell_size_cm, rows = read_dump(data)
+       self.assertEqual((width, height, cell_size_cm), (8, 4, 10))
+       self.assertEqual(rows[0][0], -7)
+       self.assertEqual(rows[3][7], 99)
+       self.assertEqual(rows[1][2], 12)
+       self.assertEqual(sum(sum(row) for row in rows), 104)
+
+
+   def test_not_a_map(self):
+       with self.assertRaises(ValueError):
+           read_dump(b"XMAP" + bytes(20))
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,240 @@
+import math
+import unittest
+
+from odometry import Odometry, simulate
+
+# Tests for odometry.py. They run on a computer, not the Pico:
+#
+#   python3 -m unittest test_odometry
+#
+# A wheel base of 0.4 steps makes the numbers come out round: wheel
+# rates 0.4 steps per second apart turn the robot one radian a second.
+
+WHEEL_BASE = 0.4
+# Seeds for the simulated wanders
+SEEDS = range(1, 11)
+# The estimate may drift by at most this fraction of the distance driven
+MAX_DRIFT = 0.05
+
+
+# Drive at these wheel rates for "elapsed" seconds, then stop
+def drive(odometry, left_rate, right_rate, elapsed):
+   odometry.set_wheels(0, left_rate, right_rate)
+   odometry.set_wheels(elapsed, 0.0, 0.0)
+
+
+class TestIntegration(unittest.TestCase):
+
+   def test_straight_up(self):
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 1.0, 1.0, 2.0)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 0.0)
+       self.assertAlmostEqual(y, 2.0)
+       self.assertAlmostEqual(odometry.get_direction(), 0.0)
+       self.assertAlmostEqual(odometry.distance_travelled, 2.0)
+
+
+   def test_straight_right(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(1.0, 1.0, 90)
+       drive(odometry, 1.5, 1.5, 2.0)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 4.0)
+       self.assertAlmostEqual(y, 1.0)
+       self.assertAlmostEqual(odometry.get_direction(), 90.0)
+
+
+   def test_reverse(self):
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, -1.0, -1.0, 3.0)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 0.0)
+       self.assertAlmostEqual(y, -3.0)
+       self.assertAlmostEqual(odometry.get_direction(), 0.0)
+       self.assertAlmostEqual(odometry.distance_travelled, 3.0)
+
+
+   def test_arc_right(self):
+       # One step a second along an arc of radius one step, for a quarter
+       # turn, ends one step up and one to the right, facing right
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 1.2, 0.8, math.pi / 2)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 1.0)
+       self.assertAlmostEqual(y, 1.0)
+       self.assertAlmostEqual(odometry.get_direction(), 90.0)
+
+
+   def test_arc_left(self):
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 0.8, 1.2, math.pi / 2)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, -1.0)
+       self.assertAlmostEqual(y, 1.0)
+       self.assertAlmostEqual(odometry.get_direction(), 270.0)
+
+
+   def test_half_circle(self):
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 1.2, 0.8, math.pi)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 2.0)
+       self.assertAlmostEqual(y, 0.0)
+       self.assertAlmostEqual(odometry.get_direction(), 180.0)
+
+
+   def test_spin_in_place(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(3.0, -2.0, 0)
+       drive(odometry, 0.2, -0.2, math.pi / 4)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 3.0)
+       self.assertAlmostEqual(y, -2.0)
+       self.assertAlmostEqual(odometry.get_direction(), 45.0)
+       self.assertAlmostEqual(odometry.distance_travelled, 0.0)
+
+
+   def test_pivot_on_one_wheel(self):
+       # Only the left wheel turns, so the robot swings round the right
+       # one, which stays put half a wheel base to the right of centre
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 0.4, 0.0, math.pi / 2)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 0.2)
+       self.assertAlmostEqual(y, 0.2)
+       self.assertAlmostEqual(odometry.get_direction(), 90.0)
+
+
+   def test_ramp_covers_the_average(self):
+       # Speeding up steadily from stopped to two steps a second over a
+       # second covers one step
+       odometry = Odometry(WHEEL_BASE)
+       odometry.ramp_wheels(1.0, 2.0, 2.0)
+       x, y = odometry.get_position()
+       self.assertAlmostEqual(x, 0.0)
+       self.assertAlmostEqual(y, 1.0)
+       self.assertEqual(odometry.left_rate, 2.0)
+       self.assertEqual(odometry.right_rate, 2.0)
+
+
+   def test_stopped_does_not_move(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(1.0, 2.0, 30)
+       odometry.advance(5.0)
+       self.assertEqual(odometry.get_position(), (1.0, 2.0))
+       self.assertAlmostEqual(odometry.get_direction(), 30.0)
+
+
+
+class TestHeading(unittest.TestCase):
+
+   def test_negative_pose_wraps(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(0, 0, -90)
+       self.assertAlmostEqual(odometry.get_direction(), 270.0)
+
+
+   def test_large_pose_wraps(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(0, 0, 450)
+       self.assertAlmostEqual(odometry.get_direction(), 90.0)
+
+
+   def test_turning_right_past_north(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(0, 0, 350)
+       drive(odometry, 0.2, -0.2, math.radians(20))
+       self.assertAlmostEqual(odometry.get_direction(), 10.0)
+
+
+   def test_turning_left_past_north(self):
+       odometry = Odometry(WHEEL_BASE)
+       odometry.set_pose(0, 0, 10)
+       drive(odometry, -0.2, 0.2, math.radians(20))
+       self.assertAlmostEqual(odometry.get_direction(), 350.0)
+
+
+   def test_always_in_range(self):
+       # Many small turns either way, several times round
+       odometry = Odometry(WHEEL_BASE)
+       for turn in range(200):
+           if turn % 3 == 0:
+               drive(odometry, -0.2, 0.2, 0.7)
+           else:
+               drive(odometry, 0.2, -0.2, 0.7)
+           direction = odometry.get_direction()
+           self.assertGreaterEqual(direction, 0.0)
+           self.assertLess(direction, 360.0)
+
+
+
+class TestUncertainty(unittest.TestCase):
+
+   def test_starts_at_zero(self):
+       odometry = Odometry(WHEEL_BASE)
+       self.assertEqual(odometry.get_uncertainty(), (0.0, 0.0))
+
+
+   def test_grows_with_distance(self):
+       odometry = Odometry(WHEEL_BASE)
+       previous = (0.0, 0.0)
+       for leg in range(5):
+           drive(odometry, 1.0, 1.0, 1.0)
+           uncertainty = odometry.get_uncertainty()
+           self.assertGreater(uncertainty[0], previous[0])
+           self.assertGreater(uncertainty[1], previous[1])
+           previous = uncertainty
+
+
+   def test_grows_faster_than_distance(self):
+       # Heading error turns into sideways error, so the second of two
+       # equal legs adds more than the first
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 1.0, 1.0, 10.0)
+       first = odometry.position_variance
+       drive(odometry, 1.0, 1.0, 10.0)
+       second = odometry.position_variance - first
+       self.assertGreater(second, first)
+
+
+   def test_spin_grows_heading_only(self):
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 0.2, -0.2, math.pi)
+       position, heading = odometry.get_uncertainty()
+       self.assertEqual(position, 0.0)
+       self.assertGreater(heading, 0.0)
+
+
+   def test_set_pose_starts_again(self):
+       odometry = Odometry(WHEEL_BASE)
+       drive(odometry, 1.2, 0.8, 3.0)
+       odometry.set_pose(0, 0, 0)
+       self.assertEqual(odometry.get_uncertainty(), (0.0, 0.0))
+       self.assertEqual(odometry.distance_travelled, 0.0)
+
+
+
+class TestDrift(unittest.TestCase):
+
+   def test_better_than_the_old_way(self):
+       for seed in SEEDS:
+           old_error, new_error, travelled, uncertainty = simulate(500, seed, verbose=False)
+           self.assertLess(new_error, old_error, "seed " + str(seed))
+
+
+   def test_drift_is_bounded(self):
+       for seed in SEEDS:
+           old_error, new_error, travelled, uncertainty = simulate(500, seed, verbose=False)
+           self.assertGreater(travelled, 0.0)
+           self.assertLess(new_error, travelled * MAX_DRIFT, "seed " + str(seed))
+           # The uncertainty we report should cover the real error
+           self.assertLess(new_error, uncertainty, "seed " + str(seed))
+
+
+   def test_same_seed_same_result(self):
+       self.assertEqual(simulate(100, 7, verbose=False), simulate(100, 7, verbose=False))
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,171 @@
+import random
+import unittest
+
+from occupancy import OccupancyGrid
+from planner import GridPlanner
+
+# Tests for planner.py. They run on a computer, not the Pico:
+#
+#   python3 -m unittest test_planner
+#
+# The map is 64 x 64 cells of 10 cm, so with the planner's 2 x 2 cells
+# each planner cell is 20 cm, two thirds of a step, and the map runs
+# from about -10.7 to 10.7 steps each way.
+
+BLOCKED_LEVEL = 20
+# Enough log-odds to block a cell
+OBJECT = 50
+
+
+def make_planner():
+   grid = OccupancyGrid(64, 64, 10)
+   planner = GridPlanner(grid)
+   planner.update_blocked(BLOCKED_LEVEL)
+   return grid, planner
+
+
+# A wall across the map at map row "row", from map column "first" up to
+# but not including "last"
+def add_wall(grid, row, first, last):
+   for column in range(first, last):
+       grid.change(column, row, OBJECT)
+
+
+class TestPlan(unittest.TestCase):
+
+   def test_open_floor_goes_straight(self):
+       grid, planner = make_planner()
+       route = planner.plan(0.0, 0.0, 0.0, 6.0)
+       self.assertEqual(route, [(0.0, 6.0)])
+
+
+   def test_ends_at_the_goal(self):
+       grid, planner = make_planner()
+       route = planner.plan(-3.0, -4.0, 5.0, 2.5)
+       self.assertEqual(route[-1], (5.0, 2.5))
+       self.assertFalse(planner.route_blocked(-3.0, -4.0, route))
+
+
+   def test_goes_round_a_wall(self):
+       grid, planner = make_planner()
+       # A wall in front with a gap at the right hand end
+       add_wall(grid, 40, 0, 56)
+       planner.update_blocked(BLOCKED_LEVEL)
+       self.assertTrue(planner.line_blocked(0.0, 0.0, 0.0, 6.0))
+       route = planner.plan(0.0, 0.0, 0.0, 6.0)
+       self.assertIsNotNone(route)
+       self.assertGreater(len(route), 1)
+       self.assertEqual(route[-1], (0.0, 6.0))
+       self.assertFalse(planner.route_blocked(0.0, 0.0, route))
+       # It has to go through the gap, to the right of the wall
+       self.assertGreater(max(point[0] for point in route), 7.0)
+
+
+   def test_no_way_through(self):
+       grid, planner = make_planner()
+       add_wall(grid, 40, 0, 64)
+       planner.update_blocked(BLOCKED_LEVEL)
+       self.assertIsNone(planner.plan(0.0, 0.0, 0.0, 6.0))
+
+
+   def test_no_squeezing_past_corners(self):
+       grid, planner = make_planner()
+       # Planner cells (15, 15) and (16, 16) are blocked. They only touch
+       # at a corner, but that still shuts the diagonal between (15, 16)
+       # and (16, 15), so the route has to go round one of them.
+       grid.change(30, 30, OBJECT)
+       grid.change(32, 32, OBJECT)
+       planner.update_blocked(BLOCKED_LEVEL)
+       start = planner.cell_centre(15, 16)
+       goal = planner.cell_centre(16, 15)
+       route = planner.plan(start[0], start[1], goal[0], goal[1])
+       self.assertIsNotNone(route)
+       self.assertGreater(len(route), 1)
+
+
+   def test_start_and_goal_may_be_blocked(self):
+       grid, planner = make_planner()
+       # The robot is standing next to something in its own cell
+       grid.change(32, 32, OBJECT)
+       grid.change(32, 50, OBJECT)
+       planner.update_blocked(BLOCKED_LEVEL)
+       route = planner.plan(0.0, 0.0, 0.0, 6.0)
+       self.assertEqual(route, [(0.0, 6.0)])
+
+
+   def test_off_the_map(self):
+       grid, planner = make_planner()
+       self.assertIsNone(planner.plan(0.0, 0.0, 50.0, 0.0))
+       self.assertIsNone(planner.plan(-50.0, 0.0, 0.0, 0.0))
+       self.assertFalse(planner.covers(50.0, 0.0))
+       self.assertTrue(planner.covers(10.0, -10.0))
+
+
+   def test_not_a_number(self):
+       grid, planner = make_planner()
+       self.assertIsNone(planner.plan(0.0, 0.0, float("nan"), 1.0))
+       self.assertIsNone(planner.plan(0.0, 0.0, 1.0, float("inf")))
+       self.assertFalse(planner.covers(float("nan"), 0.0))
+
+
+
+class TestUpdates(unittest.TestCase):
+
+   def test_nothing_new(self):
+       grid, planner = make_planner()
+       self.assertFalse(planner.update_blocked(BLOCKED_LEVEL))
+
+
+   def test_new_object(self):
+       grid, planner = make_planner()
+       grid.change(40, 40, OBJECT)
+       self.assertTrue(planner.update_blocked(BLOCKED_LEVEL))
+       self.assertTrue(planner.is_blocked(20, 20))
+       self.assertFalse(planner.is_blocked(21, 20))
+
+
+   def test_object_goes_away(self):
+       grid, planner = make_planner()
+       grid.change(40, 40, OBJECT)
+       planner.update_blocked(BLOCKED_LEVEL)
+       grid.change(40, 40, -OBJECT)
+       self.assertTrue(planner.update_blocked(BLOCKED_LEVEL))
+       self.assertFalse(planner.is_blocked(20, 20))
+
+
+   def test_clear_unblocks_everything(self):
+       grid, planner = make_planner()
+       add_wall(grid, 40, 0, 64)
+       planner.update_blocked(BLOCKED_LEVEL)
+       grid.clear()
+       self.assertTrue(planner.update_blocked(BLOCKED_LEVEL))
+       self.assertEqual(sum(planner.blocked), 0)
+
+
+   def test_same_as_starting_again(self):
+       # However the changes come, a little at a time or more than the
+       # map remembers at once, the result is the same as working the
+       # blocked cells out from the whole map
+       random.seed(3)
+       grid, planner = make_planner()
+       for update in range(100):
+           for change in range(random.randint(0, 80)):
+               grid.change(random.randint(0, 63), random.randint(0, 63),
+                           random.choice((-OBJECT, -10, 10, OBJECT)))
+           planner.update_blocked(BLOCKED_LEVEL)
+           fresh = GridPlanner(grid)
+           fresh.update_blocked(BLOCKED_LEVEL)
+           self.assertEqual(planner.blocked, fresh.blocked, "update " + str(update))
+
+
+   def test_new_level_starts_again(self):
+       grid, planner = make_planner()
+       grid.change(40, 40, 10)
+       planner.update_blocked(BLOCKED_LEVEL)
+       self.assertFalse(planner.is_blocked(20, 20))
+       self.assertTrue(planner.update_blocked(5))
+       self.assertTrue(planner.is_blocked(20, 20))
+
+
+if __name__ == "__main__":
+   unittest.main()
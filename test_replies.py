@@ -0,0 +1,138 @@
+import unittest
+
+from replies import ReplyBuffer, FORMAT_KEY_VALUE, FORMAT_JSON
+
+# Tests for replies.py. They run on a computer, not the Pico:
+#
+#   python3 -m unittest test_replies
+
+
+# Build a one number key=value reply and return it as a string
+def float_reply(value, places):
+   reply = ReplyBuffer()
+   reply.start(FORMAT_KEY_VALUE)
+   reply.add_float(b"x", value, places)
+   return bytes(reply.finish()).decode()
+
+
+def int_reply(value):
+   reply = ReplyBuffer()
+   reply.start(FORMAT_KEY_VALUE)
+   reply.add_int(b"n", value)
+   return bytes(reply.finish()).decode()
+
+
+class TestNumbers(unittest.TestCase):
+
+   def test_whole_numbers(self):
+       self.assertEqual(int_reply(0), "n=0\n")
+       self.assertEqual(int_reply(7), "n=7\n")
+       self.assertEqual(int_reply(1230), "n=1230\n")
+
+
+   def test_negative_whole_numbers(self):
+       self.assertEqual(int_reply(-1), "n=-1\n")
+       self.assertEqual(int_reply(-405), "n=-405\n")
+
+
+   def test_decimal_places(self):
+       self.assertEqual(float_reply(1.25, 2), "x=1.25\n")
+       self.assertEqual(float_reply(90.0, 1), "x=90.0\n")
+       self.assertEqual(float_reply(3.7, 0), "x=4\n")
+
+
+   def test_leading_zeros_after_the_point(self):
+       self.assertEqual(float_reply(1.05, 2), "x=1.05\n")
+       self.assertEqual(float_reply(2.004, 3), "x=2.004\n")
+       self.assertEqual(float_reply(0.001, 3), "x=0.001\n")
+
+
+   def test_negative_decimals(self):
+       self.assertEqual(float_reply(-0.5, 1), "x=-0.5\n")
+       self.assertEqual(float_reply(-12.345, 2), "x=-12.35\n")
+
+
+   def test_rounding_carries(self):
+       # Rounding up the last place carries into the whole number
+       self.assertEqual(float_reply(0.999, 2), "x=1.00\n")
+       self.assertEqual(float_reply(9.9996, 3), "x=10.000\n")
+       self.assertEqual(float_reply(-1.996, 2), "x=-2.00\n")
+
+
+   def test_no_negative_zero(self):
+       self.assertEqual(float_reply(-0.001, 2), "x=0.00\n")
+       self.assertEqual(float_reply(-0.0, 1), "x=0.0\n")
+       self.assertEqual(float_reply(-0.4, 0), "x=0\n")
+
+
+   def test_matches_round(self):
+       for hundredths in range(-2000, 2000, 7):
+           value = hundredths / 100.0 + 0.001
+           self.assertEqual(float_reply(value, 2), "x=" + "%.2f" % value + "\n")
+
+
+
+class TestLayout(unittest.TestCase):
+
+   def test_key_value(self):
+       reply = ReplyBuffer()
+       reply.start(FORMAT_KEY_VALUE)
+       reply.add_float(b"x", 1.25, 2)
+       reply.add_int(b"n", -3)
+       reply.add_bool(b"ok", True)
+       self.assertEqual(bytes(reply.finish()), b"x=1.25 n=-3 ok=true\n")
+
+
+   def test_json(self):
+       reply = ReplyBuffer()
+       reply.start(FORMAT_JSON)
+       reply.add_float(b"x", 1.25, 2)
+       reply.add_float(b"y", -0.5, 1)
+       reply.add_bool(b"ok", False)
+       self.assertEqual(bytes(reply.finish()), b'{"x":1.25,"y":-0.5,"ok":false}\n')
+
+
+   def test_start_again(self):
+       reply = ReplyBuffer()
+       reply.start(FORMAT_JSON)
+       reply.add_int(b"n", 12345)
+       reply.finish()
+       reply.start(FORMAT_KEY_VALUE)
+       reply.add_int(b"n", 1)
+       self.assertEqual(bytes(reply.finish()), b"n=1\n")
+       self.assertFalse(reply.full)
+
+
+
+class TestFull(unittest.TestCase):
+
+   def test_stops_at_the_end(self):
+       reply = ReplyBuffer(8)
+       reply.start(FORMAT_KEY_VALUE)
+       reply.add_int(b"n", 1)
+       self.assertFalse(reply.full)
+       reply.add_int(b"m", 123456789)
+       self.assertTrue(reply.full)
+       self.assertLessEqual(len(reply.finish()), 8)
+
+
+   def test_number_not_cut_in_half(self):
+       # A number which does not fit is left out, not half written
+       reply = ReplyBuffer(6)
+       reply.start(FORMAT_KEY_VALUE)
+       reply.add_int(b"n", 12345)
+       self.assertTrue(reply.full)
+       self.assertEqual(bytes(reply.view[:reply.length]), b"n=")
+
+
+   def test_json_full(self):
+       reply = ReplyBuffer(16)
+       reply.start(FORMAT_JSON)
+       for key in (b"a", b"b", b"c", b"d"):
+           reply.add_float(key, 123.456, 3)
+       self.assertTrue(reply.full)
+       self.assertEqual(len(reply.finish()), 16)
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,159 @@
+import time
+import unittest
+
+from telemetry import Telemetry, parse_fields, field_names, frame_size, read_frames, \
+    HEADER_SIZE, MAX_RATE
+
+# Tests for telemetry.py. They run on a computer, not the Pico:
+#
+#   python3 -m unittest test_telemetry
+#
+# The computer's time module has no ticks, so give it simple ones.
+# The "mem" field needs MicroPython's gc, so it is left out here.
+
+if not hasattr(time, "ticks_add"):
+   time.ticks_add = lambda ticks, delta: ticks + delta
+   time.ticks_diff = lambda new, old: new - old
+
+ALL_BUT_MEM = parse_fields("pose,motors,distance,lf,mode")
+
+
+# Just enough of the robot and buggy for build()
+class FakeBuggy:
+
+   def getRawLFValue(self, side):
+       return {"l": 100, "c": 2000, "r": 65535}[side]
+
+
+class FakeRobot:
+
+   def __init__(self):
+       self.x = 1.5
+       self.y = -2.25
+       self.direction = 90.0
+       self.left_motor = 1
+       self.right_motor = -1
+       self.left_speed = 40.0
+       self.right_speed = 35.5
+       self.forward_distance = 12.5
+       self.reverse_distance = -1.0
+       self.action = 3
+       self.buggy = FakeBuggy()
+
+
+def build_frame(fields, now=1000):
+   sender = Telemetry()
+   sender.start(fields, 10, object(), 0)
+   return bytes(sender.build(FakeRobot(), now))
+
+
+class TestFields(unittest.TestCase):
+
+   def test_names(self):
+       self.assertEqual(parse_fields("pose"), 1)
+       self.assertEqual(parse_fields("pose,mode"), 17)
+       self.assertEqual(field_names(parse_fields("mode,pose")), "pose,mode")
+       self.assertEqual(field_names(parse_fields("all")), "pose,motors,distance,lf,mode,mem")
+
+
+   def test_unknown_name(self):
+       self.assertEqual(parse_fields("pose,speed"), 0)
+       self.assertEqual(parse_fields(""), 0)
+
+
+   def test_sizes(self):
+       self.assertEqual(frame_size(0), HEADER_SIZE)
+       self.assertEqual(frame_size(parse_fields("pose")), HEADER_SIZE + 12)
+       self.assertEqual(frame_size(parse_fields("all")), HEADER_SIZE + 47)
+
+
+
+class TestRoundTrip(unittest.TestCase):
+
+   def test_every_field(self):
+       frames, rest = read_frames(build_frame(ALL_BUT_MEM, 1234))
+       self.assertEqual(len(frames), 1)
+       self.assertEqual(rest, b"")
+       frame = frames[0]
+       self.assertEqual(frame["time_ms"], 1234)
+       self.assertEqual(frame["pose"], (1.5, -2.25, 90.0))
+       self.assertEqual(frame["motors"], (1, -1, 40.0, 35.5))
+       self.assertEqual(frame["distance"], (12.5, -1.0))
+       self.assertEqual(frame["lf"], (100, 2000, 65535))
+       self.assertEqual(frame["mode"], 3)
+       self.assertNotIn("mem", frame)
+
+
+   def test_one_field(self):
+       frames, rest = read_frames(build_frame(parse_fields("mode")))
+       self.assertEqual(frames, [{"time_ms": 1000, "mode": 3}])
+
+
+   def test_between_text_replies(self):
+       data = b"Sending pose 10 times a second.\n" + build_frame(1) + b"Ron is ready> " + build_frame(16)
+       frames, rest = read_frames(data)
+       self.assertEqual(len(frames), 2)
+       self.assertIn("pose", frames[0])
+       self.assertEqual(frames[1]["mode"], 3)
+
+
+   def test_text_that_looks_like_a_frame(self):
+       data = b"RTFM please\n" + build_frame(1)
+       frames, rest = read_frames(data)
+       self.assertEqual(len(frames), 1)
+       self.assertIn("pose", frames[0])
+
+
+   def test_split_frames(self):
+       # However the frames are cut up on the way, they all come out
+       data = build_frame(ALL_BUT_MEM, 1) + b"ok\n" + build_frame(ALL_BUT_MEM, 2)
+       for cut in range(len(data) + 1):
+           frames, rest = read_frames(data[:cut])
+           more, rest = read_frames(rest + data[cut:])
+           times = [frame["time_ms"] for frame in frames + more]
+           self.assertEqual(times, [1, 2], "cut at " + str(cut))
+           self.assertEqual(rest, b"")
+
+
+   def test_keeps_the_start_of_the_magic(self):
+       frames, rest = read_frames(b"text R")
+       self.assertEqual(frames, [])
+       self.assertEqual(rest, b"R")
+
+
+
+class TestTiming(unittest.TestCase):
+
+   def test_rate(self):
+       sender = Telemetry()
+       sender.start(1, MAX_RATE, object(), 0)
+       sent = 0
+       for now in range(0, 1000, 10):
+           if sender.is_due(now):
+               sender.build(FakeRobot(), now)
+               sent += 1
+       self.assertEqual(sent, MAX_RATE)
+       self.assertEqual(sender.frames_sent, MAX_RATE)
+
+
+   def test_no_catching_up(self):
+       sender = Telemetry()
+       sender.start(1, 10, object(), 0)
+       sender.build(FakeRobot(), 0)
+       # A long pause, then only one frame is due
+       self.assertTrue(sender.is_due(1000))
+       sender.build(FakeRobot(), 1000)
+       self.assertFalse(sender.is_due(1050))
+       self.assertTrue(sender.is_due(1100))
+
+
+   def test_stop(self):
+       sender = Telemetry()
+       sender.start(1, 10, object(), 0)
+       sender.stop()
+       self.assertFalse(sender.is_running())
+       self.assertFalse(sender.is_due(1000))
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,95 @@
+import struct
+
+# Record where the robot has been.
+#
+# Each time the robot finishes a motion we store one row: the time in ms
+# since recording started, the x and y position (steps), the direction
+# (degrees) and the action (mode) the robot was in. Rows are packed into a
+# single bytearray used as a ring buffer, so when it is full the oldest
+# rows are overwritten and the memory used never grows.
+
+ROW_FORMAT = "<IfffB"
+ROW_SIZE = struct.calcsize(ROW_FORMAT)
+
+# Header written in front of a trajectory dump: magic, version, row count
+DUMP_HEADER = "<4sBH"
+DUMP_MAGIC = b"RTRK"
+DUMP_VERSION = 1
+
+
+class TrajectoryRecorder:
+
+   def __init__(self, capacity=512):
+       self.capacity = capacity
+       self.rows = bytearray(capacity * ROW_SIZE)
+       self.clear()
+
+
+   def clear(self):
+       # Where the next row goes, and how many rows we hold
+       self.next_row = 0
+       self.count = 0
+
+
+   def add(self, time_ms, x, y, direction, action):
+       struct.pack_into(ROW_FORMAT, self.rows, self.next_row * ROW_SIZE,
+                        time_ms, x, y, direction, action)
+       self.next_row = (self.next_row + 1) % self.capacity
+       if self.count < self.capacity:
+           self.count += 1
+
+
+   # Row number 0 is the oldest we still have
+   def get(self, row):
+       first = (self.next_row - self.count) % self.capacity
+       index = (first + row) % self.capacity
+       return struct.unpack_from(ROW_FORMAT, self.rows, index * ROW_SIZE)
+
+
+   def get_last(self):
+       if self.count == 0:
+           return None
+       return self.get(self.count - 1)
+
+
+   # The positions we passed through, oldest first, leaving out any
+   # closer than min_distance steps to the one before. Turning on the
+   # spot records a row without moving, so this removes those too.
+   def get_route(self, min_distance):
+       route = []
+       for row in range(self.count):
+           time_ms, x, y, direction, action = self.get(row)
+           if route:
+               last_x, last_y = route[-1]
+               if (x - last_x) ** 2 + (y - last_y) ** 2 < min_distance * min_distance:
+                   continue
+           route.append( (x, y) )
+       return route
+
+
+   def dump_header(self):
+       return struct.pack(DUMP_HEADER, DUMP_MAGIC, DUMP_VERSION, self.count)
+
+
+   # The rows, oldest first, as one or two memoryviews of the buffer
+   # (two when the ring has wrapped around).
+   def dump_rows(self):
+       rows = memoryview(self.rows)
+       first = (self.next_row - self.count) % self.capacity
+       if first + self.count <= self.capacity:
+           return [rows[first * ROW_SIZE:(first + self.count) * ROW_SIZE]]
+       return [rows[first * ROW_SIZE:], rows[:self.next_row * ROW_SIZE]]
+
+
+
+# Read a trajectory dump on a computer. Returns a list of
+# (time_ms, x, y, direction, action) rows, oldest first.
+def read_dump(data):
+   header_size = struct.calcsize(DUMP_HEADER)
+   magic, version, count = struct.unpack(DUMP_HEADER, data[:header_size])
+   if magic != DUMP_MAGIC or version != DUMP_VERSION:
+       raise ValueError("Not a robot trajectory")
+   rows = []
+   for row in range(count):
+       rows.append(struct.unpack_from(ROW_FORMAT, data, header_size + row * ROW_SIZE))
+   return rows
@@ -0,0 +1,215 @@
+import network
+import time
+
+# Join the wireless network as quickly as we can.
+#
+# start_join() only starts the join; the Wi-Fi chip carries on by itself
+# while the rest of the robot is set up, then wait_for_join() waits for
+# it to finish. Two things make joining faster:
+#
+# A fixed IP address, if network.txt gives one, so we do not have to
+# wait for DHCP.
+#
+# The access point (BSSID) and channel we joined last time, kept in
+# CACHE_FILE, so the chip does not have to scan every channel for the
+# network. If the cached access point cannot be reached we forget it
+# and join the usual way.
+#
+# Once we have joined, a LinkWatchdog keeps an eye on the connection.
+# When it drops, reconnect() keeps trying to join again, waiting longer
+# after each failure, and records how long each outage lasted.
+
+CACHE_FILE = "wifi_cache.txt"
+STATUS_CONNECTED = 3
+JOIN_TIMEOUT_MS = 10000
+# Give up on the cached access point sooner than that
+CACHED_JOIN_TIMEOUT_MS = 5000
+POLL_MS = 50
+# Wait this long after the first failed reconnect, doubling each time
+BACKOFF_START_MS = 1000
+BACKOFF_MAX_MS = 60000
+# How many outages we remember
+OUTAGE_HISTORY = 8
+
+
+# Returns (bssid, channel) from the last time we joined network_name,
+# or None
+def load_cache(network_name):
+   try:
+       cache_file = open(CACHE_FILE, "r")
+       lines = cache_file.readlines()
+       cache_file.close()
+   except OSError:
+       return None
+   if len(lines) < 3 or lines[0].strip() != network_name:
+       return None
+   try:
+       bssid = bytes.fromhex(lines[1].strip())
+       channel = int(lines[2])
+   except ValueError:
+       return None
+   return (bssid, channel)
+
+
+def forget_cache():
+   try:
+       import os
+       os.remove(CACHE_FILE)
+   except OSError:
+       pass
+
+
+# Find the access point we joined and remember it for next time. This
+# scans for networks, which takes a couple of seconds, so it is only
+# done when there is no cache. Returns True if we saved it.
+def save_cache(wlan, network_name):
+   if load_cache(network_name):
+       return True
+   best = None
+   try:
+       for found in wlan.scan():
+           ssid, bssid, channel, rssi = found[0], found[1], found[2], found[3]
+           if ssid.decode() == network_name and (best is None or rssi > best[2]):
+               best = (bssid, channel, rssi)
+   except OSError:
+       return False
+   if best is None:
+       return False
+   try:
+       cache_file = open(CACHE_FILE, "w")
+       cache_file.write(network_name + "\n" + best[0].hex() + "\n" + str(best[1]) + "\n")
+       cache_file.close()
+   except OSError:
+       return False
+   return True
+
+
+# Start joining the network and return straight away. credentials is
+# [name, password] with an optional third item, the fixed address as
+# (ip, netmask, gateway, dns). Returns the WLAN and whether the cached
+# access point was used.
+def start_join(credentials, use_cache=True):
+   wlan = network.WLAN(network.STA_IF)
+   wlan.active(True)
+   if len(credentials) > 2:
+       wlan.ifconfig(credentials[2])
+   cache = None
+   if use_cache:
+       cache = load_cache(credentials[0])
+   if cache:
+       try:
+           wlan.connect(credentials[0], credentials[1], bssid=cache[0], channel=cache[1])
+           return (wlan, True)
+       except TypeError:
+           # This firmware cannot be told where the access point is
+           pass
+   wlan.connect(credentials[0], credentials[1])
+   return (wlan, False)
+
+
+# Wait for the join to finish. Returns our IP address, or False if
+# the join failed or took longer than timeout_ms.
+def wait_for_join(wlan, timeout_ms):
+   start = time.ticks_ms()
+   while time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+       status = wlan.status()
+       if status == STATUS_CONNECTED:
+           return wlan.ifconfig()[0]
+       if status < 0:
+           # Wrong password, no access point, or the join failed
+           return False
+       time.sleep_ms(POLL_MS)
+   return False
+
+
+# Wait for a join started by start_join(). If the cached access point
+# did not work, forget it and try once more the usual way. Returns the
+# WLAN, our IP address (or False) and whether the cache was used.
+def finish_join(wlan, credentials, used_cache):
+   if used_cache:
+       address = wait_for_join(wlan, CACHED_JOIN_TIMEOUT_MS)
+       if address:
+           return (wlan, address, True)
+       forget_cache()
+       wlan.disconnect()
+       wlan, used_cache = start_join(credentials, False)
+   return (wlan, wait_for_join(wlan, JOIN_TIMEOUT_MS), False)
+
+
+
+class LinkWatchdog:
+
+   def __init__(self, wlan, credentials):
+       self.wlan = wlan
+       self.credentials = credentials
+       self.address = False
+       self.down_since = None
+       self.outages = 0
+       # Tries to rejoin, during this outage and ever
+       self.tries = 0
+       self.attempts = 0
+       self.total_downtime_ms = 0
+       self.outage_start = []
+       self.outage_length = []
+
+
+   def link_up(self):
+       return self.wlan.status() == STATUS_CONNECTED
+
+
+   # Call when we notice the network has gone. now is from ticks_ms().
+   def link_lost(self, now):
+       if self.down_since is None:
+           self.down_since = now
+           self.outages += 1
+           self.tries = 0
+           self.address = False
+
+
+   # Keep trying to join until we manage it, waiting longer after each
+   # failure. Returns our IP address.
+   def reconnect(self):
+       backoff = BACKOFF_START_MS
+       while True:
+           self.tries += 1
+           self.attempts += 1
+           try:
+               self.wlan.disconnect()
+           except OSError:
+               pass
+           wlan, used_cache = start_join(self.credentials)
+           self.wlan, address, used_cache = finish_join(wlan, self.credentials, used_cache)
+           if address:
+               self.link_found(address, time.ticks_ms())
+               return address
+           time.sleep_ms(backoff)
+           backoff = min(backoff * 2, BACKOFF_MAX_MS)
+
+
+   def link_found(self, address, now):
+       self.address = address
+       if self.down_since is None:
+           return
+       length = time.ticks_diff(now, self.down_since)
+       self.total_downtime_ms += length
+       self.outage_start.append(self.down_since)
+       self.outage_length.append(length)
+       if len(self.outage_start) > OUTAGE_HISTORY:
+           self.outage_start.pop(0)
+           self.outage_length.pop(0)
+       self.down_since = None
+
+
+   # How long the last outage lasted, in ms
+   def last_outage(self):
+       if not self.outage_length:
+           return 0
+       return self.outage_length[-1]
+
+
+   # The outages we remember, newest first, as (start ticks_ms, length ms)
+   def get_outages(self):
+       outages = []
+       for index in range(len(self.outage_start) - 1, -1, -1):
+           outages.append( (self.outage_start[index], self.outage_length[index]) )
+       return outages